@@ -0,0 +1,140 @@
+"""Compares dependency builds between two settings: with and without a fast linker, or with and without DWARF.
+
+Every build starts from a clean target directory, modes are alternated on every round. Besides whole builds, link
+steps are timed on their own: rustc reports the time spent running the linker with -Z time-passes, enabled on any
+toolchain through RUSTC_BOOTSTRAP. Link times add up every binary, dylib and build script of a build.
+
+Usage examples:
+ python bench.py -t stable-x86_64-unknown-linux-gnu rand_chacha-0.3.1 sha2-0.10.8
+ python bench.py -t stable-x86_64-unknown-linux-gnu --linker rust-lld --rounds 5 ./my_crate/Cargo.toml
+ python bench.py -t stable-x86_64-unknown-linux-gnu --compare lean rand_chacha-0.3.1
+"""
+import argparse
+import logging
+import os
+import pathlib
+import re
+import shutil
+import statistics
+import time
+from typing import Dict, List, Tuple
+
+import toml
+from rustbininfo import Crate
+
+from rustbinsign.linker import FAST_LINKERS
+from rustbinsign.logger import get_log_handler, logger
+from rustbinsign.model import CompilationCtx
+from rustbinsign.toolchain import ToolchainFactory
+from rustbinsign.util import get_default_dest_dir
+
+
+# rustc writes its timings along the build output, to the build logs
+TIME_PASSES_ENV = {"RUSTC_BOOTSTRAP": "1", "RUSTFLAGS": f"{os.environ.get('RUSTFLAGS', '')} -Z time-passes".strip()}
+RUN_LINKER = re.compile(rb"^time:\s+([0-9.]+);.*\srun_linker\s*$", re.MULTILINE)
+
+
+def log_sizes() -> Dict[pathlib.Path, int]:
+    return {path: path.stat().st_size for path in get_default_dest_dir().joinpath("logs").glob("*.log")}
+
+
+def link_time(sizes: Dict[pathlib.Path, int]) -> float:
+    """Time spent running the linker, according to what the build logs got since `sizes` were taken."""
+    total = 0.0
+    for path in get_default_dest_dir().joinpath("logs").glob("*.log"):
+        with open(path, "rb") as f:
+            f.seek(sizes.get(path, 0))
+            total += sum(float(seconds) for seconds in RUN_LINKER.findall(f.read()))
+
+    return total
+
+
+def clean(project_name: str, project_path: pathlib.Path):
+    shutil.rmtree(project_path.joinpath("target"), ignore_errors=True)
+    for target_dir in get_default_dest_dir().joinpath("targets").glob(f"{project_name}-*"):
+        shutil.rmtree(target_dir, ignore_errors=True)
+
+
+def build(tc, target: str) -> Tuple[float, float, int]:
+    """Returns the build time, the link time and the total size of the artifacts."""
+    ctx = CompilationCtx(env=TIME_PASSES_ENV)
+    sizes = log_sizes()
+    if target.endswith("Cargo.toml"):
+        toml_path = pathlib.Path(target).resolve()
+        package = toml.load(toml_path)["package"]
+        crate = Crate(name=package["name"], version=package["version"], fast_load=True)
+        clean(toml_path.parent.name, toml_path.parent)
+
+        start = time.perf_counter()
+        libs: List[pathlib.Path] = tc._get_compilation_unit(ctx).compile_crate(crate, toml_path)
+
+    else:
+        crate = Crate.from_depstring(target)
+        clean(f"{crate.name}-{crate.version}", get_default_dest_dir().joinpath(f"{crate.name}-{crate.version}"))
+
+        start = time.perf_counter()
+        libs = tc.compile_remote_crate(crate, ctx)
+
+    duration = time.perf_counter() - start
+    return duration, link_time(sizes), sum(lib.stat().st_size for lib in libs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-t", "--toolchain", required=True)
+    parser.add_argument("--compare", choices=["linker", "lean"], default="linker")
+    parser.add_argument("--linker", choices=["auto", *FAST_LINKERS], default="auto")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--vendor-dir", type=pathlib.Path, default=None)
+    parser.add_argument("targets", nargs="+", help="Crates (name-version) or paths to Cargo.toml files")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.ERROR)
+    logger.addHandler(get_log_handler())
+
+    def toolchain():
+        return ToolchainFactory.from_target_triplet(args.toolchain).set_vendor_dir(args.vendor_dir)
+
+    if args.compare == "linker":
+        toolchains = {"default": toolchain().install(), args.linker: toolchain().set_fast_linker(args.linker).install()}
+
+    else:
+        toolchains = {"dwarf": toolchain().install(), "lean": toolchain().set_lean_artifacts(True).install()}
+
+    base, other = toolchains
+    print(
+        f"{'target':40} {base + ' (s)':>12} {other + ' (s)':>12} {'saved':>7} {base + ' link (s)':>14}"
+        f" {other + ' link (s)':>14} {'saved':>7} {base + ' (MiB)':>12} {other + ' (MiB)':>12}"
+    )
+    totals = {mode: [0.0, 0.0, 0] for mode in toolchains}
+
+    def row(name: str, values: Dict[str, List]) -> str:
+        (build_base, link_base, size_base), (build_other, link_other, size_other) = values[base], values[other]
+        return (
+            f"{name:40} {build_base:12.2f} {build_other:12.2f} {1 - build_other / build_base:7.1%}"
+            f" {link_base:14.2f} {link_other:14.2f} {1 - link_other / link_base if link_base else 0:7.1%}"
+            f" {size_base / 2**20:12.1f} {size_other / 2**20:12.1f}"
+        )
+
+    for target in args.targets:
+        timings = {mode: ([], []) for mode in toolchains}
+        sizes = {}
+        for _ in range(args.rounds):
+            for mode, tc in toolchains.items():
+                duration, linking, sizes[mode] = build(tc, target)
+                timings[mode][0].append(duration)
+                timings[mode][1].append(linking)
+
+        medians = {
+            mode: [statistics.median(durations), statistics.median(links), sizes[mode]]
+            for mode, (durations, links) in timings.items()
+        }
+        for mode in toolchains:
+            totals[mode] = [total + value for total, value in zip(totals[mode], medians[mode])]
+
+        print(row(target, medians))
+
+    print(row("total", totals))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+import pathlib
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from .logger import logger as log
+
+
+# DW_EH_PE_* value formats: size and struct format
+FIXED_ENCODINGS = {0x02: (2, "H"), 0x03: (4, "I"), 0x04: (8, "Q"), 0x0A: (2, "h"), 0x0B: (4, "i"), 0x0C: (8, "q")}
+
+
+class Section(BaseModel):
+    name: str
+    address: int  # Virtual address, relative to the image base for PE files
+    offset: int  # File offset
+    size: int
+
+
+class Function(BaseModel):
+    start: int  # Same base as Section.address
+    size: int
+    has_landing_pads: bool  # The function has an LSDA (ELF) or an exception handler (PE)
+
+
+def _uleb128(data: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def _sleb128(data: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            if byte & 0x40:
+                result -= 1 << shift
+            return result, pos
+
+
+class Binary:
+    """Just enough of an ELF or PE parser to list sections and functions, from unwind information.
+
+    Usage example:
+    >>> binary = Binary(pathlib.Path("./target"))
+    >>> functions = binary.functions()
+    """
+
+    path: pathlib.Path
+    data: bytes
+    kind: str  # "elf" or "pe"
+    is_64: bool
+    sections: Dict[str, Section]
+
+    def __init__(self, path: pathlib.Path):
+        self.path = pathlib.Path(path)
+        self.data = self.path.read_bytes()
+        self.sections = {}
+
+        if self.data[:4] == b"\x7fELF":
+            self.kind = "elf"
+            self._parse_elf()
+
+        elif self.data[:2] == b"MZ":
+            self.kind = "pe"
+            self._parse_pe()
+
+        else:
+            raise ValueError(f"{path} is neither an ELF nor a PE file")
+
+    def _parse_elf(self):
+        self.is_64 = self.data[4] == 2
+        if self.data[5] != 1:
+            raise ValueError("Big endian ELF files are not supported")
+
+        if self.is_64:
+            shoff, = struct.unpack_from("<Q", self.data, 0x28)
+            shentsize, shnum, shstrndx = struct.unpack_from("<HHH", self.data, 0x3A)
+            header = "<IIQQQQ"
+
+        else:
+            shoff, = struct.unpack_from("<I", self.data, 0x20)
+            shentsize, shnum, shstrndx = struct.unpack_from("<HHH", self.data, 0x2E)
+            header = "<IIIIII"
+
+        headers = [struct.unpack_from(header, self.data, shoff + i * shentsize) for i in range(shnum)]
+        if not headers:
+            return
+
+        strtab_offset = headers[shstrndx][4]
+        for name_offset, section_type, _, address, offset, size in headers:
+            name_end = self.data.index(b"\x00", strtab_offset + name_offset)
+            name = self.data[strtab_offset + name_offset : name_end].decode(errors="replace")
+            if section_type == 8:  # SHT_NOBITS
+                size = 0
+
+            self.sections[name] = Section(name=name, address=address, offset=offset, size=size)
+
+    def _parse_pe(self):
+        pe_offset, = struct.unpack_from("<I", self.data, 0x3C)
+        if self.data[pe_offset : pe_offset + 4] != b"PE\x00\x00":
+            raise ValueError("Invalid PE signature")
+
+        section_count, = struct.unpack_from("<H", self.data, pe_offset + 6)
+        self._coff_symbols = struct.unpack_from("<II", self.data, pe_offset + 12)  # Offset and count, from MinGW
+        optional_size, = struct.unpack_from("<H", self.data, pe_offset + 20)
+        magic, = struct.unpack_from("<H", self.data, pe_offset + 24)
+        self.is_64 = magic == 0x20B
+
+        table = pe_offset + 24 + optional_size
+        for i in range(section_count):
+            raw_name, virtual_size, address, raw_size, offset = struct.unpack_from("<8sIIII", self.data, table + i * 40)
+            name = raw_name.rstrip(b"\x00").decode(errors="replace")
+            self.sections[name] = Section(name=name, address=address, offset=offset, size=min(virtual_size, raw_size))
+
+    def section_data(self, name: str) -> Optional[bytes]:
+        section = self.sections.get(name)
+        if section is None:
+            return None
+
+        return self.data[section.offset : section.offset + section.size]
+
+    def read(self, address: int, size: int) -> bytes:
+        """Reads bytes at a virtual address (an RVA for PE files)."""
+        for section in self.sections.values():
+            if section.size and section.address <= address < section.address + section.size:
+                offset = section.offset + address - section.address
+                return self.data[offset : offset + min(size, section.address + section.size - address)]
+
+        return b""
+
+    def functions(self) -> List[Function]:
+        """Functions described by unwind information: .eh_frame for ELF files, .pdata for 64-bit PE files."""
+        try:
+            if self.kind == "elf":
+                return self._eh_frame_functions()
+
+            if self.is_64:
+                return self._pdata_functions()
+
+        except (struct.error, IndexError) as exc:
+            log.debug(f"Could not parse unwind information of {self.path}: {exc}")
+
+        return []
+
+    def function_symbols(self) -> Dict[str, int]:
+        """Names of the functions defined in the symbol table, with their size (0 when unknown)."""
+        try:
+            if self.kind == "elf":
+                return self._elf_function_symbols()
+
+            return self._coff_function_symbols()
+
+        except (struct.error, IndexError, ValueError) as exc:
+            log.debug(f"Could not parse symbols of {self.path}: {exc}")
+
+        return {}
+
+    def _elf_function_symbols(self) -> Dict[str, int]:
+        symtab, strtab = self.section_data(".symtab"), self.section_data(".strtab")
+        if not symtab or strtab is None:
+            return {}
+
+        symbols = {}
+        if self.is_64:
+            entries = ((n, i, sh, sz) for n, i, _, sh, _, sz in struct.iter_unpack("<IBBHQQ", symtab))
+        else:
+            entries = ((n, i, sh, sz) for n, _, sz, i, _, sh in struct.iter_unpack("<IIIBBH", symtab))
+
+        for name_offset, info, section_index, size in entries:
+            if info & 0x0F == 2 and section_index != 0:  # Defined STT_FUNC
+                name = strtab[name_offset : strtab.index(b"\x00", name_offset)].decode(errors="replace")
+                symbols[name] = size
+
+        return symbols
+
+    def _coff_function_symbols(self) -> Dict[str, int]:
+        offset, count = getattr(self, "_coff_symbols", (0, 0))
+        if not offset or not count:
+            return {}
+
+        strings = offset + count * 18
+        symbols = {}
+        index = 0
+        while index < count:
+            raw_name, _, section_number, kind, _, aux = struct.unpack_from("<8sIhHBB", self.data, offset + index * 18)
+            if kind == 0x20 and section_number > 0:  # Function
+                if raw_name[:4] == b"\x00\x00\x00\x00":
+                    name_offset = strings + struct.unpack_from("<I", raw_name, 4)[0]
+                    raw_name = self.data[name_offset : self.data.index(b"\x00", name_offset)]
+
+                symbols[raw_name.rstrip(b"\x00").decode(errors="replace")] = 0
+
+            index += 1 + aux
+
+        return symbols
+
+    def _read_encoded(self, data: bytes, pos: int, encoding: int, base: int) -> Tuple[int, int]:
+        field = pos
+        fmt = encoding & 0x0F
+        if fmt == 0x00:
+            value, = struct.unpack_from("<Q" if self.is_64 else "<I", data, pos)
+            pos += 8 if self.is_64 else 4
+
+        elif fmt in (0x01, 0x09):
+            value, pos = (_uleb128 if fmt == 0x01 else _sleb128)(data, pos)
+
+        else:
+            size, code = FIXED_ENCODINGS[fmt]
+            value, = struct.unpack_from(f"<{code}", data, pos)
+            pos += size
+
+        if encoding & 0x70 == 0x10:  # pcrel
+            value += base + field
+
+        return value, pos
+
+    def _eh_frame_functions(self) -> List[Function]:
+        section = self.sections.get(".eh_frame")
+        if section is None:
+            return []
+
+        data = self.section_data(".eh_frame")
+        cies = {}  # offset -> (fde encoding, lsda encoding or None, has augmentation data)
+        functions = []
+        pos = 0
+
+        while pos + 4 <= len(data):
+            length, = struct.unpack_from("<I", data, pos)
+            if length == 0:
+                break
+
+            header = 4
+            if length == 0xFFFFFFFF:
+                length, = struct.unpack_from("<Q", data, pos + 4)
+                header = 12
+
+            record = pos + header
+            end = record + length
+            cie_id, = struct.unpack_from("<I", data, record)
+
+            if cie_id == 0:
+                cie_pos = record + 5
+                augmentation = data[cie_pos : data.index(b"\x00", cie_pos)].decode(errors="replace")
+                cie_pos += len(augmentation) + 1
+                _, cie_pos = _uleb128(data, cie_pos)  # Code alignment
+                _, cie_pos = _sleb128(data, cie_pos)  # Data alignment
+                if data[record + 4] == 1:
+                    cie_pos += 1
+                else:
+                    _, cie_pos = _uleb128(data, cie_pos)
+
+                fde_encoding, lsda_encoding = 0x00, None
+                if augmentation.startswith("z"):
+                    _, cie_pos = _uleb128(data, cie_pos)
+                    for char in augmentation[1:]:
+                        if char == "R":
+                            fde_encoding = data[cie_pos]
+                            cie_pos += 1
+
+                        elif char == "L":
+                            lsda_encoding = data[cie_pos]
+                            cie_pos += 1
+
+                        elif char == "P":
+                            personality_encoding = data[cie_pos]
+                            _, cie_pos = self._read_encoded(data, cie_pos + 1, personality_encoding, section.address)
+
+                cies[pos] = (fde_encoding, lsda_encoding, augmentation.startswith("z"))
+
+            else:
+                fde_encoding, lsda_encoding, has_data = cies.get(record - cie_id, (0x00, None, False))
+                fde_pos = record + 4
+                start, fde_pos = self._read_encoded(data, fde_pos, fde_encoding, section.address)
+                size, fde_pos = self._read_encoded(data, fde_pos, fde_encoding & 0x0F, 0)
+                lsda = 0
+                if has_data:
+                    _, fde_pos = _uleb128(data, fde_pos)
+                    if lsda_encoding is not None and lsda_encoding != 0xFF:  # DW_EH_PE_omit
+                        # Raw value, without applying pcrel: a null pointer means no LSDA
+                        lsda, fde_pos = self._read_encoded(data, fde_pos, lsda_encoding & 0x0F, 0)
+
+                if size:
+                    functions.append(Function(start=start & 0xFFFFFFFFFFFFFFFF, size=size, has_landing_pads=lsda != 0))
+
+            pos = end
+
+        return functions
+
+    def _pdata_functions(self) -> List[Function]:
+        data = self.section_data(".pdata")
+        if data is None:
+            return []
+
+        functions = []
+        for begin, end, unwind in struct.iter_unpack("<III", data[: len(data) - len(data) % 12]):
+            if begin == 0 and end == 0:
+                break
+
+            flags = self.read(unwind, 1)
+            has_handler = bool(flags) and bool((flags[0] >> 3) & 0x1)  # UNW_FLAG_EHANDLER
+            functions.append(Function(start=begin, size=end - begin, has_landing_pads=has_handler))
+
+        return functions
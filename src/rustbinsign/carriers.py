@@ -0,0 +1,99 @@
+import json
+import os
+import pathlib
+import shutil
+from typing import Callable, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from .compilation import template_hash
+from .logger import logger as log
+from .util import file_lock, get_default_dest_dir
+
+
+class CarrierEntry(BaseModel):
+    files: List[str]  # Names of the cached binaries, in the entry's directory
+
+
+def carrier_key(version: str, triple: Optional[str], profile: str, template: Optional[Dict]) -> str:
+    return f"{version}-{triple or 'host'}-{profile}-{template_hash(template)[:16]}"
+
+
+class CarrierCache:
+    """Persistent store of the binaries built to carry a toolchain's standard library, for toolchains whose
+    stdlib is only linked statically (musl, MinGW).
+
+    They only depend on the toolchain, profile and template, so each of them is built once per host.
+
+    Usage example:
+    >>> cache = get_carrier_cache()
+    >>> key = carrier_key("1.70.0", "x86_64-unknown-linux-musl", "release", template)
+    >>> binaries = cache.get_or_build(key, lambda: tc.compile_remote_crate(hello_world, ctx))
+    """
+
+    root: pathlib.Path
+
+    def __init__(self, root: Optional[pathlib.Path] = None):
+        self.root = pathlib.Path(root) if root is not None else get_default_dest_dir().joinpath("stdlib_carriers")
+
+    def get(self, key: str) -> Optional[List[pathlib.Path]]:
+        entry_dir = self.root.joinpath(key)
+        try:
+            entry = CarrierEntry(**json.loads(entry_dir.joinpath("entry.json").read_text(encoding="utf-8")))
+
+        except (FileNotFoundError, ValueError):
+            return None
+
+        files = [entry_dir.joinpath(name) for name in entry.files]
+        if not files or not all(path.exists() for path in files):
+            return None
+
+        return files
+
+    def record(self, key: str, files: List[pathlib.Path]) -> List[pathlib.Path]:
+        """Copies `files` into the cache, and returns their cached copies."""
+        entry_dir = self.root.joinpath(key)
+        tmp_dir = self.root.joinpath(f".{key}.{os.getpid()}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+
+        names = list(dict.fromkeys(pathlib.Path(path).name for path in files))
+        for path in files:
+            shutil.copy2(path, tmp_dir.joinpath(pathlib.Path(path).name))
+
+        tmp_dir.joinpath("entry.json").write_text(CarrierEntry(files=names).model_dump_json(), encoding="utf-8")
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+        return [entry_dir.joinpath(name) for name in names]
+
+    def get_or_build(self, key: str, build: Callable[[], List[pathlib.Path]]) -> List[pathlib.Path]:
+        """Cached binaries of `key`, built with `build` on a miss.
+
+        Concurrent runs building the same key wait for the first one, then use its binaries.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            log.debug(f"Using cached stdlib carriers {key}")
+            return cached
+
+        with file_lock(self.root.joinpath(f"{key}.lock")):
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+
+            files = build()
+            if not files:  # Nothing to remember, the next run tries again
+                return files
+
+            return self.record(key, files)
+
+
+_default_cache: Optional[CarrierCache] = None
+
+
+def get_carrier_cache() -> CarrierCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = CarrierCache()
+
+    return _default_cache
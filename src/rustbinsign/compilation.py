@@ -1,19 +1,34 @@
 import copy
 import glob
+import hashlib
+import json
 import os
 import pathlib
+import re
+import shutil
 import subprocess
+import tempfile
 from pathlib import Path
-from typing import Callable, Dict, List, Optional, Text
+from typing import Dict, List, Optional, Text, Tuple
 
-import requests
+import semver
 import toml
-from git import Repo, TagReference
 from rustbininfo import Crate
 
+from .crate_store import get_crate_store, unneeded_paths
+from .diagnostics import Diagnosis, Strategy, classify
+from .exceptions import CompilationError
+from .extras import ExtrasCache, built_executables, built_package_files, extra_targets, function_patterns
+from .failure_cache import FailureCache, failure_key
+from .features import infer_features
+from .git_mirror import checkout_crate
+from .lockfile import lock_updates, locked_packages, rewrite_lock
 from .logger import logger as log
-from .model import CompilationCtx
-from .util import extract_tarfile, get_default_dest_dir
+from .model import BuildPlan, CompilationCtx
+from .patches import CratePatch, apply_patches, get_patch_db, patches_hash
+from .process import run_process
+from .util import (EXTRACTION_MARKER, extract_tarfile, file_lock, get_default_dest_dir, replace_file,
+                   template_hash)
 
 
 # Unused yet
@@ -41,23 +56,39 @@ def remove_line(filepath: Path, line_nb: int):
                 f.write(line)
 
 
-def remove_no_std_from_project(project_path: Path):
+NO_STD_CFG_ATTR = re.compile(r"#!\[cfg_attr\(.*,\s*no_std\s*\)\]")
+
+
+def _is_no_std_line(line: str, include_cfg_attr: bool) -> bool:
+    line = line.strip()
+    return line == "#![no_std]" or (include_cfg_attr and NO_STD_CFG_ATTR.fullmatch(line) is not None)
+
+
+def remove_no_std_from_project(project_path: Path, include_cfg_attr: bool = False):
+    """Removes `#![no_std]` attributes, and conditional ones too if `include_cfg_attr` is set.
+
+    Files are replaced rather than rewritten in place, so hard links to them (see get_overlay) are left untouched.
+    """
     for dirpath, dirnames, filenames in os.walk(project_path):
         for filename in [f for f in filenames if f.endswith(".rs")]:
-            filepath = os.path.join(dirpath, filename)
-            content = open(filepath, "r", encoding="utf-8").read()
-            for i, line in enumerate(content.splitlines()):
-                if line.strip() == "#![no_std]":
-                    remove_line(filepath, i)
+            filepath = Path(dirpath).joinpath(filename)
+            lines = open(filepath, "r", encoding="utf-8", errors="ignore").readlines()
+            kept = [line for line in lines if not _is_no_std_line(line, include_cfg_attr)]
+            if len(kept) != len(lines):
+                replace_file(filepath, "".join(kept))
 
 
-def setup_toml(toml_path: Path, template: Dict):
-    custom_options = template
+TEMPLATE_MARKER = ".rustbinsign-template"
 
-    # We want to be able to compile projects as shared libraries, which can have debug symbols and are easy to parse
-    remove_no_std_from_project(toml_path.parent)
-    crate_toml = toml.load(toml_path)
-    crate_toml |= custom_options
+
+def _marker_content(digest: str, toml_path: Path) -> str:
+    return f"{digest} {hashlib.sha256(toml_path.read_bytes()).hexdigest()}"
+
+
+def merge_template(crate_toml: Dict, template: Dict) -> Dict:
+    """Returns the manifest obtained by applying `template` over `crate_toml`, without modifying either."""
+    crate_toml = copy.deepcopy(crate_toml)
+    crate_toml |= copy.deepcopy(template)
     safe_iter = copy.deepcopy(crate_toml)
 
     # Handle corner cases where some fields of Toml would have \" , which seems to be broken when using python's toml lib
@@ -70,7 +101,319 @@ def setup_toml(toml_path: Path, template: Dict):
                     del crate_toml[x][k]
                     crate_toml[x][k.replace("\\", "")] = val
 
-    toml.dump(crate_toml, open(toml_path, "w", encoding="utf-8"))
+    return crate_toml
+
+
+def setup_toml(toml_path: Path, template: Dict) -> bool:
+    """Applies a template on a Cargo.toml.
+
+    The manifest is only rewritten when its content actually changes, so that cargo's fingerprints
+    stay valid and a rerun with the same template is a no-op build.
+
+    Returns:
+        bool: True if Cargo.toml was rewritten
+    """
+    marker = toml_path.parent.joinpath(TEMPLATE_MARKER)
+    digest = template_hash(template)
+
+    # The marker records both the template and the manifest it produced, so a manifest restored or edited
+    # since then is patched again.
+    if marker.exists() and marker.read_text(encoding="utf-8") == _marker_content(digest, toml_path):
+        log.debug(f"Template {digest[:12]} already applied to {toml_path}")
+        return False
+
+    # We want to be able to compile projects as shared libraries, which can have debug symbols and are easy to parse
+    remove_no_std_from_project(toml_path.parent)
+    crate_toml = toml.load(toml_path)
+    merged_toml = merge_template(crate_toml, template)
+    changed = merged_toml != crate_toml
+
+    if changed:
+        replace_file(toml_path, toml.dumps(merged_toml))
+
+    marker.write_text(_marker_content(digest, toml_path), encoding="utf-8")
+    return changed
+
+
+# Symbols are enough to generate patterns, DWARF only makes artifacts bigger and slower to link and load
+LEAN_PROFILE = {"debug": 0, "strip": "debuginfo"}
+MIN_STRIP_VERSION = semver.Version(1, 59, 0)  # `strip` profile key stabilisation
+
+
+def lean_template(template: Optional[Dict], version: str, triple: Optional[str] = None) -> Dict:
+    """Returns `template` set up to build artifacts with symbols but without debug info, for release and dev.
+
+    Args:
+        template (Optional[Dict]): TOML modifications to apply
+        version (str): toolchain version, older ones do not know `strip`
+        triple (Optional[str]): target triple, symbols of MSVC targets are in the PDB that `strip` drops.
+            None is the host's, MSVC on Windows
+    """
+    lean = dict(LEAN_PROFILE)
+    try:
+        if semver.Version.parse(version) < MIN_STRIP_VERSION:
+            del lean["strip"]
+
+    except ValueError:
+        pass  # stable, beta and nightly channels
+
+    if triple.endswith("-msvc") if triple is not None else os.name == "nt":
+        # strip = "debuginfo" links with /DEBUG:NONE, no PDB means no names for non-exported functions
+        lean.pop("strip", None)
+
+    template = copy.deepcopy(template or {})
+    profiles = template.setdefault("profile", {})
+    for name in {"release", "dev"} | set(profiles):
+        profiles[name] = profiles.get(name, {}) | lean
+
+    return template
+
+
+# `--config` profile overrides and `cargo rustc --crate-type` are both stable since cargo 1.64
+MIN_OVERRIDES_VERSION = semver.Version(1, 64, 0)
+OVERLAY_MARKER = ".rustbinsign-overlay"
+REFUSED_PINS = ".rustbinsign-refused-pins.json"
+
+
+def supports_cargo_overrides(version: str) -> bool:
+    try:
+        return semver.Version.parse(version) >= MIN_OVERRIDES_VERSION
+
+    except ValueError:
+        return True  # stable, beta and nightly channels
+
+
+def _config_key(key: str) -> str:
+    return key if re.fullmatch(r"[A-Za-z0-9_-]+", key) else json.dumps(key)
+
+
+def _flatten_config(prefix: str, table: Dict) -> List[str]:
+    entries = []
+    for key, value in table.items():
+        path = f"{prefix}.{_config_key(key)}"
+        if isinstance(value, dict):
+            entries += _flatten_config(path, value)
+
+        else:
+            # JSON scalars and arrays of scalars are valid TOML values
+            entries.append(f"{path}={json.dumps(value)}")
+
+    return entries
+
+
+# Values of the profile keys cargo uses when a manifest does not set them. test and bench inherit dev and release.
+PROFILE_DEFAULTS = {
+    "dev": {
+        "opt-level": 0,
+        "debug": 2,
+        "strip": "none",
+        "debug-assertions": True,
+        "overflow-checks": True,
+        "lto": False,
+        "panic": "unwind",
+        "incremental": True,
+        "codegen-units": 256,
+        "rpath": False,
+    },
+    "release": {
+        "opt-level": 3,
+        "debug": 0,
+        "strip": "none",
+        "debug-assertions": False,
+        "overflow-checks": False,
+        "lto": False,
+        "panic": "unwind",
+        "incremental": False,
+        "codegen-units": 16,
+        "rpath": False,
+    },
+}
+PROFILE_DEFAULTS |= {"test": PROFILE_DEFAULTS["dev"], "bench": PROFILE_DEFAULTS["release"]}
+
+
+# Build scripts and proc-macros are built with these, over the profile's own settings
+BUILD_OVERRIDE_DEFAULTS = {"opt-level": 0, "codegen-units": 256, "debug": 0}
+
+
+def _profile_resets(settings: Dict, defaults: Dict, template: Dict) -> Dict:
+    """Defaults of the keys of a manifest's profile `settings` that `template` does not set."""
+    # Without their own settings, per-package overrides fall back to the profile's
+    inherited = defaults | {key: value for key, value in template.items() if not isinstance(value, dict)}
+    resets = {}
+    for key, value in settings.items():
+        if key == "package" and isinstance(value, dict):
+            resets[key] = {
+                name: _profile_resets(overrides, inherited, template.get(key, {}).get(name, {}))
+                for name, overrides in value.items()
+                if isinstance(overrides, dict)
+            }
+
+        elif key == "build-override" and isinstance(value, dict):
+            resets[key] = _profile_resets(value, inherited | BUILD_OVERRIDE_DEFAULTS, template.get(key, {}))
+
+        elif key not in template and key in defaults:
+            resets[key] = defaults[key]
+
+    return resets
+
+
+def _add_missing(table: Dict, other: Dict):
+    for key, value in other.items():
+        if isinstance(value, dict) and isinstance(table.get(key), dict):
+            _add_missing(table[key], value)
+
+        else:
+            table.setdefault(key, value)
+
+
+def reset_profiles(template: Optional[Dict], crate_toml: Dict) -> Optional[Dict]:
+    """Returns `template` completed with cargo's defaults for the profile keys that the crate's manifest sets and
+    the template does not.
+
+    Applied to Cargo.toml, a template replaces the whole [profile] table of the manifest. `--config` overrides
+    are merged over it instead, the package's own `lto` or `codegen-units` would otherwise survive.
+    """
+    if not template or not isinstance(template.get("profile"), dict):
+        return template
+
+    template = copy.deepcopy(template)
+    for name, settings in crate_toml.get("profile", {}).items():
+        if name in PROFILE_DEFAULTS and isinstance(settings, dict):
+            profile = template["profile"].setdefault(name, {})
+            _add_missing(profile, _profile_resets(settings, PROFILE_DEFAULTS[name], profile))
+
+    return template
+
+
+def template_to_cargo_args(template: Optional[Dict]) -> Optional[Tuple[List[str], List[str]]]:
+    """Translates a template into cargo `--config` overrides and lib crate types.
+
+    Args:
+        template (Optional[Dict]): TOML modifications to apply
+
+    Returns:
+        Optional[Tuple[List[str], List[str]]]: `--config` arguments and crate types, or None if the template
+        touches manifest sections that cannot be overridden from the command line.
+    """
+    config_args = []
+    crate_types = []
+
+    for section, value in (template or {}).items():
+        if section == "profile" and isinstance(value, dict):
+            for entry in _flatten_config("profile", value):
+                config_args += ["--config", entry]
+
+        elif section == "lib" and isinstance(value, dict) and set(value) <= {"crate-type"}:
+            crate_types = list(value.get("crate-type", []))
+
+        else:
+            return None
+
+    return config_args, crate_types
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _overlay_copy(src, dst):
+    # cargo rewrites Cargo.lock in place, which would go through a hard link to the sources
+    if Path(src).name == "Cargo.lock":
+        shutil.copy2(src, dst)
+
+    else:
+        _link_or_copy(src, dst)
+
+
+def get_overlay(
+    project_path: Path,
+    settings: str,
+    include_cfg_attr: bool = False,
+    patches: List[CratePatch] = (),
+    strip_no_std: bool = True,
+    template: Optional[Dict] = None,
+) -> Path:
+    """Returns a hard-linked copy of `project_path` dedicated to the builds identified by `settings`, leaving the
+    source untouched.
+
+    The copy has `patches` applied, its no_std attributes removed with `strip_no_std`, and `template` written to its
+    Cargo.toml when given. Its Cargo.lock is its own, so builds with other settings don't see its pins. Nothing else
+    is written to it once created, apart from cargo's own files.
+
+    The overlay is created next to a temporary name and renamed in place, so concurrent builds either see a
+    complete overlay or none at all.
+    """
+    project_path = Path(project_path).resolve()
+    # Sources extracted again, from another archive, get another overlay
+    marker = project_path.joinpath(EXTRACTION_MARKER)
+    if marker.exists():
+        source = marker.read_text(encoding="utf-8")
+
+    else:
+        manifest = project_path.joinpath("Cargo.toml").stat()
+        source = f"{manifest.st_mtime_ns}-{manifest.st_size}"
+
+    variant = f"{settings}{include_cfg_attr}{patches_hash(patches)}{strip_no_std}"
+    if template is not None:
+        variant += template_hash(template)
+
+    key = hashlib.sha256(f"{project_path}{source}{variant}".encode()).hexdigest()[:8]
+    overlays_dir = get_default_dest_dir().joinpath("overlays")
+    overlays_dir.mkdir(exist_ok=True)
+    overlay_path = overlays_dir.joinpath(f"{project_path.name}-{key}")
+
+    if overlay_path.joinpath(OVERLAY_MARKER).exists():
+        return overlay_path
+
+    tmp_dir = Path(tempfile.mkdtemp(dir=overlays_dir, prefix=f".{project_path.name}-"))
+    tmp_overlay = tmp_dir.joinpath(project_path.name)
+    shutil.copytree(
+        project_path,
+        tmp_overlay,
+        copy_function=_overlay_copy,
+        ignore=shutil.ignore_patterns("target", TEMPLATE_MARKER, OVERLAY_MARKER),
+    )
+
+    if strip_no_std:
+        # We want to be able to compile projects as shared libraries, which can have debug symbols and are easy to parse
+        remove_no_std_from_project(tmp_overlay, include_cfg_attr)
+
+    apply_patches(tmp_overlay, patches)
+    if template is not None:
+        setup_toml(tmp_overlay.joinpath("Cargo.toml"), template)
+
+    tmp_overlay.joinpath(OVERLAY_MARKER).write_text(str(project_path), encoding="utf-8")
+
+    if overlay_path.exists() and not overlay_path.joinpath(OVERLAY_MARKER).exists():
+        shutil.rmtree(overlay_path, ignore_errors=True)  # Leftover of an interrupted run
+
+    try:
+        os.rename(tmp_overlay, overlay_path)
+
+    except OSError:
+        log.debug(f"{overlay_path} was created concurrently, using it")
+
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    return overlay_path
+
+
+def _path_lock(kind: str, path: Path) -> Path:
+    digest = hashlib.sha256(str(Path(path).resolve()).encode()).hexdigest()[:16]
+    return get_default_dest_dir().joinpath("locks", f"{kind}-{Path(path).name}-{digest}.lock")
+
+
+def is_result_file(filename: str, rlib: bool = False) -> bool:
+    """Whether a file built by cargo is worth signing: libraries and executables, rlibs only when asked."""
+    suffix = Path(filename).suffix
+    if suffix in (".dll", ".exe") or (rlib and suffix == ".rlib"):
+        return True
+
+    # Extension-less files are highly inaccurate, but fine for now
+    return os.name != "nt" and (suffix == ".so" or "." not in filename)
 
 
 def project_has_lto(toml_path: Path, profile: str):
@@ -93,60 +436,37 @@ class CompilationUnit:
         self.tc = toolchain
 
     def _setup_repo(self, crate: Crate) -> Optional[Path]:
-        try:
-            repo_path = get_default_dest_dir().joinpath(crate.repository.rsplit("/", 1))
-
-        except:
-            repo_path = get_default_dest_dir().joinpath(crate.name)
-
-        log.debug(f"Pulling {crate.repository} to {repo_path}...")
-
-        if requests.get(crate.repository).status_code == 404:
+        if self.tc.vendor is not None:
+            log.warning(f"Offline mode, not pulling {crate.name}'s repository")
             return None
 
-        if not Path(repo_path).exists():
-            try:
-                repo = Repo.clone_from(crate.repository, repo_path)
-
-            except:
-                log.error(f"Could not clone {crate.repository} to {repo_path}")
-                return None
-
-        else:
-            log.info(f"{repo_path} exists, assuming that his directory is the cloned repo")
-            repo = Repo(repo_path)
-
-        # Nothing standard, but most repos should have something like this
-        seeked_tags = [
-            f"{crate.name}-{crate.version}",
-            f"{crate.name}-v{crate.version}",
-            f"{crate.name}_{crate.version}",
-            f"{crate.name}_v{crate.version}",
-            f"{crate.version}",
-            f"v{crate.version}",
-        ]
-
-        found_tag = None
-
-        for tag in TagReference.list_items(repo):
-            if tag.name in seeked_tags:
-                found_tag = tag
+        if not crate.repository:
+            log.warning(f"{crate.name} has no known repository")
+            return None
 
-        if found_tag is not None:
-            log.debug(f"Found tag {found_tag}, checking out")
-            repo.git.checkout(found_tag)
+        log.debug(f"Pulling {crate.repository}...")
+        return checkout_crate(crate)
 
-        return repo_path
+    def _get_log_path(self, project_path: Path) -> Path:
+        logs_dir = get_default_dest_dir().joinpath("logs")
+        logs_dir.mkdir(exist_ok=True)
+        # Builds of the same project with different settings may run concurrently, each gets its own log
+        name = f"{Path(project_path).name}-{self.tc.name}-{self.ctx.profile}-{template_hash(self.ctx.template)[:8]}"
+        return logs_dir.joinpath(f"{name}.log")
 
-    def _cargo_build(
+    def _run_cargo(
         self,
         project_path: pathlib.Path,
         features: Optional[List[Text]] = (),
         additional_args: Optional[List[Text]] = (),
         additional_env: Optional[Dict] = None,
         verb: str | None = "build",
-        stderr_to_stdout: bool = False,
-    ):
+    ) -> Tuple[int, Path, int]:
+        """Runs cargo once, streaming its output to the project's log file.
+
+        Returns:
+            Tuple[int, Path, int]: return code, log file, offset of this run's output in the log file
+        """
         args = [
             "cargo",
             f"+{self.tc.version}",
@@ -155,8 +475,10 @@ class CompilationUnit:
             self.tc.toolchain_name,
         ]
 
+        if verb in ("build", "rustc", "check", "test", "bench"):
+            args.append("--message-format=json")
+
         args += list(additional_args)
-        log.debug(args)
 
         if features:
             args.append("--features")
@@ -166,6 +488,11 @@ class CompilationUnit:
                 )
             )
 
+        return self._cargo(project_path, args, additional_env)
+
+    def _cargo(
+        self, project_path: Path, args: List[str], additional_env: Optional[Dict] = None
+    ) -> Tuple[int, Path, int]:
         env = os.environ.copy()
         if env is not None:
             # Custom environ setup
@@ -175,96 +502,384 @@ class CompilationUnit:
 
         log.debug(f"{' '.join(args)} || With env : {additional_env}")
 
-        ret = subprocess.run(
-            args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT if stderr_to_stdout else subprocess.PIPE,
-            cwd=project_path,
-            env=env,
-        )
+        log_path = self._get_log_path(project_path)
+        with open(log_path, "ab") as log_file:
+            offset = log_file.tell()
+            log_file.write(f"$ {' '.join(args)}\n".encode())
+            log_file.flush()
+            ret = run_process(
+                args,
+                "cargo",
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                cwd=project_path,
+                env=env,
+            )
+
+        return ret.returncode, log_path, offset
+
+    def _pin_lockfile(self, plan: BuildPlan):
+        """Pins the dependencies of a project to the versions found in the target, where semver allows it.
+
+        Cargo would otherwise resolve them to their newest compatible versions, which the target never used.
+        Pins cargo refused are recorded next to the lockfile, and not tried again.
+        """
+        pinned = self.ctx.pinned_versions
+        if not pinned:
+            return
+
+        project_path = plan.project_path
+        root = Path(plan.workspace_root or project_path)
+        lock_path = root.joinpath("Cargo.lock")
+        refused_path = root.joinpath(REFUSED_PINS)
+        global_args = []
+        env = plan.env
+        if self.tc.vendor is not None:
+            global_args, offline_env = self.tc.vendor.cargo_args(self.tc.version)
+            env = dict(env or {}) | offline_env
+
+        if not lock_path.exists():
+            self._cargo(project_path, ["cargo", f"+{self.tc.version}", "generate-lockfile"] + global_args, env)
+
+        refused = set()
+        if refused_path.exists():
+            refused = set(json.loads(refused_path.read_text(encoding="utf-8")))
+
+        updates = [u for u in lock_updates(lock_path, pinned) if "@".join(u) not in refused]
+        if not updates:
+            return
+
+        package = toml.load(Path(project_path).joinpath("Cargo.toml")).get("package", {})
+        # `name:version` package ids are understood by every cargo version, `name@version` only by recent ones
+        package_id = package["name"] + (f":{package['version']}" if isinstance(package.get("version"), str) else "")
+        cargo = ["cargo", f"+{self.tc.version}", "update"] + global_args
+        failed = self._apply_pins(project_path, lock_path, updates, cargo, package_id, env)
+
+        refused |= {"@".join(u) for u in failed}
+        refused_path.write_text(json.dumps(sorted(refused), indent=1), encoding="utf-8")
+        log.info(f"Pinned {len(updates) - len(failed)}/{len(updates)} dependencies to the target's versions")
+
+    def _crate_checksum(self, name: str, version: str) -> Optional[str]:
+        if self.tc.vendor is not None:
+            return self.tc.vendor.checksum(Crate.from_depstring(f"{name}-{version}"))
+
+        return get_crate_store().checksum(name, version)
+
+    def _apply_pins(
+        self,
+        project_path: Path,
+        lock_path: Path,
+        updates: List[Tuple[str, str, str]],
+        cargo: List[str],
+        package_id: str,
+        env: Optional[Dict],
+    ) -> List[Tuple[str, str, str]]:
+        """Moves every package of `updates` to its pinned version at once, then has cargo check the lockfile by
+        updating the project's own package.
+
+        Cargo refuses a lockfile as a whole, so a refused batch is split in two and each half tried again: a few
+        refused pins cost a few more cargo runs, not one per dependency. Pins left alone go through
+        `cargo update --precise`.
+
+        Returns:
+            List[Tuple[str, str, str]]: updates cargo refused
+        """
+        original = lock_path.read_bytes()
+        if len(updates) == 1:
+            name, version, target_version = updates[0]
+            code, log_path, _ = self._cargo(
+                project_path, cargo + ["-p", f"{name}:{version}", "--precise", target_version], env
+            )
+
+        else:
+            checksums = {(name, target): self._crate_checksum(name, target) for name, _, target in updates}
+            rewrite_lock(lock_path, updates, checksums)
+            code, log_path, _ = self._cargo(project_path, cargo + ["-p", package_id], env)
+
+        if code != 0:
+            lock_path.write_bytes(original)
+            if len(updates) == 1:
+                log.debug(f"Could not pin {updates[0][0]} to {updates[0][2]}, see {log_path}")
+                return updates
+
+            half = len(updates) // 2
+            return self._apply_pins(project_path, lock_path, updates[:half], cargo, package_id, env) + self._apply_pins(
+                project_path, lock_path, updates[half:], cargo, package_id, env
+            )
+
+        locked = {(name, version) for name, version, _ in locked_packages(lock_path)}
+        return [u for u in updates if (u[0], u[2]) not in locked]
 
-        if ret.returncode == 0:
-            return ret.returncode, ret.stdout, ret.stderr
+    def _cargo_build(
+        self,
+        project_path: pathlib.Path,
+        features: Optional[List[Text]] = (),
+        additional_args: Optional[List[Text]] = (),
+        additional_env: Optional[Dict] = None,
+        verb: str | None = "build",
+    ) -> Tuple[int, Path, Optional[Diagnosis]]:
+        """Builds a project, retrying while the failure can be fixed by dropping features.
 
-        if features:  # Remaining features to test compilation with
-            # Removing one feature and try to compile again
-            log.debug(f"Compilation failed, retrying with features : {features[1:]}")
-            return self._cargo_build(project_path, features[1:], additional_args, additional_env, verb)
+        Returns:
+            Tuple[int, Path, Optional[Diagnosis]]: return code, log file, diagnosis of the failure if any
+        """
+        features = list(features or [])
+
+        while True:
+            code, log_path, offset = self._run_cargo(project_path, features, additional_args, additional_env, verb)
+            if code == 0:
+                return code, log_path, None
+
+            diagnosis = classify(log_path, features, offset)
+            log.info(f"Compilation failed ({diagnosis.kind.value}), see {log_path}")
+
+            if diagnosis.strategy != Strategy.DROP_FEATURES or not features:
+                return code, log_path, diagnosis
 
-        return ret.returncode, ret.stdout, ret.stderr
+            # Remaining features to test compilation with
+            dropped = diagnosis.features
+            features = [f for f in features if f not in dropped]
+            log.debug(f"Retrying without features {dropped}, with features : {features}")
 
     def _compile_extra(
-        self, repo_path: Path, crate: Crate, features: Optional[List[Text]] = ()
+        self,
+        repo_path: Path,
+        crate: Crate,
+        features: Optional[List[Text]] = (),
+        plan: Optional[BuildPlan] = None,
     ) -> Path:
         log.info("Compiling tests, it might take minutes")
-        env = self.ctx.env.copy()
+        if plan is None:
+            plan = BuildPlan(project_path=repo_path, env=self.ctx.env.copy())
+
+        if self.ctx.min_extra_gain > 0:
+            self._compile_extra_incrementally(crate, features, plan)
+            return repo_path
 
         # I guess output path could be customisable, so this is not guaranteed to work.
-        code, out, err = self._cargo_build(
-            repo_path,
-            features,
-            [
-                "--tests",
-                "--profile",
-                "release" if self.ctx.profile == "release" else "dev",
-            ],
-            additional_env=env,
-        )
-        code, out, err = self._cargo_build(
-            repo_path,
-            features,
-            [
-                "--benches",
-                "--profile",
-                "release" if self.ctx.profile == "release" else "dev",
-            ],
-            additional_env=env,
-        )
-        code, out, err = self._cargo_build(
-            repo_path,
-            features,
-            [
-                "--examples",
-                "--profile",
-                "release" if self.ctx.profile == "release" else "dev",
-            ],
-            additional_env=env,
-        )
+        for extra in ("--tests", "--benches", "--examples"):
+            code, log_path, diagnosis = self._cargo_build(
+                plan.project_path,
+                features,
+                [
+                    extra,
+                    "--profile",
+                    "release" if self.ctx.profile == "release" else "dev",
+                ]
+                + plan.args,
+                additional_env=plan.env,
+            )
 
         return repo_path
 
+    def _cargo_metadata(self, plan: BuildPlan) -> Dict:
+        args = ["cargo", f"+{self.tc.version}", "metadata", "--no-deps", "--format-version", "1"]
+        # Only offline flags, metadata does not take --config overrides of the build
+        args += [arg for arg in plan.args if arg in ("--offline", "--frozen", "--locked")]
+        ret = run_process(
+            args,
+            "cargo",
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=plan.project_path,
+            env=os.environ.copy() | plan.env,
+        )
+        if ret.returncode != 0:
+            return {}
+
+        return json.loads(ret.stdout)
+
+    def _checkout_manifest(self, crate: Crate, plan: BuildPlan, repo_path: Path) -> Optional[Tuple[Path, Path]]:
+        """Manifest of `crate` in its checkout and root of its workspace, if the checkout is the very version to
+        build. `plan` builds the checkout, from an overlay of `repo_path`."""
+        metadata = self._cargo_metadata(plan)
+        for package in metadata.get("packages", []):
+            if package["name"] != crate.name:
+                continue
+
+            if package["version"] != crate.version:
+                log.debug(f"Checkout of {crate.name} is at version {package['version']}, not reusing it")
+                return None
+
+            manifest = Path(package["manifest_path"]).resolve()
+            overlay = Path(plan.project_path).resolve()
+            if plan.target_dir is None and manifest.parent != overlay:
+                # The template would have to be written in a workspace member, where cargo ignores profiles
+                return None
+
+            workspace_root = Path(metadata.get("workspace_root", overlay)).resolve()
+            return (
+                repo_path.joinpath(manifest.relative_to(overlay)),
+                repo_path.joinpath(workspace_root.relative_to(overlay)),
+            )
+
+        return None
+
+    def _compile_extra_incrementally(self, crate: Crate, features: Optional[List[Text]], plan: BuildPlan):
+        """Builds tests, examples and benches one at a time, as long as each one brings at least
+        `ctx.min_extra_gain` functions that were not built yet.
+
+        The targets that were worth it are remembered, next builds with the same settings go straight to them.
+        """
+        key = f"{crate.name}|{crate.version}|{self.tc.name}|{self.ctx.profile}|{template_hash(self.ctx.template)}"
+        cache = ExtrasCache()
+        targets = extra_targets(self._cargo_metadata(plan), crate.name)
+        profile_args = ["--profile", "release" if self.ctx.profile == "release" else "dev"]
+
+        selection = cache.get(key)
+        if selection is not None:
+            targets = [target for target in targets if target.id in selection.worth]
+            log.info(f"Building {len(targets)} extra targets of {crate.name} known to be worth it")
+            for verb in ("test", "build"):
+                args = sum([target.cargo_args for target in targets if target.verb == verb], [])
+                if args:
+                    self._cargo_build(plan.project_path, features, args + profile_args + plan.args, plan.env, verb)
+
+            return
+
+        seen = set()
+        worth, skipped = [], []
+        log_path = self._get_log_path(plan.project_path)
+        for i, target in enumerate(targets):
+            offset = log_path.stat().st_size if log_path.exists() else 0
+            code, log_path, _ = self._cargo_build(
+                plan.project_path, features, target.cargo_args + profile_args + plan.args, plan.env, target.verb
+            )
+            if code != 0:
+                skipped.append(target.id)
+                continue
+
+            patterns = function_patterns(built_executables(log_path, offset))
+            gain = len(patterns - seen)
+            seen |= patterns
+            log.debug(f"{target.id} brought {gain} new functions")
+            if gain < self.ctx.min_extra_gain:
+                skipped += [t.id for t in targets[i:]]
+                log.info(f"{target.id} brought {gain} new functions, not building the {len(targets) - i - 1} others")
+                break
+
+            worth.append(target.id)
+
+        cache.record(key, worth, skipped)
+
+    def _rustflags(self) -> str:
+        return (self.ctx.env or {}).get("RUSTFLAGS", os.environ.get("RUSTFLAGS", "")).strip()
+
+    def _get_target_dir(self, project_path: Path, template: Optional[Dict]) -> Path:
+        """Target directory dedicated to a (project, toolchain, template, RUSTFLAGS) combination, so builds of the
+        same sources with different settings never share, nor fight over, their artifacts.
+
+        RUSTFLAGS carry the link flags of --fast-linker, cargo rebuilds everything when they change.
+        """
+        rustflags = self._rustflags()
+        # Unchanged without RUSTFLAGS, so existing target directories stay in use
+        settings = template_hash({"template": template, "rustflags": rustflags} if rustflags else template)
+        name = f"{Path(project_path).name}-{self.tc.name}-{settings[:12]}"
+        return get_default_dest_dir().joinpath("targets", name)
+
+    def _prepare_build(
+        self,
+        toml_path: Path,
+        template: Optional[Dict],
+        transform: bool = False,
+        patches: List[CratePatch] = (),
+        target_dir: Optional[Path] = None,
+        workspace_root: Optional[Path] = None,
+    ) -> BuildPlan:
+        """Decides how the project at `toml_path` gets built with `template`.
+
+        Builds never write to the sources: they run in an overlay dedicated to their toolchain, template and
+        RUSTFLAGS, see get_overlay. When the toolchain allows it, the template is passed to cargo as `--config`
+        overrides and `cargo rustc --crate-type`, and artifacts go to a per-template target directory. Otherwise,
+        the template is written to the Cargo.toml of the overlay, as it always was.
+
+        Args:
+            transform (bool): also strip `#![cfg_attr(..., no_std)]` attributes, for crates that failed to build as is
+            patches (List[CratePatch]): known build fixes of the crate
+            target_dir (Optional[Path]): target directory to share with another build, with cargo overrides only
+            workspace_root (Optional[Path]): workspace `toml_path` is a member of, copied whole to the overlay
+        """
+        env = dict(self.ctx.env or {})
+        offline_args = []
+        if self.tc.vendor is not None:
+            offline_args, offline_env = self.tc.vendor.cargo_args(self.tc.version)
+            env |= offline_env
+
+        # Named after the (project, toolchain, template, RUSTFLAGS) combination, like the target directory
+        settings = self._get_target_dir(toml_path.parent, template).name
+        overrides = None
+        if supports_cargo_overrides(self.tc.version):
+            overrides = template_to_cargo_args(reset_profiles(template, toml.load(toml_path)))
+
+        if overrides is None:
+            log.debug(f"Applying template to {toml_path}")
+            overlay = get_overlay(
+                toml_path.parent, settings, include_cfg_attr=transform, patches=patches, template=template
+            )
+            return BuildPlan(project_path=overlay, args=offline_args, env=env, workspace_root=overlay)
+
+        config_args, crate_types = overrides
+        config_args = offline_args + config_args
+        root = Path(workspace_root or toml_path.parent)
+        strip_no_std = transform or "dylib" in crate_types
+        overlay = get_overlay(root, settings, include_cfg_attr=transform, patches=patches, strip_no_std=strip_no_std)
+        project_path = overlay.joinpath(toml_path.parent.resolve().relative_to(root.resolve()))
+
+        target_dir = target_dir or self._get_target_dir(toml_path.parent, template)
+        env["CARGO_TARGET_DIR"] = str(target_dir)
+
+        if crate_types:
+            return BuildPlan(
+                project_path=project_path,
+                verb="rustc",
+                args=config_args + ["--lib", "--crate-type", ",".join(crate_types)],
+                env=env,
+                target_dir=target_dir,
+                workspace_root=overlay,
+            )
+
+        return BuildPlan(
+            project_path=project_path, args=config_args, env=env, target_dir=target_dir, workspace_root=overlay
+        )
+
     def compile_project(
         self,
         project_path: Path,
         features: Optional[List[Text]] = (),
         verb: str | None = "build",
         additional_args: list[str] = [],
-        stderr_to_stdout: bool = False,
-    ):
-        code, out, err = self._cargo_build(
+    ) -> Tuple[int, Path, Optional[Diagnosis]]:
+        env = dict(self.ctx.env or {})
+        if self.tc.vendor is not None:
+            offline_args, offline_env = self.tc.vendor.cargo_args(self.tc.version)
+            additional_args = offline_args + list(additional_args)
+            env |= offline_env
+
+        return self._cargo_build(
             project_path,
             features,
             ["--profile", "release" if self.ctx.profile == "release" else "dev"] + list(additional_args),
-            additional_env=self.ctx.env,
+            additional_env=env,
             verb=verb,
-            stderr_to_stdout=stderr_to_stdout,
         )
 
-        return code, out, err
-
     def _get_result_files(
-        self, project_path: Path, profile: Optional[str] = None
+        self,
+        project_path: Path,
+        profile: Optional[str] = None,
+        target_dir: Optional[Path] = None,
     ) -> List[Path]:
         """Get generated target files from a project.
 
         Args:
             project_path (Path)
             profile (Optional[str]) : Specific target to retrieve results from
+            target_dir (Optional[Path]) : Target directory used by cargo, if not the project's one
 
         Returns:
             List[Path]: List of targets generated by the project
         """
-        compile_dst = project_path.joinpath("target")
+        compile_dst = target_dir if target_dir is not None else project_path.joinpath("target")
         # print(f"{compile_dst.absolute()}/{self.tc.toolchain_name}/*{self.ctx.profile}*")
         compile_dst = list(
             glob.glob(
@@ -281,25 +896,13 @@ class CompilationUnit:
 
         results = []
 
-        seeked_files = [
-            lambda file: Path(file).suffix[1:] == "dll",
-            lambda file: Path(file).suffix[1:] == "exe",
-        ]
-
-        if os.name != "nt":
-            seeked_files += [
-                lambda file: Path(file).suffix[1:] == "so",
-                lambda file: "." not in file,  # Highly inacurate but fine for now
-            ]
-
         for root, directories, filenames in os.walk(compile_dst):
             directories[:] = [
                 d for d in directories if d not in (".fingerprint", "build")
             ]
             for filename in filenames:
-                for routine in seeked_files:
-                    if routine(filename):
-                        results.append(Path(root).joinpath(filename))
+                if is_result_file(filename):
+                    results.append(Path(root).joinpath(filename))
 
         def uniq_filename_filter(
             list_of_paths: List[pathlib.Path],
@@ -318,17 +921,19 @@ class CompilationUnit:
         self,
         crate: Crate,
         toml_path: Path,
-        compile_all: bool = False
-        # lib: bool = True,
-        # crate_transform: Optional[Callable] = None,
+        compile_all: bool = False,
     ) -> List[pathlib.Path]:
-        """This is the single entrypoint for compiling crates."""
+        """This is the single entrypoint for compiling crates.
+
+        Extracted sources and checkouts are only read, each build writes to its own overlay and target directory
+        (see _prepare_build), so builds of the same crate with different toolchains or templates run concurrently.
+        """
         should_compile_all = project_has_lto(toml_path, "release") or compile_all
         results = []
-        features = crate.features
-
-        if "full" in features:
-            features = ["full"]
+        checkout = None
+        features = self._features(crate, toml_path)
+        key = self.failure_key(crate, features)
+        patches = get_patch_db().find(crate, self.tc.toolchain_name)
 
         if should_compile_all:
             # print("LTO detected !")
@@ -343,26 +948,116 @@ class CompilationUnit:
                 ):  # Benches, tests and examples often works bad with lib crate modification
                     del lib_template["lib"]
                 log.debug(f"Pulling repo {repo_path}")
-                setup_toml(repo_path.joinpath("Cargo.toml"), lib_template)
-                self._compile_extra(repo_path, crate, [])
-                results += self._get_result_files(repo_path)
+                plan = self._prepare_build(repo_path.joinpath("Cargo.toml"), lib_template, patches=patches)
+                self._compile_extra(repo_path, crate, [], plan)
+                results += self._get_result_files(plan.project_path, target_dir=plan.target_dir)
+                checkout = self._checkout_manifest(crate, plan, repo_path)
 
         else:
             log.warning(
                 "Compiling without --full-compilation will give weak signature results !"
             )
 
-        lib_template = self.ctx.template.copy()
-        if self.ctx.lib:
-            lib_template["lib"] = {"crate-type": ["dylib"]}
-        setup_toml(toml_path, lib_template)
-        results += self.compile_local_project(toml_path, features)
+        lib_results, diagnosis = [], None
+        if checkout is not None:
+            # Dependencies were just built there for the extra targets, with the same settings
+            log.debug(f"Building {crate} from its checkout, in {plan.target_dir or 'its target directory'}")
+            checkout_toml, workspace_root = checkout
+            lib_results, diagnosis = self._compile_lib(
+                crate, checkout_toml, features, key, patches, plan.target_dir, workspace_root
+            )
+
+        if not lib_results:
+            lib_results, diagnosis = self._compile_lib(crate, toml_path, features, key, patches)
+
+        results = list(dict.fromkeys(results + lib_results))
+        if not results and diagnosis is not None:
+            raise CompilationError(f"Could not compile {crate}: {diagnosis.kind.value}", diagnosis)
 
         log.info(f"{len(results)} results from compilation of {crate.name}")
         log.debug(f"{results}")
 
         return results
 
+    def _compile_lib(
+        self,
+        crate: Crate,
+        toml_path: Path,
+        features: List[Text],
+        key: str,
+        patches: List[CratePatch] = (),
+        target_dir: Optional[Path] = None,
+        workspace_root: Optional[Path] = None,
+    ) -> Tuple[List[pathlib.Path], Optional[Diagnosis]]:
+        """Builds the library of a crate, working around failures the build log can explain.
+
+        Workarounds that made a crate build are remembered, and applied straight away next time.
+        Identical builds, of the same crate with the same settings, share an overlay and wait for each other.
+
+        Returns:
+            Tuple[List[pathlib.Path], Optional[Diagnosis]]: generated files, diagnosis of the failure if any
+        """
+        cache = FailureCache()
+        known = cache.get(key)
+        workarounds = known.workarounds if known is not None else []
+
+        transform = Strategy.TRANSFORM in workarounds
+        crate_type = "rlib" if Strategy.RLIB in workarounds else "dylib"
+        if workarounds:
+            log.debug(f"Building {crate} with known workarounds {workarounds}")
+
+        while True:
+            lib_template = self.ctx.template.copy()
+            if self.ctx.lib:
+                lib_template["lib"] = {"crate-type": [crate_type]}
+
+            plan = self._prepare_build(
+                toml_path,
+                lib_template,
+                transform=transform,
+                patches=patches,
+                target_dir=target_dir,
+                workspace_root=workspace_root,
+            )
+            log_path = self._get_log_path(plan.project_path)
+            offset = log_path.stat().st_size if log_path.exists() else 0
+            with file_lock(_path_lock("build", plan.workspace_root)):
+                self._pin_lockfile(plan)
+                code, log_path, diagnosis = self._cargo_build(
+                    plan.project_path,
+                    features,
+                    ["--profile", "release" if self.ctx.profile == "release" else "dev"] + plan.args,
+                    additional_env=plan.env,
+                    verb=plan.verb,
+                )
+
+            # Only the crate's own files: the target directory may be shared with the builds of its tests
+            built = built_package_files(log_path, crate.name, crate.version, offset)
+            results = [path for path in built if is_result_file(path.name, rlib=crate_type == "rlib")]
+
+            if code == 0 or results:
+                break
+
+            if not self.ctx.lib:
+                break
+
+            if diagnosis.strategy == Strategy.TRANSFORM and not transform:
+                log.info(f"{crate} is no_std, stripping no_std attributes")
+                transform = True
+
+            elif diagnosis.strategy == Strategy.RLIB and crate_type != "rlib":
+                log.info(f"{crate} can't be built as a dylib, building a rlib instead")
+                crate_type = "rlib"
+
+            else:
+                break
+
+        applied = [Strategy.TRANSFORM] * transform + [Strategy.RLIB] * (crate_type == "rlib")
+        if code == 0 and applied != workarounds:
+            cache.record(key, "workaround", workarounds=applied)
+
+        return results, diagnosis
+
     def compile_local_project(
         self,
         toml_path: pathlib.Path,
@@ -373,17 +1068,37 @@ class CompilationUnit:
         self.compile_project(toml_path.parent, features, verb=verb, additional_args=additional_args)
         return self._get_result_files(toml_path.parent)
 
+    def _fetch_source(self, crate: Crate) -> Path:
+        if self.tc.vendor is not None:
+            return self.tc.vendor.fetch_source(crate)
+
+        archive_path: Path = get_crate_store().fetch(crate)
+        return extract_tarfile(archive_path, get_default_dest_dir(), skip=unneeded_paths(archive_path))
+
+    def _features(self, crate: Crate, toml_path: Path) -> List[Text]:
+        if self.ctx.infer_features_from is not None:
+            return infer_features(crate, toml_path, self.ctx.infer_features_from)
+
+        if "full" in crate.features:
+            return ["full"]
+
+        return crate.features
+
+    def failure_key(self, crate: Crate, features: Optional[List[Text]] = None) -> str:
+        """Key of the build of `crate` in the FailureCache, from the settings this unit builds it with: its template,
+        RUSTFLAGS and the features the build would use, inferred from the sources if not given."""
+        if features is None:
+            features = self._features(crate, self._fetch_source(crate).joinpath("Cargo.toml"))
+
+        return failure_key(crate, self.tc.name, self.ctx.profile, self.ctx.template, self._rustflags(), features)
+
     def compile_remote_crate(
         self,
         crate: Crate,
-        crate_transform: Optional[Callable] = None,  # TODO / XXX: unused
         compile_all: Optional[bool] = False,
     ) -> List[Path]:
-        archive_path: Path = crate.download()
-        extracted_location = extract_tarfile(archive_path)
-
         return self.compile_crate(
             crate=crate,
-            toml_path=extracted_location.joinpath("Cargo.toml"),
+            toml_path=self._fetch_source(crate).joinpath("Cargo.toml"),
             compile_all=compile_all,
         )
@@ -0,0 +1,212 @@
+import json
+import os
+import pathlib
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+import toml
+from requests.adapters import HTTPAdapter
+from rustbininfo import Crate, TargetRustInfo
+
+from .logger import logger as log
+from .util import USER_AGENT, download_file, get_default_dest_dir
+
+CRATES_DL_URL = "https://static.crates.io/crates"
+CRATES_INDEX_URL = "https://index.crates.io"
+# Directories of a crate archive that building its library never reads, by the manifest key of their targets.
+# docs/ is kept, crates include_str! their documentation from there.
+UNNEEDED_DIRS = {"test": "tests", "bench": "benches", "example": "examples"}
+
+
+def index_file_path(name: str) -> str:
+    """Path of a crate's file in a crates.io-like registry index."""
+    name = name.lower()
+    if len(name) <= 2:
+        return f"{len(name)}/{name}"
+
+    if len(name) == 3:
+        return f"3/{name[0]}/{name}"
+
+    return f"{name[:2]}/{name[2:4]}/{name}"
+
+
+def unneeded_paths(archive_path: pathlib.Path) -> List[str]:
+    """Patterns of the paths of a crate archive that can be left out when extracting it, see extract_tarfile.
+
+    Directories of targets declared in the manifest are kept: cargo refuses manifests whose targets are missing.
+    """
+    with tarfile.open(archive_path) as tar:
+        for member in tar:  # Cargo.toml comes first, cargo package sorts entries
+            if member.isfile() and member.name.count("/") == 1 and member.name.endswith("/Cargo.toml"):
+                try:
+                    manifest = toml.loads(tar.extractfile(member).read().decode("utf-8"))
+
+                except (toml.TomlDecodeError, UnicodeDecodeError):
+                    return []
+
+                break
+
+        else:
+            return []
+
+    return [f"{directory}/*" for key, directory in UNNEEDED_DIRS.items() if not manifest.get(key)]
+
+
+class CrateStore:
+    """Local content-addressed store of `.crate` archives.
+
+    Archives are stored under their sha256, which is checked against the registry index when downloading.
+    URLs can point to any crates.io-like server, such as a local mirror.
+
+    Usage example:
+    >>> store = CrateStore()
+    >>> store.prefetch_target(TargetRustInfo.from_target(target))
+    >>> archive = store.fetch(crate)
+    """
+
+    root: pathlib.Path
+    dl_url: str
+    index_url: str
+    max_workers: int
+
+    def __init__(
+        self,
+        root: Optional[pathlib.Path] = None,
+        dl_url: str = CRATES_DL_URL,
+        index_url: str = CRATES_INDEX_URL,
+        max_workers: int = 16,
+    ):
+        self.root = pathlib.Path(root) if root is not None else get_default_dest_dir().joinpath("crates")
+        self.dl_url = dl_url.rstrip("/")
+        self.index_url = index_url.rstrip("/")
+        self.max_workers = max_workers
+        self._index_cache: Dict[str, Dict[str, dict]] = {}
+        self._index_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+        # A single pooled session, so concurrent downloads reuse their connections
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=3)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _blob_path(self, digest: str) -> pathlib.Path:
+        return self.root.joinpath("blobs", digest[:2], f"{digest}.crate")
+
+    def _ref_path(self, name: str, version: str) -> pathlib.Path:
+        return self.root.joinpath("refs", f"{name}-{version}")
+
+    def get(self, crate: Crate) -> Optional[pathlib.Path]:
+        """Returns the local archive of `crate`, or None if it was never fetched."""
+        ref_path = self._ref_path(crate.name, crate.version)
+        if not ref_path.exists():
+            return None
+
+        blob_path = self._blob_path(ref_path.read_text(encoding="utf-8").strip())
+        return blob_path if blob_path.exists() else None
+
+    def index_entry(self, name: str, version: str) -> dict:
+        """Registry index entry of a crate version (checksum, dependencies, features...)."""
+        with self._lock:
+            name_lock = self._index_locks.setdefault(name, threading.Lock())
+
+        # Versions of a crate are often fetched together, they wait for the first one to read the index
+        with name_lock:
+            entries = self._index_cache.get(name)
+            if entries is None:
+                res = self.session.get(f"{self.index_url}/{index_file_path(name)}", timeout=20)
+                res.raise_for_status()
+                entries = {}
+                for line in res.text.splitlines():
+                    if line.strip():
+                        entry = json.loads(line)
+                        entries[entry["vers"]] = entry
+
+                self._index_cache[name] = entries
+
+        if version not in entries:
+            raise KeyError(f"{name}-{version} is not in the registry index")
+
+        return entries[version]
+
+    def checksum(self, name: str, version: str) -> Optional[str]:
+        """sha256 of the archive of a crate version according to the registry index, None if it can't be told."""
+        try:
+            return self.index_entry(name, version)["cksum"]
+
+        except (requests.RequestException, KeyError, ValueError):
+            return None
+
+    def fetch(self, crate: Crate) -> pathlib.Path:
+        """Returns the local archive of `crate`, downloading and verifying it if needed."""
+        archive = self.get(crate)
+        if archive is not None:
+            return archive
+
+        checksum = self.index_entry(crate.name, crate.version)["cksum"]
+        blob_path = self._blob_path(checksum)
+
+        if not blob_path.exists():
+            log.info(f"Downloading crate {crate}")
+            download_file(
+                f"{self.dl_url}/{crate.name}/{crate.name}-{crate.version}.crate",
+                blob_path,
+                expected_digest=checksum,
+                session=self.session,
+            )
+
+        ref_path = self._ref_path(crate.name, crate.version)
+        ref_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_ref = ref_path.with_name(f".{ref_path.name}.{os.getpid()}-{threading.get_ident()}")
+        tmp_ref.write_text(checksum, encoding="utf-8")
+        os.replace(tmp_ref, ref_path)
+
+        return blob_path
+
+    def prefetch(self, crates: Iterable[Crate]) -> Tuple[List[pathlib.Path], List[Crate]]:
+        """Fetches every missing crate concurrently.
+
+        Returns:
+            Tuple[List[pathlib.Path], List[Crate]]: local archives, crates that could not be fetched
+        """
+        crates = list(crates)
+        missing = [crate for crate in crates if self.get(crate) is None]
+        log.info(f"Prefetching {len(missing)} crates ({len(crates) - len(missing)} already in {self.root})")
+
+        archives = []
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as tp:
+            futures = {crate: tp.submit(self.fetch, crate) for crate in missing}
+            for crate, fut in futures.items():
+                try:
+                    archives.append(fut.result())
+
+                except Exception as exc:
+                    log.error(f"Could not fetch {crate}: {exc}")
+                    failed.append(crate)
+
+        archives += [self.get(crate) for crate in crates if crate not in missing]
+        return archives, failed
+
+    def prefetch_target(self, info: TargetRustInfo) -> Tuple[List[pathlib.Path], List[Crate]]:
+        return self.prefetch(info.dependencies)
+
+
+_default_store: Optional[CrateStore] = None
+
+
+def get_crate_store() -> CrateStore:
+    global _default_store
+    if _default_store is None:
+        _default_store = CrateStore()
+
+    return _default_store
+
+
+def set_crate_store(store: CrateStore):
+    global _default_store
+    _default_store = store
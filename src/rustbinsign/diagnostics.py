@@ -0,0 +1,146 @@
+import json
+import pathlib
+import re
+from enum import Enum
+from typing import Iterator, List
+
+from pydantic import BaseModel
+
+
+class FailureKind(str, Enum):
+    MISSING_SYSTEM_LIBRARY = "missing-system-library"
+    NO_STD = "no-std"  # #![no_std] left in the crate, no panic handler or allocator
+    LANG_ITEM_CONFLICT = "lang-item-conflict"  # The crate brings its own panic handler/allocator while std is linked
+    NIGHTLY_REQUIRED = "nightly-required"
+    UNSUPPORTED_DYLIB = "unsupported-dylib"
+    UNKNOWN_FEATURE = "unknown-feature"
+    UNKNOWN = "unknown"
+
+
+class Strategy(str, Enum):
+    SKIP = "skip"  # Nothing to do, don't build again
+    TRANSFORM = "transform"  # Strip no_std attributes from the sources
+    RLIB = "rlib"  # Build as a rlib instead of a dylib
+    DROP_FEATURES = "drop-features"
+
+
+STRATEGIES = {
+    FailureKind.MISSING_SYSTEM_LIBRARY: Strategy.SKIP,
+    FailureKind.NO_STD: Strategy.TRANSFORM,
+    FailureKind.LANG_ITEM_CONFLICT: Strategy.RLIB,
+    FailureKind.NIGHTLY_REQUIRED: Strategy.DROP_FEATURES,
+    FailureKind.UNSUPPORTED_DYLIB: Strategy.RLIB,
+    FailureKind.UNKNOWN_FEATURE: Strategy.DROP_FEATURES,
+    FailureKind.UNKNOWN: Strategy.SKIP,  # Unless the errors name features, see classify
+}
+
+# First match wins, order matters
+PATTERNS = [
+    (
+        FailureKind.MISSING_SYSTEM_LIBRARY,
+        re.compile(
+            r"could not find system library|unable to find library -l|cannot find -l|"
+            r"pkg-config.*(not found|failed)|could not find directory of openssl|"
+            r"fatal error: [^\s]+\.h: no such file",
+            re.I,
+        ),
+    ),
+    (
+        FailureKind.LANG_ITEM_CONFLICT,
+        re.compile(r"duplicate lang item|found duplicate lang item|conflicts with allocation error handler", re.I),
+    ),
+    (
+        FailureKind.NO_STD,
+        re.compile(
+            r"`#\[panic_handler\]` function required|no global memory allocator found|"
+            r"unwinding panics are not supported without std|`#\[alloc_error_handler\]` function required",
+            re.I,
+        ),
+    ),
+    (
+        FailureKind.UNSUPPORTED_DYLIB,
+        re.compile(
+            r"cannot satisfy dependencies so `\w+` only shows up once|cannot produce dylib|"
+            r"dependency `\w+` not found in rlib format|crate type `dylib` .*not supported",
+            re.I,
+        ),
+    ),
+    (
+        FailureKind.NIGHTLY_REQUIRED,
+        re.compile(r"E0554|may not be used on the stable release channel|requires a nightly|is unstable", re.I),
+    ),
+    (
+        FailureKind.UNKNOWN_FEATURE,
+        re.compile(
+            r"does not (have|contain) (the|this) feature|none of the selected packages contains these features",
+            re.I,
+        ),
+    ),
+]
+
+FEATURE_NAMES = re.compile(r"""features?:?\s+[`'"]?([\w+-]+(?:\s*,\s*[\w+-]+)*)""", re.I)
+
+
+class Diagnosis(BaseModel):
+    kind: FailureKind
+    strategy: Strategy
+    features: List[str] = []  # Features to drop, for Strategy.DROP_FEATURES
+    message: str = ""
+
+
+def iter_errors(log_path: pathlib.Path, offset: int = 0) -> Iterator[str]:
+    """Yields error messages of a build log.
+
+    The log holds cargo's `--message-format=json` output on stdout, mixed with its human readable stderr (where
+    build script failures end up).
+    """
+    with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+        f.seek(offset)
+        for line in f:
+            if line.startswith("{"):
+                try:
+                    message = json.loads(line)
+
+                except ValueError:
+                    yield line
+                    continue
+
+                if message.get("reason") == "compiler-message" and message["message"].get("level") == "error":
+                    yield message["message"].get("rendered") or message["message"].get("message", "")
+
+            elif line.strip():
+                yield line
+
+
+def classify(log_path: pathlib.Path, features: List[str] = (), offset: int = 0) -> Diagnosis:
+    """Sorts a failed build into a FailureKind, and chooses what to do about it."""
+    errors = list(iter_errors(log_path, offset))
+    text = "\n".join(errors)
+
+    kind = FailureKind.UNKNOWN
+    for candidate, pattern in PATTERNS:
+        if pattern.search(text):
+            kind = candidate
+            break
+
+    strategy = STRATEGIES[kind]
+    dropped = []
+
+    if kind == FailureKind.NIGHTLY_REQUIRED:
+        dropped = [f for f in features if any(word in f for word in ("nightly", "unstable", "simd", "asm"))]
+
+    elif kind == FailureKind.UNKNOWN_FEATURE:
+        for match in FEATURE_NAMES.finditer(text):
+            dropped += [name.strip() for name in match.group(1).split(",") if name.strip() in features]
+
+    elif kind == FailureKind.UNKNOWN:
+        # Features named in the errors, e.g. in `#[cfg(feature = "x")]` spans
+        dropped = [f for f in features if re.search(rf"feature\s*=\s*\"{re.escape(f)}\"", text)]
+        if dropped:
+            strategy = Strategy.DROP_FEATURES
+
+    if strategy == Strategy.DROP_FEATURES and not dropped:
+        strategy = Strategy.SKIP  # Dropping features blindly only makes the retries pile up
+
+    # Keep the last lines, that is where the first error usually gets summarised
+    return Diagnosis(kind=kind, strategy=strategy, features=dropped, message="\n".join(errors[-20:]))
@@ -0,0 +1,108 @@
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import requests
+import toml
+
+from .logger import logger as log
+from .util import download_file
+
+DEFAULT_DIST_SERVER = "https://static.rust-lang.org"
+# Components of rustup's minimal profile, for manifests older than profiles
+MINIMAL_COMPONENTS = ["rustc", "cargo", "rust-std"]
+
+
+def manifest_path(version: str) -> str:
+    return f"dist/channel-rust-{version}.toml"
+
+
+def component_packages(
+    manifest: Dict, triple: str, components: List[str], upstream: str
+) -> List[Tuple[str, str, str]]:
+    """Tarballs rustup downloads to install `components` for `triple`.
+
+    Returns:
+        List[Tuple[str, str, str]]: path relative to the dist server, url, sha256
+    """
+    packages = []
+    for component in components:
+        target = manifest.get("pkg", {}).get(component, {}).get("target", {}).get(triple)
+        if target is None or not target.get("available", False):
+            log.warning(f"{component} is not available for {triple} in {manifest.get('date')}'s manifest")
+            continue
+
+        # rustup picks xz over gz when both are there
+        url, digest = (target["xz_url"], target["xz_hash"]) if "xz_url" in target else (target["url"], target["hash"])
+        if not url.startswith(DEFAULT_DIST_SERVER):
+            log.warning(f"{url} is not on the default dist server, rustup won't look for it in the mirror")
+            continue
+
+        path = url[len(DEFAULT_DIST_SERVER) :].lstrip("/")
+        packages.append((path, f"{upstream}/{path}", digest))
+
+    return packages
+
+
+def fill_mirror(
+    mirror_dir: pathlib.Path,
+    versions: List[str],
+    triples: List[str],
+    components: List[str] = (),
+    upstream: str = DEFAULT_DIST_SERVER,
+    jobs: int = 4,
+) -> List[pathlib.Path]:
+    """Downloads the channel manifests of `versions`, and the tarballs of the minimal profile (plus `components`)
+    for `triples`, laid out as on the dist server.
+
+    Point rustup at it with RUSTUP_DIST_SERVER (see --dist-server), either as a directory or served over HTTP,
+    e.g `python -m http.server -d <mirror_dir>`. Files already in the mirror are not downloaded again.
+
+    Returns:
+        List[pathlib.Path]: files of the mirror needed by these toolchains
+    """
+    mirror_dir = pathlib.Path(mirror_dir)
+    upstream = upstream.rstrip("/")
+    session = requests.Session()
+    downloads: Dict[str, Tuple[str, str]] = {}
+    files = []
+
+    for version in versions:
+        relative = manifest_path(version)
+        destination = mirror_dir.joinpath(relative)
+        if not destination.exists():
+            # The manifest is verified against its published hash, which rustup fetches too
+            checksum = download_file(f"{upstream}/{relative}.sha256", mirror_dir.joinpath(f"{relative}.sha256"))
+            digest = checksum.read_text(encoding="utf-8").split()[0]
+            log.info(f"Downloading manifest of {version}")
+            download_file(f"{upstream}/{relative}", destination, expected_digest=digest, session=session)
+
+        files += [destination, mirror_dir.joinpath(f"{relative}.sha256")]
+        manifest = toml.load(destination)
+        wanted = list(manifest.get("profiles", {}).get("minimal", MINIMAL_COMPONENTS)) + list(components)
+
+        for triple in triples:
+            for path, url, digest in component_packages(manifest, triple, wanted, upstream):
+                downloads[path] = (url, digest)
+
+    def fetch(item: Tuple[str, Tuple[str, str]]) -> pathlib.Path:
+        path, (url, digest) = item
+        destination = mirror_dir.joinpath(path)
+        if not destination.exists():
+            log.info(f"Downloading {path}")
+            download_file(url, destination, expected_digest=digest, session=session)
+
+        return destination
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        files += list(pool.map(fetch, downloads.items()))
+
+    return files
+
+
+def dist_server_url(server: str) -> str:
+    """RUSTUP_DIST_SERVER value for an URL or a local mirror directory."""
+    if "://" in server:
+        return server.rstrip("/")
+
+    return pathlib.Path(server).resolve().as_uri()
@@ -3,8 +3,21 @@ class InvalidVersionError(Exception):
 
 
 class CompilationError(Exception):
-    pass
+    def __init__(self, message: str, diagnosis=None):
+        self.diagnosis = diagnosis
+        super().__init__(message)
 
 
 class InvalidToolchainError(Exception):
     pass
+
+
+class ChecksumError(Exception):
+    pass
+
+
+class ProcessTimeoutError(Exception):
+    def __init__(self, kind: str, timeout: float):
+        self.kind = kind
+        self.timeout = timeout
+        super().__init__(f"{kind} timed out after {timeout}s")
@@ -0,0 +1,168 @@
+import json
+import os
+import pathlib
+import re
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+from .binary import Binary
+from .logger import logger as log
+from .util import file_lock, get_default_dest_dir
+
+EXTRA_KINDS = ("test", "example", "bench")  # Build order, tests usually cover the most code
+LEGACY_HASH = re.compile(r"17h[0-9a-f]{16}E$")
+
+
+class ExtraTarget(BaseModel):
+    kind: str  # test, bench, example, or lib for the unit tests of the library
+    name: str
+
+    @property
+    def id(self) -> str:
+        return f"{self.kind}:{self.name}"
+
+    @property
+    def verb(self) -> str:
+        # `cargo build` can only select the library itself, not its test harness
+        return "test" if self.kind == "lib" else "build"
+
+    @property
+    def cargo_args(self) -> List[str]:
+        return ["--no-run", "--lib"] if self.kind == "lib" else [f"--{self.kind}", self.name]
+
+
+def extra_targets(metadata: Dict, package_name: str) -> List[ExtraTarget]:
+    """Tests, examples and benches of a package, from `cargo metadata` output. The lib's own unit tests come first."""
+    targets = []
+    for package in metadata.get("packages", []):
+        if package["name"] != package_name:
+            continue
+
+        for target in package["targets"]:
+            for kind in set(target["kind"]) & set(EXTRA_KINDS):
+                targets.append(ExtraTarget(kind=kind, name=target["name"]))
+
+            if set(target["kind"]) & {"lib", "dylib", "rlib"} and target.get("test", True):
+                targets.append(ExtraTarget(kind="lib", name=target["name"]))
+
+    order = {kind: i for i, kind in enumerate(("lib",) + EXTRA_KINDS)}
+    return sorted(targets, key=lambda t: (order[t.kind], t.name))
+
+
+def _cargo_messages(log_path: pathlib.Path, offset: int = 0):
+    """Messages of cargo's `--message-format=json` output, in a build log."""
+    with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.startswith("{"):
+                continue
+
+            try:
+                yield json.loads(line)
+
+            except ValueError:
+                continue
+
+
+def built_executables(log_path: pathlib.Path, offset: int = 0) -> List[pathlib.Path]:
+    """Executables a build produced, from cargo's `--message-format=json` output."""
+    executables = []
+    for message in _cargo_messages(log_path, offset):
+        if message.get("reason") == "compiler-artifact" and message.get("executable"):
+            executables.append(pathlib.Path(message["executable"]))
+
+    return executables
+
+
+def package_of(package_id: str) -> Tuple[str, str]:
+    """Name and version of a package from its cargo id, `name version (source)` before cargo 1.77, a URL since."""
+    if " " in package_id:
+        name, version = package_id.split(" ")[:2]
+        return name, version
+
+    url, _, fragment = package_id.partition("#")
+    name, _, version = fragment.rpartition("@")
+    # The name is left out when it is the last segment of the URL
+    return name or url.split("?")[0].rstrip("/").rsplit("/", 1)[-1], version
+
+
+def built_package_files(log_path: pathlib.Path, name: str, version: str, offset: int = 0) -> List[pathlib.Path]:
+    """Files a build produced for the targets of a single package, from cargo's `--message-format=json` output.
+
+    Dependencies, build scripts, and whatever else the target directory already held are left out.
+    """
+    files = []
+    for message in _cargo_messages(log_path, offset):
+        if message.get("reason") != "compiler-artifact" or "custom-build" in message["target"]["kind"]:
+            continue
+
+        if package_of(message["package_id"]) != (name, version):
+            continue
+
+        files += [pathlib.Path(path) for path in message.get("filenames", [])]
+        if message.get("executable"):
+            files.append(pathlib.Path(message["executable"]))
+
+    return list(dict.fromkeys(files))
+
+
+def function_patterns(paths: List[pathlib.Path]) -> Set[Tuple[str, int]]:
+    """Identifies the functions of executables by name and size.
+
+    Legacy symbol hashes are dropped: they change when a crate is built as a test harness, while its code does not.
+    """
+    patterns = set()
+    for path in paths:
+        try:
+            symbols = Binary(path).function_symbols()
+
+        except (OSError, ValueError) as exc:
+            log.debug(f"Can't read symbols of {path}: {exc}")
+            continue
+
+        patterns |= {(LEGACY_HASH.sub("E", name), size) for name, size in symbols.items()}
+
+    return patterns
+
+
+class ExtraSelection(BaseModel):
+    worth: List[str]  # ExtraTarget ids that brought enough new functions
+    skipped: List[str] = []
+    timestamp: float
+
+
+class ExtrasCache:
+    """Persistent record of the extra targets worth building for a crate, with given build settings.
+
+    Usage example:
+    >>> cache = ExtrasCache()
+    >>> selection = cache.get(key)
+    >>> if selection is None:
+    ...     cache.record(key, ["lib:serde", "test:regression"], ["example:demo"])
+    """
+
+    path: pathlib.Path
+
+    def __init__(self, path: Optional[pathlib.Path] = None):
+        self.path = pathlib.Path(path) if path is not None else get_default_dest_dir().joinpath("extra_targets.json")
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, key: str) -> Optional[ExtraSelection]:
+        entry = self._load().get(key)
+        return ExtraSelection(**entry) if entry is not None else None
+
+    def record(self, key: str, worth: List[str], skipped: List[str] = ()):
+        with file_lock(self.path.with_suffix(".lock")):
+            entries = self._load()
+            entries[key] = ExtraSelection(worth=list(worth), skipped=list(skipped), timestamp=time.time()).model_dump()
+            tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+            tmp_path.write_text(json.dumps(entries, indent=1), encoding="utf-8")
+            os.replace(tmp_path, self.path)
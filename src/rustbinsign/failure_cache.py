@@ -0,0 +1,100 @@
+import json
+import os
+import pathlib
+import time
+from typing import Dict, Iterable, List, Optional
+
+from pydantic import BaseModel
+from rustbininfo import Crate
+
+from .logger import logger as log
+from .util import file_lock, get_default_dest_dir, template_hash
+
+DEFAULT_TTL = 7 * 24 * 3600  # seconds
+TRANSIENT_TTL = 3600  # Timeouts and empty builds depend on the load and the environment as much as on the crate
+
+
+class BuildFailure(BaseModel):
+    kind: str
+    message: str = ""
+    timestamp: float
+    workarounds: List[str] = []  # Strategies that make the build succeed, the build is not skipped if any
+    ttl: Optional[float] = None  # Lifetime of this record, when shorter than the cache's
+
+
+def failure_key(
+    crate: Crate,
+    toolchain_name: str,
+    profile: str,
+    template: Optional[Dict],
+    rustflags: str = "",
+    features: Iterable[str] = (),
+) -> str:
+    """Identifies a build by everything its outcome depends on. Use CompilationUnit.failure_key, which passes the
+    settings a build actually uses rather than the ones it was asked for."""
+    settings = {"template": template or {}, "rustflags": rustflags, "features": sorted(features)}
+    return f"{crate.name}|{crate.version}|{toolchain_name}|{profile}|{template_hash(settings)}"
+
+
+class FailureCache:
+    """Persistent record of builds known to fail, so that later runs don't pay for them again.
+
+    Usage example:
+    >>> cache = FailureCache()
+    >>> key = unit.failure_key(crate)
+    >>> if cache.get(key) is None:
+    ...     cache.record(key, "no-artifacts")
+    """
+
+    path: pathlib.Path
+    ttl: float
+
+    def __init__(self, path: Optional[pathlib.Path] = None, ttl: float = DEFAULT_TTL):
+        self.path = pathlib.Path(path) if path is not None else get_default_dest_dir().joinpath("build_failures.json")
+        self.ttl = ttl
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _update(self, key: str, entry: Optional[BuildFailure]):
+        with file_lock(self.path.with_suffix(".lock")):
+            entries = self._load()
+            if entry is None:
+                if entries.pop(key, None) is None:
+                    return
+
+            else:
+                entries[key] = entry.model_dump()
+
+            tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+            tmp_path.write_text(json.dumps(entries, indent=1), encoding="utf-8")
+            os.replace(tmp_path, self.path)
+
+    def get(self, key: str) -> Optional[BuildFailure]:
+        """Returns the recorded failure of a build, unless it expired."""
+        entry = self._load().get(key)
+        if entry is None:
+            return None
+
+        failure = BuildFailure(**entry)
+        ttl = min(self.ttl, failure.ttl) if failure.ttl is not None else self.ttl
+        if time.time() - failure.timestamp > ttl:
+            log.debug(f"Recorded failure of {key} expired")
+            return None
+
+        return failure
+
+    def record(
+        self, key: str, kind: str, message: str = "", workarounds: List[str] = (), ttl: Optional[float] = None
+    ):
+        failure = BuildFailure(
+            kind=kind, message=message[-2000:], timestamp=time.time(), workarounds=list(workarounds), ttl=ttl
+        )
+        self._update(key, failure)
+
+    def forget(self, key: str):
+        self._update(key, None)
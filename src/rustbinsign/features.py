@@ -0,0 +1,228 @@
+import functools
+import os
+import pathlib
+import re
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import toml
+from rustbininfo import Crate
+
+from .logger import logger as log
+
+CFG_ATTRIBUTE = re.compile(r"#\s*(!?)\s*\[\s*cfg\s*\((.*)\)\s*\]\s*$")
+FEATURE_NAME = re.compile(r'feature\s*=\s*"([^"]+)"')
+MOD_DECLARATION = re.compile(r"^\s*(?:pub(?:\([^)]*\))?\s+)?mod\s+(\w+)\s*;")
+MIN_EVIDENCE_STRING = 12  # Shorter strings are too common to tell anything
+STRING_LITERAL = re.compile(r'"((?:[^"\\\n]|\\.){%d,200})"' % MIN_EVIDENCE_STRING)
+RUST_STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.S)
+CHAR_LITERAL = re.compile(r"'(?:\\.[^']*|[^\\'])'")
+IGNORED_DIRECTORIES = ("tests", "benches", "examples", "target")
+
+
+def cfg_features(predicate: str) -> Optional[Set[str]]:
+    """Features a cfg predicate requires, None if it does not only depend on features being enabled."""
+    if "not(" in predicate.replace(" ", "") or "any(" in predicate.replace(" ", ""):
+        return None
+
+    features = set(FEATURE_NAME.findall(predicate))
+    return features or None
+
+
+def item_end(source: str, start: int) -> int:
+    """Offset right after the item starting at `start`: its closing brace, or its semicolon."""
+    depth = 0
+    pos = start
+    while pos < len(source):
+        char = source[pos]
+        if char in "\"'":
+            literal = (RUST_STRING if char == '"' else CHAR_LITERAL).match(source, pos)
+            if literal is not None:
+                pos = literal.end()
+                continue
+
+        if source.startswith("//", pos):
+            pos = source.find("\n", pos)
+            pos = len(source) if pos == -1 else pos
+            continue
+
+        if char == "{":
+            depth += 1
+
+        elif char == "}":
+            depth -= 1
+            if depth <= 0:
+                return pos + 1
+
+        elif char == ";" and depth == 0:
+            return pos + 1
+
+        pos += 1
+
+    return pos
+
+
+def gated_regions(source: str) -> Iterator[Tuple[Set[str], int, int]]:
+    """Yields (features, start, end) for each item of a file gated by features. A file wide gate spans the file."""
+    lines = source.splitlines(keepends=True)
+    offset = 0
+    pending: Set[str] = set()
+    for line in lines:
+        stripped = line.strip()
+        match = CFG_ATTRIBUTE.match(stripped)
+        if match is not None:
+            features = cfg_features(match.group(2))
+            if features and match.group(1):
+                yield features, 0, len(source)
+
+            elif features:
+                pending |= features
+
+        elif pending and stripped and not stripped.startswith(("#", "//")):
+            yield pending, offset, item_end(source, offset)
+            pending = set()
+
+        offset += len(line)
+
+
+def module_stem(path: pathlib.Path, name: Optional[str] = None) -> pathlib.Path:
+    """Path of a module without extension, for the file itself or for `mod name;` declared in it.
+
+    Files of the module are either `<stem>.rs` or under `<stem>/`.
+    """
+    if name is None:
+        return path.parent if path.name == "mod.rs" else path.with_suffix("")
+
+    directory = path.parent if path.name in ("lib.rs", "main.rs", "mod.rs") else path.with_suffix("")
+    return directory.joinpath(name)
+
+
+def source_gates(project_path: pathlib.Path) -> Tuple[Dict[str, Set[str]], Dict[str, List[Set[str]]]]:
+    """Maps the crate's feature gated sources to the features they require.
+
+    Returns:
+        Tuple[Dict, Dict]: features required by each gated file (relative path), features required by each string
+        literal, for every place it appears in
+    """
+    sources = {}
+    for root, directories, filenames in os.walk(project_path):
+        directories[:] = [d for d in directories if d not in IGNORED_DIRECTORIES and not d.startswith(".")]
+        for filename in filenames:
+            if filename.endswith(".rs") and filename != "build.rs":
+                path = pathlib.Path(root, filename)
+                sources[path.relative_to(project_path).as_posix()] = path.read_text(encoding="utf-8", errors="replace")
+
+    regions = {relative: list(gated_regions(source)) for relative, source in sources.items()}
+    module_gates: Dict[str, Set[str]] = {}
+    for relative, source in sources.items():
+        for features, start, end in regions[relative]:
+            if (start, end) == (0, len(source)):
+                stem = module_stem(pathlib.PurePosixPath(relative))
+
+            else:
+                match = MOD_DECLARATION.search(source[start:end])
+                if match is None:
+                    continue
+
+                stem = module_stem(pathlib.PurePosixPath(relative), match.group(1))
+
+            module_gates.setdefault(stem.as_posix(), set()).update(features)
+
+    file_gates: Dict[str, Set[str]] = {}
+    strings: Dict[str, List[Set[str]]] = {}
+    for relative, source in sources.items():
+        # Submodules of a gated module are gated too
+        inherited = set().union(
+            *[f for stem, f in module_gates.items() if relative == f"{stem}.rs" or relative.startswith(f"{stem}/")]
+        )
+        if inherited:
+            file_gates[relative] = inherited
+
+        for literal in STRING_LITERAL.finditer(source):
+            gates = inherited.union(*[f for f, start, end in regions[relative] if start <= literal.start() < end])
+            strings.setdefault(literal.group(1), []).append(gates)
+
+    return file_gates, strings
+
+
+def implied_features(table: Dict[str, List[str]], feature: str) -> Set[str]:
+    """Features enabled by a feature, itself included."""
+    implied = set()
+    stack = [feature]
+    while stack:
+        current = stack.pop()
+        if current in implied:
+            continue
+
+        implied.add(current)
+        stack += [f for f in table.get(current, []) if f in table]
+
+    return implied
+
+
+def minimal_features(table: Dict[str, List[str]], required: Set[str]) -> List[str]:
+    """Smallest list of features enabling all of `required`, on top of the default ones."""
+    enabled = implied_features(table, "default") if "default" in table else set()
+    kept = []
+    for feature in sorted(required, key=lambda f: (-len(implied_features(table, f)), f)):
+        if feature not in enabled:
+            kept.append(feature)
+            enabled |= implied_features(table, feature)
+
+    return sorted(kept)
+
+
+@functools.lru_cache(maxsize=4)
+def _read_target(target: pathlib.Path) -> bytes:
+    return target.read_bytes()
+
+
+def infer_features(crate: Crate, toml_path: pathlib.Path, target: pathlib.Path) -> List[str]:
+    """Features a crate was most likely built with in a target.
+
+    Feature gated source files whose path appears in the target (panic locations, debug info), and strings only
+    found in feature gated code, tell which features were enabled. Only the features the default ones do not
+    already enable are returned.
+    """
+    try:
+        manifest = toml.load(toml_path)
+
+    except (FileNotFoundError, toml.TomlDecodeError) as exc:
+        log.debug(f"Can't infer features of {crate}: {exc}")
+        return []
+
+    table = manifest.get("features", {})
+    optional = {
+        name
+        for section in ("dependencies", "build-dependencies")
+        for name, spec in manifest.get(section, {}).items()
+        if isinstance(spec, dict) and spec.get("optional", False)
+    }
+    # Optional dependencies are implicit features, unless a feature refers to them with dep:
+    known = set(table) | {name for name in optional if not any(f"dep:{name}" in v for v in table.values())}
+    table = {**{name: [] for name in known}, **table}
+    if not known - {"default"}:
+        return []
+
+    data = _read_target(target)
+    file_gates, strings = source_gates(toml_path.parent)
+    required = set()
+    prefix = f"{crate.name}-{crate.version}/"
+
+    for relative, features in file_gates.items():
+        candidates = (prefix + relative, prefix.replace("/", "\\") + relative.replace("/", "\\"))
+        if any(candidate.encode() in data for candidate in candidates):
+            log.debug(f"{crate}: {relative} found in target, requires {sorted(features)}")
+            required |= features
+
+    for literal, places in strings.items():
+        # A string also found in code that is not gated, or gated differently, tells nothing
+        if "\\" in literal or not all(places) or any(gates != places[0] for gates in places):
+            continue
+
+        if literal.encode() in data:
+            log.debug(f"{crate}: {literal!r} found in target, requires {sorted(places[0])}")
+            required |= places[0]
+
+    features = minimal_features(table, required & known)
+    log.info(f"{crate}: inferred features {features}")
+    return features
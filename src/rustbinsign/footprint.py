@@ -0,0 +1,83 @@
+import pathlib
+from typing import List, Tuple
+
+from pydantic import BaseModel
+from rich import print
+from rustbininfo import Crate
+
+from .logger import logger as log
+
+# Weight of each kind of trace. A source path is left by a panic location or debug info of code that was actually
+# linked, while a crate name in a symbol can come from a single inlined helper.
+SOURCE_PATH_WEIGHT = 4
+SYMBOL_WEIGHT = 1
+TYPE_PATH_WEIGHT = 1
+
+
+class Footprint(BaseModel):
+    crate: str  # name-version
+    source_paths: int = 0  # e.g .cargo/registry/src/index.crates.io-6f17d22bba15001f/serde-1.0.197/src/de/mod.rs
+    symbols: int = 0  # Crate name in mangled symbols, e.g _ZN5serde or Cs4xhM6ZLiMbN_5serde
+    type_paths: int = 0  # Crate name in type names and log targets, e.g serde::de::Error
+
+    @property
+    def score(self) -> int:
+        return (
+            SOURCE_PATH_WEIGHT * self.source_paths
+            + SYMBOL_WEIGHT * self.symbols
+            + TYPE_PATH_WEIGHT * self.type_paths
+        )
+
+    @property
+    def reason(self) -> str:
+        if self.score == 0:
+            return "no trace in target"
+
+        return f"{self.source_paths} source paths, {self.symbols} symbols, {self.type_paths} type paths"
+
+
+def crate_footprint(data: bytes, crate: Crate) -> Footprint:
+    ident = crate.name.replace("-", "_")
+    mangled = f"{len(ident)}{ident}".encode()
+    return Footprint(
+        crate=f"{crate.name}-{crate.version}",
+        source_paths=data.count(f"{crate.name}-{crate.version}/".encode()),
+        symbols=data.count(b"_ZN" + mangled) + data.count(b"_" + mangled),
+        type_paths=data.count(f"{ident}::".encode()),
+    )
+
+
+def rank_dependencies(target: pathlib.Path, dependencies: List[Crate]) -> List[Tuple[Crate, Footprint]]:
+    """Estimates how much of the target each crate accounts for, from the traces it left. Biggest first."""
+    data = target.read_bytes()
+    ranked = [(dep, crate_footprint(data, dep)) for dep in dependencies]
+    return sorted(ranked, key=lambda item: item[1].score, reverse=True)
+
+
+def select_dependencies(target: pathlib.Path, dependencies: List[Crate], min_footprint: int) -> List[Crate]:
+    """Drops the crates whose footprint in the target is below `min_footprint`, such as proc-macros, build
+    dependencies, or crates that were fully inlined, and reports them.
+
+    Returns:
+        List[Crate]: the crates worth building, biggest footprint first
+    """
+    if min_footprint <= 0:
+        return dependencies
+
+    ranked = rank_dependencies(target, dependencies)
+    if all(footprint.score == 0 for _, footprint in ranked):
+        # Nothing to go on, e.g a stripped binary built with panic = "abort" and trimmed paths
+        log.warning(f"No dependency left any trace in {target}, building all of them")
+        return dependencies
+
+    kept = [dep for dep, footprint in ranked if footprint.score >= min_footprint]
+    skipped = [footprint for _, footprint in ranked if footprint.score < min_footprint]
+    for _, footprint in ranked:
+        log.debug(f"{footprint.crate}: {footprint.score} ({footprint.reason})")
+
+    if skipped:
+        print(f"Skipping {len(skipped)}/{len(ranked)} dependencies with a footprint below {min_footprint}:")
+        for footprint in skipped:
+            print(f"\t{footprint.crate}: {footprint.score} ({footprint.reason})")
+
+    return kept
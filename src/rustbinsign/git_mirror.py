@@ -0,0 +1,101 @@
+import pathlib
+import shutil
+from typing import List, Optional
+
+from git import GitCommandError, Repo
+from rustbininfo import Crate
+
+from .logger import logger as log
+from .process import LIMITS
+from .util import file_lock, get_default_dest_dir, slugify
+
+
+def candidate_tags(crate: Crate) -> List[str]:
+    # Nothing standard, but most repos should have something like this
+    return [
+        f"{crate.name}-{crate.version}",
+        f"{crate.name}-v{crate.version}",
+        f"{crate.name}_{crate.version}",
+        f"{crate.name}_v{crate.version}",
+        f"{crate.version}",
+        f"v{crate.version}",
+    ]
+
+
+def get_mirror_path(url: str) -> pathlib.Path:
+    return get_default_dest_dir().joinpath("git", f"{slugify(url)}.git")
+
+
+def list_remote_tags(repo: Repo, url: str) -> List[str]:
+    tags = []
+    for line in repo.git.ls_remote("--tags", url, kill_after_timeout=LIMITS["git"].timeout).splitlines():
+        _, ref = line.split("\t", 1)
+        if ref.startswith("refs/tags/") and not ref.endswith("^{}"):
+            tags.append(ref[len("refs/tags/") :])
+
+    return tags
+
+
+def checkout_crate(crate: Crate) -> Optional[pathlib.Path]:
+    """Checks out the sources of `crate` from its repository in a dedicated worktree.
+
+    Every repository has a single bare mirror, to which only the tag matching the crate version is fetched,
+    shallowly. Each version gets its own worktree, so versions of the same crate can be built concurrently.
+
+    Returns:
+        Optional[pathlib.Path]: worktree path, None if the repository could not be fetched
+    """
+    url = crate.repository
+    worktree_path = get_default_dest_dir().joinpath("worktrees", f"{crate.name}-{crate.version}")
+    if worktree_path.joinpath(".git").exists():
+        log.debug(f"{worktree_path} already checked out")
+        return worktree_path
+
+    mirror_path = get_mirror_path(url)
+
+    with file_lock(mirror_path.with_suffix(".lock")):
+        repo = Repo(mirror_path) if mirror_path.exists() else Repo.init(mirror_path, bare=True, mkdir=True)
+
+        try:
+            remote_tags = list_remote_tags(repo, url)
+
+        except GitCommandError:
+            log.error(f"Could not list tags of {url}")
+            return None
+
+        found_tag = next((tag for tag in candidate_tags(crate) if tag in remote_tags), None)
+
+        if found_tag is not None:
+            log.debug(f"Found tag {found_tag}, fetching it")
+            ref = f"refs/tags/{found_tag}"
+
+        else:
+            log.warning(f"No tag matching {crate} in {url}, using the default branch")
+            ref = f"refs/rustbinsign/{crate.name}-{crate.version}"
+
+        try:
+            repo.git.fetch(
+                "--depth",
+                "1",
+                url,
+                f"+{ref if found_tag else 'HEAD'}:{ref}",
+                kill_after_timeout=LIMITS["git"].timeout,
+            )
+
+        except GitCommandError:
+            log.error(f"Could not fetch {url}")
+            return None
+
+        if worktree_path.exists():  # Leftover of an interrupted run
+            shutil.rmtree(worktree_path, ignore_errors=True)
+
+        try:
+            repo.git.worktree("prune")
+            repo.git.worktree("add", "--detach", str(worktree_path), f"{ref}^{{commit}}")
+
+        except GitCommandError as exc:
+            log.error(f"Could not check out {ref} of {url}: {exc}")
+            shutil.rmtree(worktree_path, ignore_errors=True)
+            return None
+
+    return worktree_path
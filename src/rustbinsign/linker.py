@@ -0,0 +1,90 @@
+import glob
+import pathlib
+import subprocess
+from typing import List, Optional
+
+from .logger import logger as log
+from .process import run_process
+from .util import get_installed_program_path
+
+FAST_LINKERS = ("mold", "lld", "rust-lld")  # Preference order of the "auto" mode
+
+
+def _mold_flags() -> Optional[List[str]]:
+    path = get_installed_program_path("mold")
+    if path is None:
+        return None
+
+    # mold ships an `ld` wrapper, found with -B by any gcc, while -fuse-ld=mold needs gcc >= 12.1
+    wrapper_dir = pathlib.Path(path).resolve().parent.parent.joinpath("libexec", "mold")
+    if wrapper_dir.joinpath("ld").exists():
+        return ["-C", f"link-arg=-B{wrapper_dir}"]
+
+    return ["-C", "link-arg=-fuse-ld=mold"]
+
+
+def _lld_flags() -> Optional[List[str]]:
+    if get_installed_program_path("ld.lld") is None:
+        return None
+
+    return ["-C", "link-arg=-fuse-ld=lld"]
+
+
+def _rust_lld_flags(version: str) -> Optional[List[str]]:
+    # Toolchains bundle lld, with an `ld.lld` wrapper that cc can be pointed to
+    try:
+        ret = run_process(
+            ["rustc", f"+{version}", "--print", "sysroot"],
+            "rustup",
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    except FileNotFoundError:
+        return None
+
+    if ret.returncode != 0:
+        return None
+
+    sysroot = ret.stdout.decode().strip()
+    wrappers = glob.glob(f"{sysroot}/lib/rustlib/*/bin/gcc-ld/ld.lld")
+    if not wrappers:
+        return None
+
+    return ["-C", "link-arg=-fuse-ld=lld", "-C", f"link-arg=-B{pathlib.Path(wrappers[0]).parent}"]
+
+
+def fast_linker_flags(mode: str, version: str, toolchain_name: Optional[str]) -> Optional[List[str]]:
+    """Rust flags making builds link with a fast linker.
+
+    Args:
+        mode (str): "auto", or one of FAST_LINKERS
+        version (str): toolchain version, to find the lld it bundles
+        toolchain_name (Optional[str]): target triple
+
+    Returns:
+        Optional[List[str]]: flags to add to RUSTFLAGS, None if no suitable linker was found
+    """
+    if toolchain_name is not None and "linux" not in toolchain_name:
+        log.warning(f"Fast linkers are only supported for linux targets, linking {toolchain_name} as usual")
+        return None
+
+    for linker in FAST_LINKERS if mode == "auto" else (mode,):
+        if linker == "mold":
+            flags = _mold_flags()
+
+        elif linker == "lld":
+            flags = _lld_flags()
+
+        elif linker == "rust-lld":
+            flags = _rust_lld_flags(version)
+
+        else:
+            raise ValueError(f"Unknown linker {linker}")
+
+        if flags is not None:
+            log.info(f"Linking with {linker}")
+            return flags
+
+    log.warning(f"No fast linker found ({mode}), linking as usual")
+    return None
@@ -0,0 +1,115 @@
+import pathlib
+from typing import Dict, List, Optional, Tuple
+
+import semver
+import toml
+from rustbininfo import Crate
+
+
+def pinned_versions(crates: List[Crate]) -> Dict[str, List[str]]:
+    """Versions of each crate found in a target, as expected by CompilationCtx.pinned_versions."""
+    pinned = {}
+    for crate in crates:
+        versions = pinned.setdefault(crate.name, [])
+        if crate.version not in versions:
+            versions.append(crate.version)
+
+    return pinned
+
+
+def compat_key(version: str) -> Optional[Tuple[int, ...]]:
+    """Part of a version that cargo keeps when resolving a caret requirement: 1.2.3 -> (1,), 0.2.3 -> (0, 2)."""
+    try:
+        parsed = semver.Version.parse(version)
+
+    except ValueError:
+        return None
+
+    if parsed.major:
+        return (parsed.major,)
+
+    if parsed.minor:
+        return (0, parsed.minor)
+
+    return (0, 0, parsed.patch)
+
+
+def locked_packages(lock_path: pathlib.Path) -> List[Tuple[str, str, str]]:
+    """(name, version, source) of every package of a Cargo.lock."""
+    try:
+        lock = toml.load(lock_path)
+
+    except (FileNotFoundError, toml.TomlDecodeError):
+        return []
+
+    return [(p["name"], p["version"], p.get("source", "")) for p in lock.get("package", [])]
+
+
+def lock_updates(lock_path: pathlib.Path, pinned: Dict[str, List[str]]) -> List[Tuple[str, str, str]]:
+    """Registry packages of a Cargo.lock that can be moved to a version observed in the target.
+
+    Only versions that are semver compatible with the locked one are considered, others would not satisfy the
+    requirements that led to it.
+
+    Returns:
+        List[Tuple[str, str, str]]: name, locked version, version to pin
+    """
+    updates = []
+    for name, version, source in locked_packages(lock_path):
+        if not source.startswith("registry+") or version in pinned.get(name, []):
+            continue
+
+        key = compat_key(version)
+        candidates = [v for v in pinned.get(name, []) if key is not None and compat_key(v) == key]
+        if candidates:
+            updates.append((name, version, candidates[0]))
+
+    return updates
+
+
+def _moved_reference(reference: str, moves: Dict[Tuple[str, str], str]) -> str:
+    # `name`, `name version` or `name version (source)`, depending on the lockfile version and ambiguities
+    parts = reference.split(" ")
+    if len(parts) > 1 and (parts[0], parts[1]) in moves:
+        parts[1] = moves[(parts[0], parts[1])]
+
+    return " ".join(parts)
+
+
+def rewrite_lock(
+    lock_path: pathlib.Path, updates: List[Tuple[str, str, str]], checksums: Dict[Tuple[str, str], Optional[str]]
+):
+    """Moves registry packages of a Cargo.lock to other versions, in any lockfile format.
+
+    The result is left for cargo to check: it keeps the new versions that satisfy every requirement, and refuses the
+    lockfile otherwise. Checksums are only known to cargo for versions it already locked once, they are taken from
+    `checksums` (by name and version), the entry has none when missing.
+
+    Args:
+        updates (List[Tuple[str, str, str]]): name, locked version, version to move to, see lock_updates
+    """
+    lock = toml.load(lock_path)
+    moves = {(name, version): target for name, version, target in updates}
+
+    for package in lock.get("package", []):
+        target = moves.get((package["name"], package["version"]))
+        if target is not None and package.get("source", "").startswith("registry+"):
+            package["version"] = target
+            package.pop("checksum", None)
+            if checksums.get((package["name"], target)):
+                package["checksum"] = checksums[(package["name"], target)]
+
+        if "dependencies" in package:
+            package["dependencies"] = [_moved_reference(dep, moves) for dep in package["dependencies"]]
+
+    # Format 1 keeps checksums apart, as `"checksum name version (source)" = "digest"`
+    metadata = lock.get("metadata", {})
+    for key in [key for key in metadata if key.startswith("checksum ")]:
+        moved = "checksum " + _moved_reference(key.removeprefix("checksum "), moves)
+        if moved != key:
+            del metadata[key]
+            name, version = moved.split(" ")[1:3]
+            if checksums.get((name, version)):
+                metadata[moved] = checksums[(name, version)]
+
+    lock_path.write_text(toml.dumps(lock), encoding="utf-8")
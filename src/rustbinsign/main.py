@@ -3,19 +3,30 @@ import logging
 import pathlib
 import sys
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from typing import Dict, Optional
 
 from rich import print
 from rustbininfo import (BasicProvider, Crate, TargetRustInfo,
                          get_min_max_update_time)
 
+from .crate_store import CRATES_DL_URL, CRATES_INDEX_URL, CrateStore, set_crate_store
+from .dist_mirror import DEFAULT_DIST_SERVER, dist_server_url, fill_mirror
+from .failure_cache import DEFAULT_TTL
 from .logger import get_log_handler, logger
+from .linker import FAST_LINKERS
+from .patches import get_patch_db
+from .process import set_limits
+from .profile_guess import guess_profile
+from .rustup import set_dist_server
 from .sig_providers.forced_ida.forced_ida import ForcedIDAProvider
 from .sig_providers.ida.ida import IDAProvider
+from .sig_providers.provider_base import BaseSigProvider
 from .subcommands.download import download_subcommand
+from .subcommands.matrix import build_matrix, sign_matrix_subcommand
 from .subcommands.sign import (compile_target_subcommand, sign_libs,
-                               sign_subcommand)
+                               sign_subcommand, stdlib_signature_name)
+from .subcommands.stdlib_range import expand_versions, sign_stdlib_range_subcommand
 from .toolchain import ToolchainFactory
-from .util import slugify
 
 DESCRIPTION = """This script aims at facilitate creation of signatures for rust executables. It can detect dependencies and rustc version used in a target, and create signatures using a signature provider."""
 
@@ -27,8 +38,10 @@ example_text = r"""Usage examples:
  rustbinsign -l DEBUG download_compile rand_chacha-0.3.1 1.70.0-x86_64-unknown-linux-gnu
  rustbinsign -l DEBUG compile --template ./profile/ctf.json /tmp/rustbininfo/rand_chacha-0.3.1/Cargo.toml 1.70.0-x86_64-unknown-linux-gnu
  rustbinsign -l DEBUG sign_stdlib --template ./profiles/ivanti_rust_sample.json -t 1.70.0-x86_64-unknown-linux-musl --provider IDA
+ rustbinsign -l DEBUG sign_stdlib_range 1.50.0..=1.67.1 -t x86_64-unknown-linux-gnu -t x86_64-unknown-linux-musl --provider IDA
  rustbinsign -l DEBUG get_std_lib 1.70.0-x86_64-unknown-linux-musl
  rustbinsign -l DEBUG sign_libs -l .\sha2-0.10.8\target\release\sha2.lib -l .\crypt-0.4.2\target\release\crypt.lib --provider IDA
+ rustbinsign -l DEBUG sign_matrix -t 1.70.0-x86_64-unknown-linux-gnu -t 1.70.0-x86_64-unknown-linux-musl --template ./profiles/ctf.json --template ./profiles/size_opt.json --provider IDA --target ./target --signature-name target_sig
  rustbinsign -l DEBUG sign_target -t stable-x86_64-pc-windows-gnu --template ./profiles/target.json  --provider IDA --target ./target.exe --no-std --signature_name target_sig
  """
 
@@ -43,6 +56,13 @@ def parse_args():
         dest="provider",
         help="Signature provider. This is the tool that will be used to create signatures.",
     )
+    provider.add_argument(
+        "--keep-debuginfo",
+        default=False,
+        action="store_true",
+        dest="keep_debuginfo",
+        help="Build with full debug info even if the provider only needs symbols.",
+    )
 
     signature_name_parser = ArgumentParser(add_help=False)
     signature_name_parser.add_argument(
@@ -60,6 +80,15 @@ def parse_args():
         action="store_true",
         help="Tries to compile with tests, benches and examples, to maximize code coverage. Gives the best results, but takes a long time !",
     )
+    full_compilation.add_argument(
+        "--min-extra-gain",
+        type=int,
+        default=0,
+        dest="min_extra_gain",
+        help="With --full-compilation, build tests, examples and benches one by one, and stop at the first one "
+        "bringing fewer new functions. Targets worth building are remembered. "
+        "0 builds them all (default: %(default)s).",
+    )
 
     toolchain_name_parser = ArgumentParser(add_help=False)
     toolchain_name_parser.add_argument(
@@ -89,10 +118,71 @@ def parse_args():
         "--template",
         type=str,
         dest="template",
-        help="Give a JSON file of the TOML modifications to operate before compilation.",
+        help="Give a JSON file of the TOML modifications to operate before compilation. "
+        "With compile_target and sign_target, `auto` guesses them from the target.",
         required=False,
     )
 
+    offline_parser = ArgumentParser(add_help=False)
+    offline_parser.add_argument(
+        "--vendor-dir",
+        type=pathlib.Path,
+        default=None,
+        dest="vendor_dir",
+        help="Build offline, using crates from this `cargo vendor` directory or local registry mirror only.",
+    )
+
+    linker_parser = ArgumentParser(add_help=False)
+    linker_parser.add_argument(
+        "--fast-linker",
+        choices=["auto", "none", *FAST_LINKERS],
+        default="none",
+        dest="fast_linker",
+        help="Link with mold or lld, which makes dylib builds faster. auto picks the first one available.",
+    )
+
+    component_parser = ArgumentParser(add_help=False)
+    component_parser.add_argument(
+        "--component",
+        action="append",
+        default=[],
+        dest="components",
+        help="Rustup component to install with the toolchain, e.g rustc-dev. Can be repeated.",
+    )
+
+    failure_cache_parser = ArgumentParser(add_help=False)
+    failure_cache_parser.add_argument(
+        "--retry-failed",
+        default=False,
+        action="store_true",
+        dest="retry_failed",
+        help="Build crates again even if they are known to fail with these settings.",
+    )
+    failure_cache_parser.add_argument(
+        "--failure-ttl",
+        type=float,
+        default=DEFAULT_TTL / 3600,
+        dest="failure_ttl",
+        help="Hours during which a failed build is not attempted again (default: %(default)s).",
+    )
+
+    traces_parser = ArgumentParser(add_help=False)
+    traces_parser.add_argument(
+        "--min-footprint",
+        type=int,
+        default=0,
+        dest="min_footprint",
+        help="Skip dependencies leaving fewer traces (source paths, symbols, type names) in the target. "
+        "0 builds them all (default: %(default)s).",
+    )
+    traces_parser.add_argument(
+        "--infer-features",
+        default=False,
+        action="store_true",
+        dest="infer_features",
+        help="Build each dependency with the features its traces in the target point to, instead of all of them.",
+    )
+
     compile_with_all_parser = ArgumentParser(add_help=False)
     compile_with_all_parser.add_argument(
         "-a",
@@ -120,6 +210,54 @@ def parse_args():
         default="INFO",
     )
 
+    parser.add_argument(
+        "--build-timeout",
+        type=float,
+        default=None,
+        help="Wall clock limit, in seconds, of each cargo and rustup invocation",
+    )
+    parser.add_argument(
+        "--build-cpu-time",
+        type=int,
+        default=None,
+        help="CPU time limit, in seconds, of each process spawned by cargo",
+    )
+    parser.add_argument(
+        "--build-memory-limit",
+        type=int,
+        default=None,
+        help="Address space limit, in MiB, of each process spawned by cargo",
+    )
+    parser.add_argument(
+        "--provider-timeout",
+        type=float,
+        default=None,
+        help="Wall clock limit, in seconds, of each signature provider invocation (idat, sigmake)",
+    )
+
+    parser.add_argument(
+        "--patch-db",
+        type=pathlib.Path,
+        action="append",
+        default=[],
+        help="Additional crate patch file, in the format of rustbinsign's patches.toml. Can be repeated",
+    )
+    parser.add_argument(
+        "--dist-server",
+        default=None,
+        help="Rustup dist server to install toolchains from: an URL, or a directory filled by mirror_toolchains",
+    )
+    parser.add_argument(
+        "--crates-index",
+        default=CRATES_INDEX_URL,
+        help="Sparse registry index to read crate checksums from, e.g a local crates.io mirror",
+    )
+    parser.add_argument(
+        "--crates-dl",
+        default=CRATES_DL_URL,
+        help="Server to download .crate archives from, e.g a local crates.io mirror",
+    )
+
     ## Subcommand parsers
     subparsers = parser.add_subparsers(dest="mode", title="mode", help="Mode to use")
 
@@ -135,7 +273,16 @@ def parse_args():
     download_sign_parser = subparsers.add_parser(
         "download_sign",
         help="Download a crate and signs it. Exemple: rand_chacha-0.3.1",
-        parents=[provider, signature_name_parser, profile_parser, template_parser, full_compilation],
+        parents=[
+            provider,
+            signature_name_parser,
+            profile_parser,
+            template_parser,
+            full_compilation,
+            offline_parser,
+            linker_parser,
+            component_parser,
+        ],
     )
 
     download_compile_parser = subparsers.add_parser(
@@ -145,6 +292,9 @@ def parse_args():
             profile_parser,
             template_parser,
             full_compilation,
+            offline_parser,
+            linker_parser,
+            component_parser,
         ],
         help="Download a crate and compiles it. Exemple: rand_chacha-0.3.1",
     )
@@ -158,6 +308,9 @@ def parse_args():
             profile_parser,
             template_parser,
             full_compilation,
+            offline_parser,
+            linker_parser,
+            component_parser,
         ],
     )
 
@@ -170,6 +323,11 @@ def parse_args():
             profile_parser,
             template_parser,
             full_compilation,
+            offline_parser,
+            linker_parser,
+            component_parser,
+            failure_cache_parser,
+            traces_parser,
         ],
     )
 
@@ -177,7 +335,12 @@ def parse_args():
     sign_stdlib_parser = subparsers.add_parser(
         "sign_stdlib",
         help="Sign standard lib toolchain",
-        parents=[provider, template_parser, profile_parser],
+        parents=[provider, template_parser, profile_parser, offline_parser, linker_parser, component_parser],
+    )
+    stdlib_range_parser = subparsers.add_parser(
+        "sign_stdlib_range",
+        help="Sign the standard lib of many toolchains, one signature each",
+        parents=[provider, template_parser, profile_parser, offline_parser, linker_parser, component_parser],
     )
     signature_parser = subparsers.add_parser(
         "sign_target",
@@ -189,6 +352,11 @@ def parse_args():
             profile_parser,
             template_parser,
             full_compilation,
+            offline_parser,
+            linker_parser,
+            component_parser,
+            failure_cache_parser,
+            traces_parser,
         ],
     )
     signature_lib_parser = subparsers.add_parser(
@@ -196,9 +364,23 @@ def parse_args():
         help="Generate a signature for a given list of libs, using choosed signature provider",
         parents=[provider, signature_name_parser],
     )
+    matrix_parser = subparsers.add_parser(
+        "sign_matrix",
+        help="Generate signatures for a given executable, for every combination of toolchain, profile and template",
+        parents=[
+            provider,
+            signature_name_parser,
+            full_compilation,
+            offline_parser,
+            linker_parser,
+            component_parser,
+            failure_cache_parser,
+            traces_parser,
+        ],
+    )
     std_parser = subparsers.add_parser(
         "get_std_lib",
-        parents=[profile_parser, template_parser],
+        parents=[profile_parser, template_parser, offline_parser, linker_parser, component_parser],
         help="Download stdlib with symbols for a specific version of rustc",
     )
 
@@ -216,6 +398,30 @@ def parse_args():
         required=True,
     )
 
+    stdlib_range_parser.add_argument(
+        "versions",
+        nargs="+",
+        help="Rust versions or ranges of releases, e.g 1.70.0, 1.50.0..1.60.0 (end excluded), 1.50.0..=1.60.0 "
+        "or 1.75.0..",
+    )
+    stdlib_range_parser.add_argument(
+        "-t",
+        "--target",
+        action="append",
+        default=[],
+        dest="targets",
+        help="Target triple to sign toolchains of. Can be repeated (default: x86_64-unknown-linux-gnu).",
+    )
+    stdlib_range_parser.add_argument(
+        "--manifest",
+        type=pathlib.Path,
+        default=pathlib.Path("sign_stdlib_range.json"),
+        help="Progress file, toolchains it records as signed are skipped (default: %(default)s)",
+    )
+    stdlib_range_parser.add_argument(
+        "-j", "--jobs", type=int, default=4, help="Toolchains to set up concurrently (default: %(default)s)"
+    )
+
     download_parser.add_argument("crate")
     download_parser.add_argument("--directory", required=False, default=None)
 
@@ -248,6 +454,46 @@ def parse_args():
         default=False,
     )
 
+    matrix_parser.add_argument("--target", type=pathlib.Path, required=True)
+    matrix_parser.add_argument(
+        "-t",
+        "--toolchain",
+        action="append",
+        required=True,
+        dest="toolchains",
+        help="Toolchain to build with, with version and target triple (e.g 1.70.0-x86_64-unknown-linux-musl). "
+        "Can be repeated",
+    )
+    matrix_parser.add_argument(
+        "-p",
+        "--profile",
+        choices=["release", "debug"],
+        action="append",
+        dest="profiles",
+        help="Profile to build with (default is release). Can be repeated",
+    )
+    matrix_parser.add_argument(
+        "--template",
+        type=pathlib.Path,
+        action="append",
+        dest="templates",
+        help="JSON file of the TOML modifications to operate before compilation. Can be repeated",
+    )
+    matrix_parser.add_argument(
+        "--no-std",
+        help="Don't sign std lib",
+        dest="no_std",
+        action="store_true",
+        default=False,
+    )
+    matrix_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=2,
+        help="Number of matrix cells to build concurrently (default: %(default)s)",
+    )
+
     signature_lib_parser.add_argument(
         "--lib", "-l", action="append", type=pathlib.Path, required=True
     )
@@ -260,9 +506,55 @@ def parse_args():
     )
     compiletime_parser.add_argument("target", type=pathlib.Path)
 
+    guess_profile_parser = subparsers.add_parser(
+        "guess_profile",
+        help="Guesses the profile settings a target was compiled with, and prints a matching template",
+    )
+    guess_profile_parser.add_argument("target", type=pathlib.Path)
+
+    mirror_parser = subparsers.add_parser(
+        "mirror_toolchains",
+        help="Downloads toolchains to a local rustup dist mirror, to install them from with --dist-server",
+    )
+    mirror_parser.add_argument("mirror_dir", type=pathlib.Path)
+    mirror_parser.add_argument("versions", nargs="+", help="Rust versions, e.g 1.70.0")
+    mirror_parser.add_argument(
+        "--target",
+        action="append",
+        default=[],
+        dest="targets",
+        help="Target triple to mirror toolchains of. Can be repeated (default: x86_64-unknown-linux-gnu).",
+    )
+    mirror_parser.add_argument(
+        "--component",
+        action="append",
+        default=[],
+        dest="components",
+        help="Rustup component to mirror on top of the minimal profile, e.g rustc-dev. Can be repeated.",
+    )
+    mirror_parser.add_argument("--upstream", default=DEFAULT_DIST_SERVER, help="Dist server to mirror")
+    mirror_parser.add_argument("-j", "--jobs", type=int, default=4, help="Concurrent downloads")
+
     return parser
 
 
+def setup_toolchain(
+    tc, args, template: Optional[Dict], provider: Optional[BaseSigProvider] = None, profile: Optional[str] = None
+):
+    """Applies the build options shared by every subcommand building crates, and installs the toolchain."""
+    lean = provider is not None and not provider.needs_dwarf and not args.keep_debuginfo
+    return (
+        tc.set_compilation_profile(profile or args.profile)
+        .set_compilation_template(template)
+        .set_vendor_dir(args.vendor_dir)
+        .set_fast_linker(args.fast_linker)
+        .set_lean_artifacts(lean)
+        .set_min_extra_gain(getattr(args, "min_extra_gain", 0))
+        .set_components(args.components)
+        .install()
+    )
+
+
 def main_cli():
     parser = parse_args()
     args = parser.parse_args()
@@ -277,7 +569,23 @@ def main_cli():
         logger.setLevel(getattr(logging, args.logLevel))
         logger.addHandler(get_log_handler())
 
-    if args.mode in ("download_sign", "sign_libs", "sign_target", "sign_stdlib"):
+    memory_limit = args.build_memory_limit * 1024 * 1024 if args.build_memory_limit else None
+    for kind in ("cargo", "rustup", "git"):
+        set_limits(kind, timeout=args.build_timeout)
+    set_limits("cargo", cpu_time=args.build_cpu_time, memory=memory_limit)
+    for kind in ("idat", "sigmake"):
+        set_limits(kind, timeout=args.provider_timeout)
+
+    for patch_file in args.patch_db:
+        get_patch_db().load(patch_file)
+
+    if args.dist_server is not None:
+        set_dist_server(dist_server_url(args.dist_server))
+
+    if args.crates_index != CRATES_INDEX_URL or args.crates_dl != CRATES_DL_URL:
+        set_crate_store(CrateStore(dl_url=args.crates_dl, index_url=args.crates_index))
+
+    if args.mode in ("download_sign", "sign_libs", "sign_target", "sign_stdlib", "sign_stdlib_range", "sign_matrix"):
         if args.provider == "IDA":
             provider = IDAProvider()
 
@@ -291,11 +599,24 @@ def main_cli():
         "compile",
         "compile_target",
         "sign_stdlib",
+        "sign_stdlib_range",
         "download_compile",
         "download_sign",
         "sign_target",
     ):
-        if args.template:
+        if args.template == "auto":
+            if args.mode not in ("compile_target", "sign_target"):
+                print("--template auto needs a target, use it with compile_target or sign_target", file=sys.stderr)
+                sys.exit(1)
+
+            guess = guess_profile(pathlib.Path(args.target))
+            for evidence in guess.evidence:
+                logger.info(f"Profile guess: {evidence}")
+
+            template = guess.to_template()
+            args.profile = guess.profile
+
+        elif args.template:
             template = json.load(open(args.template, "r", encoding="utf-8"))
 
     if args.mode in (
@@ -307,12 +628,7 @@ def main_cli():
         "sign_stdlib",
         "get_std_lib",
     ):
-        tc = (
-            ToolchainFactory.from_target_triplet(args.toolchain)
-            .set_compilation_profile(args.profile)
-            .set_compilation_template(template)
-            .install()
-        )
+        tc = setup_toolchain(ToolchainFactory.from_target_triplet(args.toolchain), args, template, provider)
 
     match args.mode:
         case "info":
@@ -332,12 +648,7 @@ def main_cli():
         case "compile_target":
             if not args.toolchain:
                 _, version = BasicProvider().get_rustc_version(pathlib.Path(args.target))
-                tc = (
-                    ToolchainFactory.from_version(version)
-                    .set_compilation_profile(args.profile)
-                    .set_compilation_template(template)
-                    .install()
-                )
+                tc = setup_toolchain(ToolchainFactory.from_version(version), args, template, provider)
 
             libs, fails = compile_target_subcommand(
                 pathlib.Path(args.target),
@@ -345,6 +656,10 @@ def main_cli():
                 args.profile,
                 template,
                 compile_all=args.full_compilation,
+                retry_failed=args.retry_failed,
+                failure_ttl=args.failure_ttl * 3600,
+                min_footprint=args.min_footprint,
+                infer_features=args.infer_features,
             )
             [print(lib) for lib in libs]
             [print(f"Failed to compile: {fail}", file=sys.stderr) for fail in fails]
@@ -368,12 +683,7 @@ def main_cli():
         case "sign_target":
             if not args.toolchain:
                 _, version = BasicProvider().get_rustc_version(pathlib.Path(args.target))
-                tc = (
-                    ToolchainFactory.from_version(version)
-                    .set_compilation_profile(args.profile)
-                    .set_compilation_template(template)
-                    .install()
-                )
+                tc = setup_toolchain(ToolchainFactory.from_version(version), args, template, provider)
 
             sign_subcommand(
                 provider,
@@ -384,14 +694,50 @@ def main_cli():
                 not args.no_std,
                 template,
                 compile_all=args.full_compilation,
+                retry_failed=args.retry_failed,
+                failure_ttl=args.failure_ttl * 3600,
+                min_footprint=args.min_footprint,
+                infer_features=args.infer_features,
+            )
+
+        case "sign_matrix":
+            cells = build_matrix(args.toolchains, args.profiles or ["release"], args.templates or [None])
+            sign_matrix_subcommand(
+                provider,
+                args.target,
+                args.signature_name,
+                cells,
+                lambda triple, profile, cell_template: setup_toolchain(
+                    ToolchainFactory.from_target_triplet(triple), args, cell_template, provider, profile
+                ),
+                sign_std=not args.no_std,
+                compile_all=args.full_compilation,
+                retry_failed=args.retry_failed,
+                failure_ttl=args.failure_ttl * 3600,
+                jobs=args.jobs,
+                min_footprint=args.min_footprint,
+                infer_features=args.infer_features,
             )
 
         case "sign_stdlib":
-            template = template or "default"
-            signame = f"{tc.name}-{args.profile}-{slugify(template)}"
+            signame = stdlib_signature_name(tc.name, args.profile, template)
             sign_libs(provider, tc.get_libs(), signame)
             print(f"Generated : {signame}.sig")
 
+        case "sign_stdlib_range":
+            sign_stdlib_range_subcommand(
+                provider,
+                expand_versions(args.versions),
+                args.targets or ["x86_64-unknown-linux-gnu"],
+                lambda toolchain: setup_toolchain(
+                    ToolchainFactory.from_target_triplet(toolchain), args, template, provider
+                ),
+                args.profile,
+                template,
+                args.manifest,
+                args.jobs,
+            )
+
         case "get_std_lib":
             for lib in tc.get_libs():
                 print(lib)
@@ -401,6 +747,27 @@ def main_cli():
             min_date, max_date = get_min_max_update_time(ti.dependencies)
             print(f"Latest dependency was added between {min_date} and {max_date}")
 
+        case "guess_profile":
+            guess = guess_profile(args.target)
+            for evidence in guess.evidence:
+                print(f"- {evidence}", file=sys.stderr)
+
+            print(f"Use with --profile {guess.profile}", file=sys.stderr)
+            sys.stdout.write(json.dumps(guess.to_template(), indent=4) + "\n")
+
+        case "mirror_toolchains":
+            files = fill_mirror(
+                args.mirror_dir,
+                args.versions,
+                args.targets or ["x86_64-unknown-linux-gnu"],
+                args.components,
+                args.upstream,
+                args.jobs,
+            )
+            size = sum(f.stat().st_size for f in files)
+            print(f"{len(files)} files ({size / 2**20:.0f} MiB) in {args.mirror_dir}")
+            print(f"Install from it with --dist-server {args.mirror_dir.resolve()}")
+
 
 if __name__ == "__main__":
     main_cli()
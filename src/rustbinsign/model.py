@@ -1,4 +1,5 @@
-from typing import Dict, Optional
+import pathlib
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel
 
@@ -21,3 +22,17 @@ class CompilationCtx(BaseModel):
     }
     lib: bool = True
     env: Optional[dict] = {}  # Additional env variable to use compile time
+    pinned_versions: Dict[str, List[str]] = {}  # Versions of dependencies to lock builds to, by crate name
+    min_extra_gain: int = 0  # New functions an extra target must bring to be worth building, 0 builds all of them
+    infer_features_from: Optional[pathlib.Path] = None  # Target to guess crate features from, None builds them all
+
+
+class BuildPlan(BaseModel):
+    """How cargo should be invoked to build a project with a given template."""
+
+    project_path: pathlib.Path
+    verb: str = "build"
+    args: List[str] = []
+    env: Dict[str, str] = {}
+    target_dir: Optional[pathlib.Path] = None  # None means cargo's default, <project>/target
+    workspace_root: Optional[pathlib.Path] = None  # Where Cargo.lock is, None means project_path
@@ -0,0 +1,175 @@
+import copy
+import hashlib
+import json
+import pathlib
+import re
+from typing import Any, Dict, List, Optional
+
+import semver
+import toml
+from pydantic import BaseModel
+from rustbininfo import Crate
+
+from .logger import logger as log
+from .util import replace_file
+
+BUILTIN_PATCHES = pathlib.Path(__file__).parent.joinpath("patches.toml")
+CONSTRAINT = re.compile(r"\s*(>=|<=|==|!=|>|<|=)?\s*([0-9][0-9A-Za-z.+-]*)\s*")
+
+
+class TextPatch(BaseModel):
+    file: str  # Relative to the crate root
+    old: str
+    new: str
+
+
+class CratePatch(BaseModel):
+    versions: str = ""
+    targets: List[str] = []
+    reason: str = ""
+    set: Dict[str, Any] = {}
+    remove: List[str] = []
+    remove_features: Dict[str, List[str]] = {}
+    replace: List[TextPatch] = []
+
+    def matches(self, version: str, target: Optional[str]) -> bool:
+        if self.targets and target not in self.targets:
+            return False
+
+        return version_matches(version, self.versions)
+
+
+def version_matches(version: str, constraints: str) -> bool:
+    """Tells whether `version` satisfies every comma separated constraint, such as ">=0.14, <1"."""
+    try:
+        parsed = semver.Version.parse(version, optional_minor_and_patch=True)
+
+    except ValueError:
+        log.debug(f"Can't compare version {version}")
+        return False
+
+    for constraint in filter(str.strip, constraints.split(",")):
+        match = CONSTRAINT.fullmatch(constraint)
+        if match is None:
+            raise ValueError(f"Invalid version constraint {constraint!r}")
+
+        operator = {None: "==", "=": "=="}.get(match.group(1), match.group(1))
+        bound = semver.Version.parse(match.group(2), optional_minor_and_patch=True)
+        if not parsed.match(f"{operator}{bound}"):
+            return False
+
+    return True
+
+
+def _split_key(key: str) -> List[str]:
+    # Dotted TOML keys, with optional quoting: target."cfg(unix)".dependencies
+    return [quoted or bare for quoted, bare in re.findall(r'"([^"]*)"|([^.]+)', key)]
+
+
+def _parent_table(manifest: Dict, key: str, create: bool = False) -> Optional[tuple]:
+    *path, last = _split_key(key)
+    table = manifest
+    for part in path:
+        if part not in table and create:
+            table[part] = {}
+
+        table = table.get(part)
+        if not isinstance(table, dict):
+            return None
+
+    return table, last
+
+
+def patch_manifest(manifest: Dict, patch: CratePatch) -> Dict:
+    """Returns the manifest obtained by applying `patch` over `manifest`, without modifying either."""
+    manifest = copy.deepcopy(manifest)
+
+    for key, value in patch.set.items():
+        table, last = _parent_table(manifest, key, create=True)
+        table[last] = value
+
+    for key in patch.remove:
+        parent = _parent_table(manifest, key)
+        if parent is not None:
+            parent[0].pop(parent[1], None)
+
+    for key, features in patch.remove_features.items():
+        parent = _parent_table(manifest, key)
+        dependency = parent[0].get(parent[1]) if parent is not None else None
+        if isinstance(dependency, dict) and "features" in dependency:
+            dependency["features"] = [f for f in dependency["features"] if f not in features]
+
+    return manifest
+
+
+def apply_patches(project_path: pathlib.Path, patches: List[CratePatch]) -> bool:
+    """Applies patches to the sources of a crate. Applying them again is a no-op.
+
+    Files are replaced rather than rewritten in place, so hard links to them are left untouched.
+
+    Returns:
+        bool: True if any file was modified
+    """
+    toml_path = pathlib.Path(project_path).joinpath("Cargo.toml")
+    manifest = toml.load(toml_path)
+    patched = manifest
+    changed = False
+
+    for patch in patches:
+        log.info(f"Patching {project_path.name}: {patch.reason or 'known build fix'}")
+        patched = patch_manifest(patched, patch)
+
+        for text in patch.replace:
+            path = project_path.joinpath(text.file)
+            content = path.read_text(encoding="utf-8")
+            if text.old in content:
+                replace_file(path, content.replace(text.old, text.new))
+                changed = True
+
+    if patched != manifest:
+        replace_file(toml_path, toml.dumps(patched))
+        changed = True
+
+    return changed
+
+
+def patches_hash(patches: List[CratePatch]) -> str:
+    return hashlib.sha256(json.dumps([p.model_dump() for p in patches], sort_keys=True).encode()).hexdigest()
+
+
+class PatchDB:
+    """Known build fixes of crates, indexed by crate name.
+
+    Usage example:
+    >>> db = PatchDB()
+    >>> db.load("./my_patches.toml")
+    >>> patches = db.find(crate, "x86_64-unknown-linux-musl")
+    """
+
+    entries: Dict[str, List[CratePatch]]
+
+    def __init__(self):
+        self.entries = {}
+
+    def load(self, path: pathlib.Path):
+        """Adds the entries of a patch file, see patches.toml for its format."""
+        for name, patches in toml.load(path).items():
+            if isinstance(patches, dict):
+                patches = [patches]
+
+            self.entries.setdefault(name, []).extend(CratePatch(**patch) for patch in patches)
+
+    def find(self, crate: Crate, target: Optional[str] = None) -> List[CratePatch]:
+        return [patch for patch in self.entries.get(crate.name, []) if patch.matches(crate.version, target)]
+
+
+_default_db: Optional[PatchDB] = None
+
+
+def get_patch_db() -> PatchDB:
+    global _default_db
+    if _default_db is None:
+        _default_db = PatchDB()
+        _default_db.load(BUILTIN_PATCHES)
+
+    return _default_db
@@ -0,0 +1,132 @@
+import os
+import shutil
+import signal
+import subprocess
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+from .exceptions import ProcessTimeoutError
+from .logger import logger as log
+
+
+class ProcessLimits(BaseModel):
+    timeout: Optional[float] = None  # Wall clock, in seconds
+    cpu_time: Optional[int] = None  # CPU seconds, enforced per process of the tree (RLIMIT_CPU)
+    memory: Optional[int] = None  # Address space in bytes, enforced per process of the tree (RLIMIT_AS)
+
+
+# Limits of each kind of external process, None means unlimited
+LIMITS: Dict[str, ProcessLimits] = {
+    "cargo": ProcessLimits(),
+    "rustup": ProcessLimits(),
+    "rustc-dev": ProcessLimits(timeout=120),
+    "git": ProcessLimits(),
+    "idat": ProcessLimits(),
+    "sigmake": ProcessLimits(),
+}
+
+
+def set_limits(
+    kind: str,
+    timeout: Optional[float] = None,
+    cpu_time: Optional[int] = None,
+    memory: Optional[int] = None,
+):
+    limits = LIMITS.setdefault(kind, ProcessLimits())
+    if timeout is not None:
+        limits.timeout = timeout
+
+    if cpu_time is not None:
+        limits.cpu_time = cpu_time
+
+    if memory is not None:
+        limits.memory = memory
+
+
+def _prlimit_args(limits: ProcessLimits) -> List[str]:
+    """util-linux `prlimit` command line applying `limits` to the command that follows it."""
+    args = [shutil.which("prlimit")]
+    if limits.cpu_time is not None:
+        args.append(f"--cpu={limits.cpu_time}")
+
+    if limits.memory is not None:
+        args.append(f"--as={limits.memory}")
+
+    return args + ["--"]
+
+
+def _set_rlimits(pid: int, limits: ProcessLimits):
+    """Applies `limits` to a running process. Children it spawned already are not limited."""
+    import resource
+
+    try:
+        if limits.cpu_time is not None:
+            resource.prlimit(pid, resource.RLIMIT_CPU, (limits.cpu_time, limits.cpu_time))
+
+        if limits.memory is not None:
+            resource.prlimit(pid, resource.RLIMIT_AS, (limits.memory, limits.memory))
+
+    except (OSError, AttributeError) as exc:  # Exited already, or no prlimit on this platform
+        log.debug(f"Could not limit process {pid}: {exc}")
+
+
+def _kill_process_tree(proc: subprocess.Popen):
+    try:
+        if os.name == "nt":
+            subprocess.run(
+                ["taskkill", "/F", "/T", "/PID", str(proc.pid)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+
+    except OSError:
+        pass
+
+    proc.kill()
+
+
+def run_process(args: List[str], kind: str, check: bool = False, **kwargs) -> subprocess.CompletedProcess:
+    """Drop-in replacement for `subprocess.run`, applying the limits configured for `kind`.
+
+    The process runs in its own process group, which is killed as a whole when the timeout expires.
+
+    Raises:
+        ProcessTimeoutError: the process ran for longer than its timeout
+    """
+    limits = LIMITS.get(kind, ProcessLimits())
+
+    if os.name == "nt":
+        kwargs.setdefault("creationflags", subprocess.CREATE_NEW_PROCESS_GROUP)
+
+    else:
+        kwargs.setdefault("start_new_session", True)
+
+    # Not through preexec_fn, which can deadlock the child when the parent runs threads
+    rlimited = os.name != "nt" and (limits.cpu_time is not None or limits.memory is not None)
+    wrapped = rlimited and shutil.which("prlimit") is not None
+    with subprocess.Popen(_prlimit_args(limits) + list(args) if wrapped else args, **kwargs) as proc:
+        if rlimited and not wrapped:
+            _set_rlimits(proc.pid, limits)
+
+        try:
+            stdout, stderr = proc.communicate(timeout=limits.timeout)
+
+        except subprocess.TimeoutExpired:
+            log.error(f"{kind} timed out after {limits.timeout}s: {' '.join(map(str, args))}")
+            _kill_process_tree(proc)
+            proc.communicate()
+            raise ProcessTimeoutError(kind, limits.timeout)
+
+        except BaseException:
+            _kill_process_tree(proc)
+            raise
+
+    ret = subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
+    if check:
+        ret.check_returncode()
+
+    return ret
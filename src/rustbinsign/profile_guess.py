@@ -0,0 +1,118 @@
+import collections
+import hashlib
+import pathlib
+from typing import Dict, List, Optional, Union
+
+from pydantic import BaseModel
+
+from .binary import Binary
+from .logger import logger as log
+
+# Most of a target is made of its dependencies. Functions are aligned on 16 bytes unless optimizing for size, but
+# the precompiled standard library always is, so the ratio never gets close to 0.
+SIZE_OPT_ALIGNMENT = 0.75
+# Without LTO, generic functions get instantiated once per codegen unit, and identical copies pile up
+LTO_DUPLICATES = 0.003
+MIN_DUPLICATE_SIZE = 16  # Smaller functions are identical too often to tell anything
+
+OVERFLOW_MESSAGES = (
+    b"attempt to add with overflow",
+    b"attempt to subtract with overflow",
+    b"attempt to multiply with overflow",
+)
+# Only linked along the panic_unwind runtime. The precompiled standard library brings its landing pads with either
+# strategy, so they only tell the strategy apart when there are none.
+UNWIND_MARKERS = (b"_Unwind_RaiseException", b"panic_unwind", b"_CxxThrowException")
+
+
+class ProfileGuess(BaseModel):
+    profile: str = "release"  # As in --profile: release or debug
+    # Only size ("z") or speed (3) optimizations: "s" and "z" align functions alike, and so do 1, 2 and 3
+    opt_level: Union[int, str] = 3
+    panic: str = "unwind"
+    lto: bool = False
+    codegen_units: Optional[int] = None  # None means cargo's default
+    evidence: List[str] = []
+
+    def to_template(self) -> Dict:
+        """Compilation template building code as close as possible to the target's.
+
+        Targets built with opt-level "s", 1 or 2 get "z" or 3 instead, the closest level the guess can tell.
+        """
+        settings = {"debug": 2, "strip": "none", "opt-level": self.opt_level, "panic": self.panic}
+        if self.lto:
+            settings["lto"] = True
+
+        if self.codegen_units is not None:
+            settings["codegen-units"] = self.codegen_units
+
+        return {"profile": {"release" if self.profile == "release" else "dev": settings}}
+
+
+def duplicate_ratio(binary: Binary, functions) -> float:
+    bodies = collections.Counter(
+        hashlib.sha1(binary.read(f.start, f.size)).digest() for f in functions if f.size >= MIN_DUPLICATE_SIZE
+    )
+    total = sum(bodies.values())
+    return sum(count - 1 for count in bodies.values()) / total if total else 0.0
+
+
+def guess_profile(target: pathlib.Path) -> ProfileGuess:
+    """Estimates the cargo profile settings a target was built with.
+
+    - debug profile: overflow checks panic messages are only linked when overflow checks are enabled
+    - panic strategy: without any landing pad (an LSDA, or an exception handler on PE) nothing can unwind.
+      Otherwise, the panic_unwind runtime is only linked with panic = "unwind"
+    - opt-level: function starts are not aligned when optimizing for size. This only tells size from speed
+      optimizations, opt-level is guessed as either "z" or 3, never "s", 1 or 2
+    - LTO: identical copies of generic functions are merged
+    - codegen-units: not observable on its own, set to 1 along size optimizations and LTO, as it usually is
+    """
+    binary = Binary(target)
+    guess = ProfileGuess()
+
+    if any(message in binary.data for message in OVERFLOW_MESSAGES):
+        guess.profile = "debug"
+        guess.opt_level = 0
+        guess.evidence.append("overflow check messages found: debug profile")
+
+    functions = binary.functions()
+    landing_pads = sum(f.has_landing_pads for f in functions)
+    if functions and not landing_pads:
+        guess.panic = "abort"
+        guess.evidence.append("no function has landing pads: panic = abort")
+
+    elif not any(marker in binary.data for marker in UNWIND_MARKERS):
+        guess.panic = "abort"
+        guess.evidence.append(f"{landing_pads} functions with landing pads, but no unwinding runtime: panic = abort")
+
+    else:
+        guess.evidence.append(f"{landing_pads} functions with landing pads and an unwinding runtime: panic = unwind")
+
+    if not functions:
+        guess.evidence.append("no unwind information, can't tell opt-level nor LTO")
+        log.warning(f"{target} has no unwind information, the profile guess is partial")
+        return guess
+
+    aligned = sum(f.start % 16 == 0 for f in functions) / len(functions)
+    duplicates = duplicate_ratio(binary, functions)
+    log.debug(f"{len(functions)} functions, {aligned:.2f} aligned, {duplicates:.4f} duplicated")
+
+    if guess.profile == "release":
+        if aligned < SIZE_OPT_ALIGNMENT:
+            guess.opt_level = "z"
+            guess.evidence.append(f"{aligned:.0%} of functions aligned on 16 bytes: opt-level s or z")
+
+        else:
+            guess.evidence.append(f"{aligned:.0%} of functions aligned on 16 bytes: opt-level 1 to 3")
+
+        if duplicates < LTO_DUPLICATES:
+            guess.lto = True
+            guess.evidence.append(f"{duplicates:.2%} of function bodies duplicated: LTO")
+            if guess.opt_level == "z":
+                guess.codegen_units = 1
+
+        else:
+            guess.evidence.append(f"{duplicates:.2%} of function bodies duplicated: no LTO")
+
+    return guess
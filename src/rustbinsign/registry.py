@@ -0,0 +1,114 @@
+import json
+import os
+import pathlib
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+from .logger import logger as log
+from .rustup import find_toolchain_dir, get_rustup_home
+from .util import file_lock, get_default_dest_dir
+
+
+class LibEntry(BaseModel):
+    path: pathlib.Path
+    size: int
+
+
+class LibsEntry(BaseModel):
+    mtime: int  # Newest mtime (ns) of the directories the libraries were listed from
+    libs: List[LibEntry]
+
+
+def directories_mtime(root: pathlib.Path, patterns: List[str]) -> int:
+    mtime = 0
+    for directory in {root.joinpath(pattern).parent for pattern in patterns}:
+        try:
+            mtime = max(mtime, directory.stat().st_mtime_ns)
+
+        except FileNotFoundError:
+            pass
+
+    return mtime
+
+
+class ToolchainRegistry:
+    """Persistent record of installed toolchains: where they are, and the libraries of their standard library.
+
+    Entries are checked against the mtime of the directories they were built from, so a lookup costs a few
+    stat calls instead of running rustup and walking the toolchains.
+
+    Usage example:
+    >>> registry = get_toolchain_registry()
+    >>> tc_dir = registry.find_toolchain_dir("1.70.0", "x86_64-unknown-linux-gnu")
+    >>> libs = registry.libs(tc_dir, ["lib/rustlib/x86_64-unknown-linux-gnu/lib/*.so"])
+    """
+
+    path: pathlib.Path
+
+    def __init__(self, path: Optional[pathlib.Path] = None):
+        self.path = pathlib.Path(path) if path is not None else get_default_dest_dir().joinpath("toolchains.json")
+
+    def _load(self) -> Dict:
+        try:
+            registry = json.loads(self.path.read_text(encoding="utf-8"))
+
+        except (FileNotFoundError, ValueError):
+            return {}
+
+        # Entries of another rustup installation are useless
+        return registry if registry.get("rustup_home") == get_rustup_home() else {}
+
+    def _update(self, section: str, key: str, value):
+        with file_lock(self.path.with_suffix(".lock")):
+            registry = self._load()
+            registry["rustup_home"] = get_rustup_home()
+            registry.setdefault(section, {})[key] = value
+            tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+            tmp_path.write_text(json.dumps(registry, indent=1), encoding="utf-8")
+            os.replace(tmp_path, self.path)
+
+    def find_toolchain_dir(self, version: str, toolchain_name: Optional[str]) -> Optional[pathlib.Path]:
+        """Installation directory of a toolchain, see rustup.find_toolchain_dir."""
+        key = f"{version}|{toolchain_name}"
+        cached = self._load().get("toolchains", {}).get(key)
+        if cached is not None:
+            tc_dir = pathlib.Path(cached)
+            # Without a triple, the toolchain is the host's and any of its stdlibs will do
+            stdlib = tc_dir.joinpath("lib", "rustlib", toolchain_name, "lib") if toolchain_name else tc_dir
+            if stdlib.exists() and any(tc_dir.joinpath("bin").glob("rustc*")):
+                return tc_dir
+
+        tc_dir = find_toolchain_dir(version, toolchain_name)
+        if tc_dir is not None:
+            self._update("toolchains", key, str(tc_dir))
+
+        return tc_dir
+
+    def libs(self, tc_dir: pathlib.Path, patterns: List[str]) -> List[LibEntry]:
+        """Files of a toolchain matching glob `patterns`, relative to its directory, with their size."""
+        key = f"{tc_dir}|{'|'.join(patterns)}"
+        mtime = directories_mtime(tc_dir, patterns)
+        cached = self._load().get("libs", {}).get(key)
+        if cached is not None and cached["mtime"] == mtime:
+            return LibsEntry(**cached).libs
+
+        log.debug(f"Listing libraries of {tc_dir}")
+        libs = [
+            LibEntry(path=path, size=path.stat().st_size)
+            for pattern in patterns
+            for path in sorted(tc_dir.glob(pattern))
+        ]
+        self._update("libs", key, LibsEntry(mtime=mtime, libs=libs).model_dump(mode="json"))
+        return libs
+
+
+_default_registry: Optional[ToolchainRegistry] = None
+
+
+def get_toolchain_registry() -> ToolchainRegistry:
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = ToolchainRegistry()
+
+    return _default_registry
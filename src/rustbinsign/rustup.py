@@ -1,46 +1,156 @@
+import functools
+import os
+import pathlib
+import re
 import shlex
 import subprocess
+from typing import Iterable, Optional
 
+from .exceptions import InvalidToolchainError, ProcessTimeoutError
 from .logger import logger
+from .process import LIMITS, run_process
+from .util import file_lock, get_default_dest_dir
 
+DATED_TOOLCHAIN = re.compile(r"\d{4}-\d{2}-\d{2}-")
+_dist_server: Optional[str] = None
 
-def rustup_install_toolchain(version, toolchain_name):
+
+def set_dist_server(server: Optional[str]):
+    """Installs toolchains from another dist server than rustup's default, e.g a mirror filled by fill_mirror."""
+    global _dist_server
+    _dist_server = server
+
+
+def _rustup_env() -> Optional[dict]:
+    if _dist_server is None:
+        return None
+
+    return os.environ | {"RUSTUP_DIST_SERVER": _dist_server}
+
+
+def is_toolchain_installed(version, toolchain_name) -> bool:
+    """Whether a toolchain of `version` with the standard library of `toolchain_name` is installed."""
+    return find_toolchain_dir(version, toolchain_name) is not None
+
+
+def find_toolchain_dir(version, toolchain_name) -> Optional[pathlib.Path]:
+    """Installation directory of a toolchain of `version` with the standard library of `toolchain_name`, of any
+    target if it is None."""
+    tc_path = pathlib.Path(get_rustup_home()).joinpath("toolchains")
+    if not tc_path.exists():
+        return None
+
+    # <version>-<host triple>, where "nightly-" also prefixes dated toolchains such as nightly-2023-06-01-<host>
+    candidates = [
+        directory
+        for directory in os.listdir(tc_path)
+        if directory.startswith(f"{version}-") and not DATED_TOOLCHAIN.match(directory[len(version) + 1 :])
+    ]
+    # The toolchain of the target's host first, if it is installed
+    candidates.sort(key=lambda directory: (directory != f"{version}-{toolchain_name}", directory))
+
+    for directory in candidates:
+        path = tc_path.joinpath(directory)
+        if (toolchain_name is None or path.joinpath("lib", "rustlib", toolchain_name, "lib").exists()) and any(
+            path.joinpath("bin").glob("rustc*")
+        ):
+            return path
+
+    return None
+
+
+def has_component(version, toolchain_name, component: str) -> bool:
+    tc_dir = find_toolchain_dir(version, toolchain_name)
+    if tc_dir is None:
+        return False
+
+    try:
+        installed = tc_dir.joinpath("lib", "rustlib", "components").read_text().split()
+
+    except FileNotFoundError:
+        return False
+
+    return any(name == component or name.startswith(f"{component}-") for name in installed)
+
+
+def rustup_install_toolchain(version, toolchain_name, offline: bool = False, components: Iterable[str] = ()):
+    """Installs a toolchain and the standard library of `toolchain_name`, unless they are already there.
+
+    Components such as rustc-dev are large and seldom needed, they are only added when asked for. Toolchains
+    can be installed concurrently, installations of the same one are serialized.
+    """
+    components = [c for c in components if not has_component(version, toolchain_name, c)]
+    if is_toolchain_installed(version, toolchain_name) and not components:
+        logger.debug(f"Toolchain {version}-{toolchain_name} already installed")
+        return
+
+    if offline:
+        raise InvalidToolchainError(
+            f"Toolchain {version}-{toolchain_name} or components {components} are not installed, "
+            "can't install them offline"
+        )
+
+    with file_lock(get_default_dest_dir().joinpath("locks", f"rustup-{version}-{toolchain_name}.lock")):
+        if not is_toolchain_installed(version, toolchain_name):
+            _rustup_install(version, toolchain_name)
+
+        for component in components:
+            rustup_add_component(version, toolchain_name, component)
+
+
+def _rustup_install(version, toolchain_name):
     logger.info("Adding target with rustup")
-    subprocess.run(
-        shlex.split(f"rustup target add {toolchain_name}"),
-        check=True,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-    )
+    with file_lock(get_default_dest_dir().joinpath("locks", "rustup-default.lock")):
+        run_process(
+            shlex.split(f"rustup target add {toolchain_name}"),
+            "rustup",
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env=_rustup_env(),
+        )
     logger.info("Adding specific target version with rustup")
-    subprocess.run(
+    run_process(
         shlex.split(f"rustup +{version} target add {toolchain_name}"),
+        "rustup",
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
+        env=_rustup_env(),
     )
     logger.info("Installing toolchain with rustup")
-    subprocess.run(
+    run_process(
         shlex.split(f"rustup install {version}-{toolchain_name} --profile minimal"),
+        "rustup",
         # check=True,
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
+        env=_rustup_env(),
     )
+
+
+def rustup_add_component(version, toolchain_name, component: str):
+    logger.info(f"Adding {component} to {version}-{toolchain_name}")
     try:
-        subprocess.run(
-            shlex.split(
-                f"rustup component add rustc-dev --toolchain {version}-{toolchain_name}"
-            ),
-            # check=True,
-            timeout=120,
+        run_process(
+            shlex.split(f"rustup component add {component} --toolchain {version}-{toolchain_name}"),
+            component if component in LIMITS else "rustup",
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
+            env=_rustup_env(),
         )
 
-    except subprocess.TimeoutExpired:
-        logger.error(
-            f"rustup component add rustc-dev --toolchain {version}-{toolchain_name} : STATUS [FAILED]"
-        )
+    except ProcessTimeoutError:
+        logger.error(f"rustup component add {component} --toolchain {version}-{toolchain_name} : STATUS [FAILED]")
 
 
+@functools.lru_cache(maxsize=None)
 def get_rustup_home():
-    return subprocess.check_output(shlex.split("rustup show home")).decode().strip()
+    # Same resolution as rustup's, which saves starting it
+    if os.environ.get("RUSTUP_HOME"):
+        return os.environ["RUSTUP_HOME"]
+
+    default_home = pathlib.Path.home().joinpath(".rustup")
+    if default_home.joinpath("toolchains").exists():
+        return str(default_home)
+
+    return run_process(shlex.split("rustup show home"), "rustup", check=True, stdout=subprocess.PIPE).stdout.decode().strip()
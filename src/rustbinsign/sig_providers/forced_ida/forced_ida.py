@@ -3,8 +3,10 @@ import pathlib
 import subprocess
 import sys
 import tempfile
+from typing import Optional
 
 from ...logger import logger as log
+from ...process import run_process
 from ..ida.ida import IDAProvider
 
 
@@ -17,11 +19,14 @@ class ForcedIDAProvider(IDAProvider):
             print("Please patch the ida makesig plugin before using forcedIDA provider.", file=sys.stderr)
             exit(1)
 
-    def _generate_pattern(self, libfile) -> pathlib.Path:
+    def _generate_pattern(self, libfile, pattern_dir: Optional[pathlib.Path] = None) -> pathlib.Path:
         assert libfile.exists()
         log.debug(f"Gen for {libfile}...")
         script_path = pathlib.Path(__file__).parent.resolve().joinpath("sig_gen.py")
-        target_path = pathlib.Path(libfile).with_suffix(".pat")
+        if pattern_dir is None:
+            pattern_dir = pathlib.Path(libfile).parent
+
+        target_path = pattern_dir.joinpath(libfile.name).with_suffix(".pat")
 
         if target_path.exists():  # Don't resign if signed already
             return target_path
@@ -46,8 +51,9 @@ class ForcedIDAProvider(IDAProvider):
 
         # log.debug(" ".join(args))
 
-        subprocess.run(
+        run_process(
             args,
+            "idat",
             stdout=subprocess.DEVNULL,
             check=True,
             # shell=True,
@@ -11,6 +11,7 @@ from typing import List, Optional
 from parse import *
 
 from ...logger import logger as log
+from ...process import run_process
 from ..provider_base import BaseSigProvider
 from .model import ConfigIDA
 
@@ -44,6 +45,7 @@ def _remove_line(filepath: pathlib.Path, line_number: int):
 
 class IDAProvider(BaseSigProvider):
     cfg: ConfigIDA
+    needs_dwarf = False  # Patterns are made of function names and code
 
     def __init__(self, cfg: Optional[ConfigIDA] = None):
         if cfg is None:
@@ -55,6 +57,16 @@ class IDAProvider(BaseSigProvider):
     def generate_signature(
         self, libs: List[pathlib.Path], sig_name: Optional[str]
     ) -> pathlib.Path:
+        pats = self.generate_patterns(libs)
+
+        if sig_name is None:
+            sig_name = f"rust-std-{self.version}-{os.name}"
+
+        return self.generate_signature_from_patterns(pats, sig_name)
+
+    def generate_patterns(
+        self, libs: List[pathlib.Path], pattern_dir: Optional[pathlib.Path] = None
+    ) -> List[pathlib.Path]:
         POOL_SIZE = multiprocessing.cpu_count()
         log.info(f"Generating pattern files with {POOL_SIZE} threads...")
         pats = []
@@ -62,8 +74,11 @@ class IDAProvider(BaseSigProvider):
         fails = 0
         tp = ThreadPoolExecutor(max_workers=POOL_SIZE)
 
+        if pattern_dir is not None:
+            pattern_dir.mkdir(parents=True, exist_ok=True)
+
         def routine(self, lib):
-            return self._generate_pattern(lib)
+            return self._generate_pattern(lib, pattern_dir)
 
         for lib in libs:
             futures.append(tp.submit(routine, self, lib))
@@ -77,16 +92,16 @@ class IDAProvider(BaseSigProvider):
                 fails += 1
 
         log.info(f"{len(pats)} pat generated. {fails} failed.")
+        return pats
 
-        if sig_name is None:
-            sig_name = f"rust-std-{self.version}-{os.name}"
-
-        return self._generate_sig_file(pats, sig_name)
+    def generate_signature_from_patterns(self, patterns: List[pathlib.Path], sig_name: str) -> pathlib.Path:
+        return self._generate_sig_file(patterns, sig_name)
 
     def _run_sig(self, cmdline):
         log.debug(f'Running command: "{" ".join(cmdline)}"')
-        p = subprocess.run(
+        p = run_process(
             cmdline,
+            "sigmake",
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             check=False,
@@ -139,14 +154,15 @@ class IDAProvider(BaseSigProvider):
         self._run_sig(cmdline)
         return f"{sig_name}.sig"
 
-    def _generate_pattern(self, libfile) -> pathlib.Path:
+    def _generate_pattern(self, libfile, pattern_dir: Optional[pathlib.Path] = None) -> pathlib.Path:
         assert libfile.exists()
         log.debug(f"Gen for {libfile}...")
         # script_path = pathlib.Path(__file__).parent.resolve().joinpath("sig_gen.py")
         script_path = pathlib.Path(__file__).parent.resolve().joinpath("idb2pat.py")
-        target_path = (
-            pathlib.Path(os.getcwd()).joinpath(libfile.name).with_suffix(".pat")
-        )
+        if pattern_dir is None:
+            pattern_dir = pathlib.Path(os.getcwd())
+
+        target_path = pattern_dir.joinpath(libfile.name).with_suffix(".pat")
         # target_path = pathlib.Path(libfile).with_suffix(".pat")
 
         if target_path.exists():  # Don't resign if signed already
@@ -172,8 +188,9 @@ class IDAProvider(BaseSigProvider):
 
         # log.debug(" ".join(args))
 
-        subprocess.run(
+        run_process(
             args,
+            "idat",
             stdout=subprocess.DEVNULL,
             check=True,
             # shell=True,
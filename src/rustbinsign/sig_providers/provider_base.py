@@ -4,7 +4,19 @@ from typing import List, Optional
 
 
 class BaseSigProvider(ABC):
+    needs_dwarf: bool = True  # Whether libs must be built with debug info, or symbols are enough
+
     def generate_signature(
         self, libs: List[pathlib.Path], sig_name: Optional[str]
     ) -> pathlib.Path:
         ...
+
+    def generate_patterns(
+        self, libs: List[pathlib.Path], pattern_dir: Optional[pathlib.Path] = None
+    ) -> List[pathlib.Path]:
+        """Intermediate representation of libs, that signatures are made from. Patterns of libs with the same
+        file name must go to different `pattern_dir`."""
+        ...
+
+    def generate_signature_from_patterns(self, patterns: List[pathlib.Path], sig_name: str) -> pathlib.Path:
+        ...
@@ -3,7 +3,8 @@ import pathlib
 from typing import Callable, List, Optional
 
 from .logger import logger as log
-from .rustup import get_rustup_home, install_toolchain
+from .registry import get_toolchain_registry
+from .rustup import install_toolchain
 
 
 class Toolchain:
@@ -29,24 +30,10 @@ class Toolchain:
     @property
     def libs(self):
         if self._libs is None:
-            rustup_home = get_rustup_home()
-
-            tc_path = pathlib.Path(rustup_home).joinpath("toolchains")
-            target = None
-            for _, dirs, _ in os.walk(tc_path):
-                for directory in dirs:
-                    if directory.startswith(self.version):
-                        target = directory
-                        break
-                break
-
-            if os.name == "nt":
-                libs_path = tc_path / pathlib.Path(target) / pathlib.Path("bin")
-                self._libs = list(libs_path.glob("*.dll"))
-
-            else:
-                libs_path = tc_path / pathlib.Path(target) / pathlib.Path("lib")
-                self._libs = list(libs_path.glob("*.so"))
+            registry = get_toolchain_registry()
+            tc_dir = registry.find_toolchain_dir(self.version, None)
+            patterns = ["bin/*.dll"] if os.name == "nt" else ["lib/*.so"]
+            self._libs = [lib.path for lib in registry.libs(tc_dir, patterns)] if tc_dir is not None else []
 
             if len(self._libs) == 0:
                 raise ValueError("Please install the toolchain first using install()")
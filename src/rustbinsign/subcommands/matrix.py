@@ -0,0 +1,142 @@
+import json
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from pydantic import BaseModel
+from rich import print
+from rustbininfo import TargetRustInfo
+
+from ..crate_store import get_crate_store
+from ..failure_cache import DEFAULT_TTL
+from ..footprint import select_dependencies
+from ..lockfile import pinned_versions
+from ..logger import logger as log
+from ..sig_providers.provider_base import BaseSigProvider
+from ..toolchains.model import ToolchainModel
+from ..util import slugify
+from .sign import compile_dependencies
+
+
+class MatrixCell(BaseModel):
+    toolchain: str  # e.g 1.70.0-x86_64-unknown-linux-gnu
+    profile: str = "release"
+    template: Optional[pathlib.Path] = None  # None means the default template
+
+    @property
+    def name(self) -> str:
+        template = self.template.stem if self.template is not None else "default"
+        return slugify(f"{self.toolchain}-{self.profile}-{template}".replace(".", "_"))
+
+
+class CellResult(BaseModel):
+    cell: MatrixCell
+    libs: List[pathlib.Path] = []
+    failed: List[str] = []
+    signature: Optional[pathlib.Path] = None
+
+
+def build_matrix(
+    toolchains: List[str], profiles: List[str], templates: List[Optional[pathlib.Path]]
+) -> List[MatrixCell]:
+    return [
+        MatrixCell(toolchain=toolchain, profile=profile, template=template)
+        for toolchain in toolchains
+        for profile in profiles
+        for template in templates
+    ]
+
+
+def load_template(path: Optional[pathlib.Path]) -> Optional[Dict]:
+    if path is None:
+        return None
+
+    return json.load(open(path, "r", encoding="utf-8"))
+
+
+def sign_matrix_subcommand(
+    provider: BaseSigProvider,
+    target: pathlib.Path,
+    signature_name: str,
+    cells: List[MatrixCell],
+    make_toolchain: Callable[[str, str, Optional[Dict]], ToolchainModel],
+    sign_std: bool = True,
+    compile_all: bool = False,
+    retry_failed: bool = False,
+    failure_ttl: float = DEFAULT_TTL,
+    jobs: int = 2,
+    min_footprint: int = 0,
+    infer_features: bool = False,
+) -> List[CellResult]:
+    """Builds the dependencies of a target with every combination of toolchain, profile and template, and
+    signs each of them, plus all of them at once.
+
+    Crates are fetched and extracted once for the whole matrix. Cells build concurrently, but a crate is only
+    built by one cell at a time: they share its sources, checkout and overlays.
+
+    Args:
+        make_toolchain (Callable): returns an installed toolchain from a triple, a profile and a template
+    """
+    if not target.exists():
+        print(f"{target} do not exists")
+        exit(1)
+
+    def setup(cell: MatrixCell) -> ToolchainModel:
+        log.info(f"Setting up {cell.name}")
+        return make_toolchain(cell.toolchain, cell.profile, load_template(cell.template))
+
+    # Installed toolchains are found without running rustup, installations of the same toolchain are serialized
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        toolchains = dict(zip([cell.name for cell in cells], pool.map(setup, cells)))
+
+    offline = any(tc.vendor is not None for tc in toolchains.values())
+    log.info("Getting dependencies...")
+    # Crates metadata come from crates.io, which can't be reached offline
+    target_info = TargetRustInfo.from_target(target, fast_load=offline)
+    dependencies = select_dependencies(target, target_info.dependencies, min_footprint)
+    # Crates left out still end up in the lockfiles of the others
+    pinned = pinned_versions(target_info.dependencies)
+    if not offline:
+        log.info("Fetching dependencies...")
+        get_crate_store().prefetch(dependencies)
+
+    def build(cell: MatrixCell) -> CellResult:
+        tc = toolchains[cell.name]
+        libs, failed = compile_dependencies(
+            dependencies,
+            tc,
+            cell.profile,
+            load_template(cell.template),
+            compile_all,
+            retry_failed,
+            failure_ttl,
+            target if infer_features else None,
+            pinned,
+        )
+        return CellResult(cell=cell, libs=libs, failed=failed)
+
+    # Cells only read the sources they share, each one builds in its own overlays and target directories
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        results = list(pool.map(build, cells))
+
+    if sign_std:
+        for result in results:
+            result.libs += toolchains[result.cell.name].get_libs()
+
+    patterns = []
+    for result in results:
+        cell_patterns = provider.generate_patterns(result.libs, pathlib.Path("patterns", result.cell.name))
+        patterns += cell_patterns
+        if cell_patterns:
+            result.signature = provider.generate_signature_from_patterns(
+                cell_patterns, f"{signature_name}-{result.cell.name}"
+            )
+
+        print(f"{result.cell.name}: {len(result.libs)} libs, {len(result.failed)} failures -> {result.signature}")
+        for fail in result.failed:
+            print(f"\t{fail}")
+
+    if patterns:
+        print(f"Generated : {provider.generate_signature_from_patterns(patterns, signature_name)}")
+
+    return results
@@ -1,13 +1,20 @@
 import pathlib
-from typing import List, Optional, Tuple
+import time
+from typing import Dict, List, Optional, Tuple
 
 from rich import print
 from rustbininfo import Crate, TargetRustInfo
 
+from ..crate_store import get_crate_store
+from ..exceptions import CompilationError, ProcessTimeoutError
+from ..failure_cache import DEFAULT_TTL, TRANSIENT_TTL, FailureCache
+from ..footprint import select_dependencies
+from ..lockfile import pinned_versions
 from ..logger import logger as log
 from ..model import CompilationCtx
 from ..sig_providers.provider_base import BaseSigProvider
 from ..toolchains.model import ToolchainModel
+from ..util import slugify
 
 
 def sign_libs(
@@ -16,12 +23,20 @@ def sign_libs(
     return provider.generate_signature(libs, signature_name)
 
 
+def stdlib_signature_name(toolchain_name: str, profile: str, template: Optional[dict]) -> str:
+    return f"{toolchain_name}-{profile}-{slugify(template or 'default')}"
+
+
 def compile_target_subcommand(
     target: pathlib.Path,
     toolchain: ToolchainModel,
     profile: Optional[str] = "release",
     template: Optional[pathlib.Path] = None,
     compile_all: bool = False,
+    retry_failed: bool = False,
+    failure_ttl: float = DEFAULT_TTL,
+    min_footprint: int = 0,
+    infer_features: bool = False,
 ) -> Tuple[List, List]:
     if profile is None:
         profile = "release"
@@ -32,28 +47,121 @@ def compile_target_subcommand(
 
     log.info("Getting dependencies...")
 
-    dependencies: List[Crate] = TargetRustInfo.from_target(target, fast_load=False).dependencies
+    offline = toolchain.vendor is not None
+    # Crates metadata come from crates.io, which can't be reached offline
+    target_info = TargetRustInfo.from_target(target, fast_load=offline)
+    dependencies: List[Crate] = select_dependencies(target, target_info.dependencies, min_footprint)
+
+    if not offline:
+        log.info("Fetching dependencies...")
+        get_crate_store().prefetch(dependencies)
     # _, version = get_rustc_version(target)
     # tc = toolchain.install()
+    return compile_dependencies(
+        dependencies,
+        toolchain,
+        profile,
+        template,
+        compile_all,
+        retry_failed,
+        failure_ttl,
+        target if infer_features else None,
+        # Crates left out still end up in the lockfiles of the others
+        pinned_versions(target_info.dependencies),
+    )
+
+
+def compile_dependencies(
+    dependencies: List[Crate],
+    toolchain: ToolchainModel,
+    profile: str = "release",
+    template: Optional[dict] = None,
+    compile_all: bool = False,
+    retry_failed: bool = False,
+    failure_ttl: float = DEFAULT_TTL,
+    infer_features_from: Optional[pathlib.Path] = None,
+    pinned: Optional[Dict[str, List[str]]] = None,
+) -> Tuple[List, List]:
+    """Builds crates, which must have been fetched already. Known failures are skipped, new ones recorded.
+
+    Args:
+        infer_features_from (pathlib.Path): target to guess the features of each crate from, instead of building
+            all of them
+        pinned (Dict[str, List[str]]): versions to pin dependencies to, defaults to the versions of `dependencies`
+
+    Returns:
+        Tuple[List, List]: generated files, crates that could not be built
+    """
     failed = []
     # if sign_std:
     # libs = tc.get_libs()
 
     # else:
     libs = []
+    failure_cache = FailureCache(ttl=failure_ttl)
+    if pinned is None:
+        pinned = pinned_versions(dependencies)
+    start = time.perf_counter()
 
     for dep in dependencies:
+        args = {"profile": profile, "pinned_versions": pinned, "infer_features_from": infer_features_from}
+        if template is not None:
+            args["template"] = template
+        ctx = CompilationCtx(**args)
         try:
-            args = {"profile": profile}
-            if template is not None:
-                args["template"] = template
-            libs += toolchain.compile_remote_crate(crate=dep, ctx=CompilationCtx(**args), compile_all=compile_all)
+            # The same key the build records workarounds under: effective template, RUSTFLAGS and features
+            key = toolchain.failure_key(dep, ctx, compile_all)
 
         except Exception as exc:
-            failed.append(dep.name)
+            failed.append(f"{dep.name} ({type(exc).__name__}: {exc})")
+            log.exception(f"{dep}: {exc}")
+            continue
+
+        known_failure = None if retry_failed else failure_cache.get(key)
+        if known_failure is not None and not known_failure.workarounds:
+            log.info(f"Skipping {dep}, it failed to build before ({known_failure.kind})")
+            failed.append(f"{dep.name} (known failure: {known_failure.kind})")
+            continue
+
+        try:
+            dep_libs = toolchain.compile_remote_crate(crate=dep, ctx=ctx, compile_all=compile_all)
+
+        except ProcessTimeoutError as exc:
+            # A hung build should not stop the whole batch
+            failed.append(f"{dep.name} ({exc})")
+            failure_cache.record(key, "timeout", str(exc), ttl=TRANSIENT_TTL)
+            log.error(f"{dep}: {exc}")
+            continue
+
+        except CompilationError as exc:
+            kind = exc.diagnosis.kind.value if exc.diagnosis is not None else "compilation-error"
+            failed.append(f"{dep.name} ({kind})")
+            failure_cache.record(key, kind, exc.diagnosis.message if exc.diagnosis is not None else str(exc))
             log.error(exc)
-            print(exc)
-            raise exc
+            continue
+
+        except Exception as exc:
+            # Not a build failure (network, bug...), nothing worth remembering about the crate
+            failed.append(f"{dep.name} ({type(exc).__name__}: {exc})")
+            log.exception(f"{dep}: {exc}")
+            continue
+
+        if dep_libs:
+            entry = failure_cache.get(key)
+            if entry is not None and not entry.workarounds:
+                failure_cache.forget(key)
+
+        else:
+            failed.append(f"{dep.name} (no artifacts)")
+            failure_cache.record(key, "no-artifacts", ttl=TRANSIENT_TTL)
+
+        libs += dep_libs
+
+    size = sum(lib.stat().st_size for lib in libs if lib.exists())
+    log.info(
+        f"Built {len(libs)} artifacts ({size / 2**20:.1f} MiB) in {time.perf_counter() - start:.0f}s"
+        f"{', without debug info' if toolchain.lean else ''}"
+    )
 
     return libs, failed
 
@@ -67,9 +175,13 @@ def sign_subcommand(
     sign_std: bool = True,
     template: Optional[pathlib.Path] = None,
     compile_all: bool = False,
+    retry_failed: bool = False,
+    failure_ttl: float = DEFAULT_TTL,
+    min_footprint: int = 0,
+    infer_features: bool = False,
 ):
     libs, fails = compile_target_subcommand(
-        target, toolchain, profile, template, compile_all
+        target, toolchain, profile, template, compile_all, retry_failed, failure_ttl, min_footprint, infer_features
     )
     if sign_std:
         libs += toolchain.get_libs()
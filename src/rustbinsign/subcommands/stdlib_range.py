@@ -0,0 +1,190 @@
+import json
+import os
+import pathlib
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+
+import requests
+import semver
+from pydantic import BaseModel
+from rich import print
+
+from ..logger import logger as log
+from ..sig_providers.provider_base import BaseSigProvider
+from ..toolchains.model import ToolchainModel
+from ..util import USER_AGENT, file_lock
+from .sign import stdlib_signature_name
+
+RELEASES_URL = "https://raw.githubusercontent.com/rust-lang/rust/master/RELEASES.md"
+RELEASE_LINE = re.compile(r"^Version\s+(\S+)\s+\(.*\)$", re.MULTILINE)
+VERSION_RANGE = re.compile(r"(?P<start>[0-9.]*)\.\.(?P<inclusive>=?)(?P<end>[0-9.]*)")
+
+
+def released_versions() -> List[semver.Version]:
+    """Stable rustc releases, oldest first, from the release notes of rust-lang/rust."""
+    res = requests.get(RELEASES_URL, timeout=20, headers={"User-Agent": USER_AGENT})
+    res.raise_for_status()
+
+    versions = set()
+    for version in RELEASE_LINE.findall(res.text):
+        try:
+            parsed = semver.Version.parse(version)
+
+        except ValueError:
+            continue
+
+        if parsed.prerelease is None:
+            versions.add(parsed)
+
+    return sorted(versions)
+
+
+def expand_versions(specs: List[str], releases: Optional[List[semver.Version]] = None) -> List[str]:
+    """Rust versions from a mix of versions and ranges.
+
+    Ranges read like Rust's: `1.50.0..1.67.1` stops before 1.67.1, `1.50.0..=1.67.1` includes it, and either end
+    can be left open. Release notes are only fetched when there is a range to expand.
+    """
+    versions = []
+    for spec in specs:
+        match = VERSION_RANGE.fullmatch(spec)
+        if match is None:
+            versions.append(str(semver.Version.parse(spec)))
+            continue
+
+        if releases is None:
+            releases = released_versions()
+
+        start = semver.Version.parse(match["start"]) if match["start"] else None
+        end = semver.Version.parse(match["end"]) if match["end"] else None
+        for release in releases:
+            if start is not None and release < start:
+                continue
+
+            if end is not None and (release > end or (release == end and not match["inclusive"])):
+                continue
+
+            versions.append(str(release))
+
+    return list(dict.fromkeys(versions))
+
+
+class RangeEntry(BaseModel):
+    toolchain: str
+    status: str  # "signed" or "failed"
+    signature: Optional[pathlib.Path] = None
+    error: Optional[str] = None
+    timestamp: float
+
+
+class RangeManifest:
+    """Progress of a sign_stdlib_range run, so that running it again only does what is left.
+
+    Entries are keyed by signature name. A signed toolchain is done for as long as its signature exists,
+    failed ones are tried again.
+    """
+
+    path: pathlib.Path
+
+    def __init__(self, path: pathlib.Path):
+        self.path = pathlib.Path(path)
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, key: str) -> Optional[RangeEntry]:
+        entry = self._load().get(key)
+        return RangeEntry(**entry) if entry is not None else None
+
+    def is_done(self, key: str) -> bool:
+        entry = self.get(key)
+        return entry is not None and entry.status == "signed" and entry.signature.exists()
+
+    def record(self, key: str, toolchain: str, signature: Optional[pathlib.Path] = None, error: Optional[str] = None):
+        status = "signed" if signature is not None else "failed"
+        entry = RangeEntry(toolchain=toolchain, status=status, signature=signature, error=error, timestamp=time.time())
+        with file_lock(self.path.with_name(f".{self.path.name}.lock")):
+            entries = self._load()
+            entries[key] = entry.model_dump(mode="json")
+            tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+            tmp_path.write_text(json.dumps(entries, indent=1), encoding="utf-8")
+            os.replace(tmp_path, self.path)
+
+
+def sign_stdlib_range_subcommand(
+    provider: BaseSigProvider,
+    versions: List[str],
+    triples: List[str],
+    make_toolchain: Callable[[str], ToolchainModel],
+    profile: str,
+    template: Optional[Dict],
+    manifest_path: pathlib.Path,
+    jobs: int = 4,
+) -> Dict[str, RangeEntry]:
+    """Signs the standard library of every version for every triple, one signature per toolchain.
+
+    Toolchains are installed `jobs` at a time, and each of them goes on to pattern generation as soon as its
+    libraries are ready, while the next ones install. Every cache is shared, so rustup, the toolchain registry
+    and the stdlib carriers only do the work once.
+
+    Args:
+        make_toolchain (Callable): returns an installed toolchain from a name such as 1.70.0-x86_64-unknown-linux-gnu
+        manifest_path (pathlib.Path): where progress is kept; toolchains already signed there are skipped
+    """
+    manifest = RangeManifest(manifest_path)
+    toolchains = [f"{version}-{triple}" for version in versions for triple in triples]
+    names = {toolchain: stdlib_signature_name(toolchain, profile, template) for toolchain in toolchains}
+
+    pending = []
+    for toolchain in toolchains:
+        if manifest.is_done(names[toolchain]):
+            log.info(f"{toolchain} was signed already, skipping it")
+
+        else:
+            pending.append(toolchain)
+
+    def provision(toolchain: str) -> List[pathlib.Path]:
+        log.info(f"Setting up {toolchain}")
+        return make_toolchain(toolchain).get_libs()
+
+    def sign(toolchain: str, libs: List[pathlib.Path]):
+        name = names[toolchain]
+        patterns = provider.generate_patterns(libs, pathlib.Path("patterns", name))
+        signature = provider.generate_signature_from_patterns(patterns, name)
+        manifest.record(name, toolchain, signature=pathlib.Path(signature).absolute())
+        print(f"{toolchain}: {len(libs)} libs -> {signature}")
+
+    def failed(toolchain: str, exc: Exception):
+        log.error(f"{toolchain}: {exc}")
+        manifest.record(names[toolchain], toolchain, error=f"{type(exc).__name__}: {exc}")
+        print(f"{toolchain}: failed ({exc})")
+
+    # A single signing worker: pattern generation already uses every core
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as provisioning, ThreadPoolExecutor(max_workers=1) as signing:
+        provisions = {provisioning.submit(provision, toolchain): toolchain for toolchain in pending}
+        signatures = {}
+        for future in as_completed(provisions):
+            toolchain = provisions[future]
+            try:
+                signatures[signing.submit(sign, toolchain, future.result())] = toolchain
+
+            except Exception as exc:  # One broken release should not stop the batch
+                failed(toolchain, exc)
+
+        for future in as_completed(signatures):
+            try:
+                future.result()
+
+            except Exception as exc:
+                failed(signatures[future], exc)
+
+    entries = {toolchain: manifest.get(names[toolchain]) for toolchain in toolchains}
+    signed = sum(entry is not None and entry.status == "signed" for entry in entries.values())
+    print(f"{signed}/{len(toolchains)} toolchains signed, progress is kept in {manifest_path}")
+    return entries
@@ -4,12 +4,18 @@ from typing import Callable, Dict, List, Optional
 
 from rustbininfo import Crate
 
-from ..compilation import CompilationUnit
+from ..carriers import carrier_key, get_carrier_cache
+from ..compilation import CompilationUnit, lean_template
+from ..linker import fast_linker_flags
 from ..logger import logger as log
 from ..model import CompilationCtx
-from ..rustup import get_rustup_home, rustup_install_toolchain
+from ..registry import get_toolchain_registry
+from ..rustup import rustup_install_toolchain
+from ..vendor import VendorSource
 from .model import ToolchainModel
 
+HELLO_WORLD_CRATE = "hello-world-2022-10-01-0.1.0"
+
 
 class DefaultToolchain(ToolchainModel):
     """
@@ -31,8 +37,13 @@ class DefaultToolchain(ToolchainModel):
         self.libs = None
         self.toolchain_name = toolchain_name
         self.compile_unit = CompilationUnit(self)
-        self.crate_transforms = {}
         self._default_template = {}
+        self.vendor = None
+        self.fast_linker = None
+        self._link_flags = None
+        self.lean = False
+        self.min_extra_gain = 0
+        self.components = []
 
     @classmethod
     def match_toolchain(cls, toolchain_name: str):
@@ -40,22 +51,45 @@ class DefaultToolchain(ToolchainModel):
 
     def install(self) -> "self":
         log.debug(f"Downloading and installing toolchain version {self.name}")
-        rustup_install_toolchain(self.version, self.toolchain_name)
+        rustup_install_toolchain(
+            self.version, self.toolchain_name, offline=self.vendor is not None, components=self.components
+        )
         return self
 
-    def _get_compilation_unit(self, ctx: Optional[CompilationCtx] = None) -> CompilationUnit:
+    def _get_link_flags(self) -> List[str]:
+        if self.fast_linker is None:
+            return []
+
+        if self._link_flags is None:
+            self._link_flags = fast_linker_flags(self.fast_linker, self.version, self.toolchain_name) or []
+
+        return self._link_flags
+
+    def _get_compilation_unit(self, ctx: Optional[CompilationCtx] = None, compile_all: bool = False) -> CompilationUnit:
         if ctx is None:
             ctx = CompilationCtx(profile=self._profile)
 
+        link_flags = self._get_link_flags()
+        if link_flags:
+            env = dict(ctx.env or {})
+            env["RUSTFLAGS"] = " ".join([env.get("RUSTFLAGS", os.environ.get("RUSTFLAGS", ""))] + link_flags).strip()
+            ctx = ctx.model_copy(update={"env": env})
+
+        if self.lean:
+            ctx = ctx.model_copy(update={"template": lean_template(ctx.template, self.version, self.toolchain_name)})
+
+        if self.min_extra_gain and not ctx.min_extra_gain:
+            ctx = ctx.model_copy(update={"min_extra_gain": self.min_extra_gain})
+
         return CompilationUnit(self, ctx)
 
     def compile_remote_crate(self, crate: Crate, ctx: Optional[CompilationCtx] = None, compile_all: bool = False):
-        unit = self._get_compilation_unit(ctx)
-        return unit.compile_remote_crate(
-            crate,
-            crate_transform=self.crate_transforms.get(crate.name),
-            compile_all=compile_all,
-        )
+        unit = self._get_compilation_unit(ctx, compile_all)
+        return unit.compile_remote_crate(crate, compile_all=compile_all)
+
+    def failure_key(self, crate: Crate, ctx: Optional[CompilationCtx] = None, compile_all: bool = False) -> str:
+        """Key under which compile_remote_crate's outcome is recorded in the FailureCache."""
+        return self._get_compilation_unit(ctx, compile_all).failure_key(crate)
 
     def compile_project(
         self,
@@ -85,61 +119,75 @@ class DefaultToolchain(ToolchainModel):
         self._profile = profile
         return self
 
-    def _gen_libs(self):
-        rustup_home = get_rustup_home()
+    def set_vendor_dir(self, vendor_dir: Optional[pathlib.Path]):
+        """Builds offline, from a `cargo vendor` directory or a local registry mirror."""
+        if vendor_dir is not None:
+            self.vendor = VendorSource(vendor_dir)
 
-        tc_path = pathlib.Path(rustup_home).joinpath("toolchains")
-        target = None
-        for _, dirs, _ in os.walk(tc_path):
-            for directory in dirs:
-                correct_version = directory.startswith(self.version)
-                correct_toolchain = (
-                    not self.toolchain_name or self.toolchain_name in directory
-                )
-                if correct_version and correct_toolchain:
-                    target = directory
-                    break
+        return self
+
+    def set_fast_linker(self, mode: Optional[str]):
+        """Links with mold or lld, either the first one available ("auto") or a specific one.
 
-            break
+        Builds link as usual if the requested linker can't be found.
+        """
+        if mode not in (None, "none"):
+            self.fast_linker = mode
 
-        assert target is not None
+        return self
+
+    def set_lean_artifacts(self, lean: bool):
+        """Builds artifacts with symbols but no DWARF, which is enough for providers that don't need debug info."""
+        self.lean = lean
+        return self
+
+    def set_components(self, components: Optional[List[str]]):
+        """Rustup components to install along the toolchain, e.g rustc-dev. None are by default."""
+        self.components = list(components or [])
+        return self
+
+    def set_min_extra_gain(self, gain: int):
+        """With --full-compilation, builds tests, examples and benches one by one, and stops at the first one
+        bringing fewer than `gain` new functions."""
+        self.min_extra_gain = gain
+        return self
+
+    def _gen_libs(self):
+        registry = get_toolchain_registry()
+        tc_dir = registry.find_toolchain_dir(self.version, self.toolchain_name)
+        assert tc_dir is not None
 
         if self.toolchain_name is None:
-            self.toolchain_name = target.split("-", 1)[1]
+            self.toolchain_name = tc_dir.name.split("-", 1)[1]
 
         # if "nt" in os.name: #XXX: removed due to potential cross compilation?
-        libs = []
-        libs_path = tc_path / pathlib.Path(target) / pathlib.Path("bin")
-        libs += list(libs_path.glob("*.dll"))
-
-        libs_path = (
-            tc_path
-            / pathlib.Path(target)
-            / pathlib.Path("lib")
-            / pathlib.Path("rustlib")
-            / pathlib.Path(self.toolchain_name)
-            / pathlib.Path("lib")
-        )
-        libs += list(libs_path.glob("*.dll"))
-
-        # else:
-        libs_path: pathlib.Path = (
-            tc_path
-            / pathlib.Path(target)
-            / "lib"
-            / "rustlib"
-            / self.toolchain_name
-            / "lib"
-        )
-        libs += list(libs_path.glob("*.so"))
-
-        libs_path_self_contained = libs_path.joinpath(pathlib.Path("self-contained"))
-        libs += list(libs_path_self_contained.glob("*.o"))
+        libs_path = f"lib/rustlib/{self.toolchain_name}/lib"
+        patterns = ["bin/*.dll", f"{libs_path}/*.dll", f"{libs_path}/*.so", f"{libs_path}/self-contained/*.o"]
+        libs = [lib.path for lib in registry.libs(tc_dir, patterns)]
         if len(libs) == 0:
             raise ValueError("Please install the toolchain first using install()")
 
         return libs
 
+    def _hello_world_env(self) -> Dict[str, str]:
+        return {}
+
+    def _gen_hello_world(self, template: Optional[Dict]) -> List[pathlib.Path]:
+        """Builds a hello world binary, for toolchains whose standard library only comes linked statically.
+
+        Binaries are cached by toolchain, profile and template.
+        """
+        template = {key: value for key, value in (template or {}).items() if key != "lib"}
+        ctx = CompilationCtx(profile="release", lib=False, env=self._hello_world_env(), template=template)
+        effective_template = lean_template(template, self.version, self.toolchain_name) if self.lean else template
+        key = carrier_key(self.version, self.toolchain_name, ctx.profile, effective_template)
+
+        def build() -> List[pathlib.Path]:
+            log.info("Generating hello world package")
+            return self._get_compilation_unit(ctx).compile_remote_crate(Crate.from_depstring(HELLO_WORLD_CRATE))
+
+        return get_carrier_cache().get_or_build(key, build)
+
     def _filter_libs(self, library_paths: List[pathlib.Path], custom_filter: Callable):
         res = []
         for lib in library_paths:
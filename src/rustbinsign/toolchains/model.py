@@ -4,6 +4,7 @@ from typing import Dict, List, Optional
 
 from ..compilation import CompilationUnit
 from ..model import CompilationCtx
+from ..vendor import VendorSource
 
 
 class ToolchainModel(ABC):
@@ -12,6 +13,11 @@ class ToolchainModel(ABC):
     _default_template: Optional[Dict] = None
     toolchain_name: Optional[str] = None
     version: str
+    vendor: Optional[VendorSource] = None  # Offline builds source every crate from there
+    fast_linker: Optional[str] = None  # "auto", "mold", "lld" or "rust-lld", None links as usual
+    lean: bool = False  # Build without DWARF
+    min_extra_gain: int = 0  # See CompilationCtx.min_extra_gain
+    components: List[str] = []  # Extra rustup components to install, such as rustc-dev
 
     @classmethod
     def match_toolchain(cls, toolchain_name: str):
@@ -22,6 +28,8 @@ class ToolchainModel(ABC):
 
     def compile_remote_crate(self, crate, ctx: Optional[CompilationCtx] = None, compile_all: bool = False): ...
 
+    def failure_key(self, crate, ctx: Optional[CompilationCtx] = None, compile_all: bool = False) -> str: ...
+
     def compile_project(
         self,
         toml_path: pathlib.Path,
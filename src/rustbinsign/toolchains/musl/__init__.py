@@ -1,19 +1,20 @@
+import json
 import os
 import pathlib
 from typing import Callable, Dict, List, Optional
 
-import requests
-from rustbininfo import Crate
-
-from ...compilation import CompilationUnit
+from ...exceptions import InvalidToolchainError
 from ...logger import logger as log
 from ...model import CompilationCtx
 from ...rustup import get_rustup_home, rustup_install_toolchain
-from ...util import extract_tarfile, get_default_dest_dir
+from ...util import (EXTRACTION_MARKER, download_file, extract_tarfile, file_digest, file_lock,
+                     get_default_dest_dir)
 from ..default import DefaultToolchain
-from .transforms import hyper
 
-TRANSFORMS = {"hyper": hyper.transform}
+MUSL_MIRROR = "https://musl.cc"
+# SHA-512 of the musl archives, checked independently of the mirror that serves them. By archive name.
+# Archives missing here are trusted on first download, see MuslToolchain._musl_digest.
+MUSL_SHA512: Dict[str, str] = {}
 
 
 class MuslToolchain(DefaultToolchain):
@@ -30,7 +31,6 @@ class MuslToolchain(DefaultToolchain):
         super().__init__(version, toolchain_name)
         self._default_template = {"release": {"debug": 2, "strip": "none"}}
         self.musl_lib_path = None
-        self.crate_transforms = TRANSFORMS
         self.musl_target_name = "x86_64-linux-musl-native.tgz"
 
     @classmethod
@@ -42,104 +42,111 @@ class MuslToolchain(DefaultToolchain):
             "MUSL toolchain requieres musl, musl-dev and musl-tools packages to be installed."
         )
         log.debug(f"Downloading and installing toolchain version {self.name}")
-        rustup_install_toolchain(self.version, self.toolchain_name)
+        rustup_install_toolchain(
+            self.version, self.toolchain_name, offline=self.vendor is not None, components=self.components
+        )
 
-        musl_dir = get_default_dest_dir().joinpath("x86_64-linux-musl-native")
-        if musl_dir.exists():
+        musl_dir = self._musl_cache_dir().joinpath(self.musl_target_name.removesuffix(".tgz"))
+        if musl_dir.joinpath(EXTRACTION_MARKER).exists():
             self.musl_lib_path = musl_dir / "lib"
 
+        elif self.vendor is not None:
+            raise InvalidToolchainError(f"{musl_dir} does not exist, can't download musl offline")
+
         else:
             self.musl_lib_path = self._setup_musl()
 
         return self
 
-    def _compile_setup_ctx(self, ctx) -> CompilationCtx:
+    def _get_compilation_unit(self, ctx: Optional[CompilationCtx] = None, compile_all: bool = False):
         assert self.musl_lib_path is not None  # call install() first !
 
         if ctx is None:
             ctx = self._get_default_compilation_ctx()
 
-        ctx.env |= {
-            "LD_LIBRARY_PATH": str(self.musl_lib_path),
-        }
-        if ctx.lib:
+        lib = ctx.lib and not compile_all
+        env = dict(ctx.env or {}) | {"LD_LIBRARY_PATH": str(self.musl_lib_path)}
+        if lib:
             # warning: -crt-static only works when building lib
-            ctx.env |= {
-                "RUSTFLAGS": ctx.env.get("RUSTFLAGS", "") + " -C target-feature=-crt-static",
-            }
+            env["RUSTFLAGS"] = env.get("RUSTFLAGS", "") + " -C target-feature=-crt-static"
 
-        return ctx
-
-    def compile_remote_crate(self, crate: Crate, ctx: Optional[CompilationCtx] = None, compile_all: bool = False):
-        if compile_all:
-            ctx.lib = False
-        ctx = self._compile_setup_ctx(ctx)
-        return super().compile_remote_crate(crate, ctx, compile_all)
-
-    def compile_project(
-        self,
-        toml_path: pathlib.Path,
-        ctx: CompilationCtx | None = None,
-        features: Optional[list[str]] = (),
-        verb: str | None = "build",
-        additional_args: list[str] = [],
-    ):
-        ctx = self._compile_setup_ctx(ctx)
-        return super().compile_project(toml_path, features=features, verb=verb, additional_args=additional_args)
+        # Copied, callers may reuse their context with other toolchains
+        return super()._get_compilation_unit(ctx.model_copy(update={"lib": lib, "env": env}), compile_all)
 
     def get_libs(self):
         if self.libs is None:
-            # self.libs = self._gen_libs()
-            self.libs = []
-            self.libs = self._filter_libs(self.libs, lambda x: "driver" not in x.name)
-            self.libs += self._gen_hello_world(self._default_template)
+            self.libs = self._gen_hello_world(self._default_template)
 
         return self.libs
 
+    def _hello_world_env(self) -> Dict[str, str]:
+        return {"LD_LIBRARY_PATH": str(self.musl_lib_path)}
+
+    def _musl_cache_dir(self) -> pathlib.Path:
+        return get_default_dest_dir().joinpath("toolchain_cache")
+
+    def _recorded_digests_path(self) -> pathlib.Path:
+        return self._musl_cache_dir().joinpath("musl-sha512.json")
+
+    def _recorded_digests(self) -> Dict[str, str]:
+        try:
+            return json.loads(self._recorded_digests_path().read_text(encoding="utf-8"))
+
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _record_digest(self, digest: str):
+        path = self._recorded_digests_path()
+        with file_lock(path.with_name(f".{path.name}.lock")):
+            digests = self._recorded_digests() | {self.musl_target_name: digest}
+            tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+            tmp_path.write_text(json.dumps(digests, indent=1), encoding="utf-8")
+            os.replace(tmp_path, path)
+
+    def _musl_digest(self) -> Optional[str]:
+        """Pinned SHA-512 of the musl archive: RUSTBINSIGN_MUSL_SHA512, MUSL_SHA512, then the digest recorded when
+        the archive was first downloaded on this host. None when nothing is pinned yet.
+
+        Digests published by musl.cc are not used: they come from the host serving the archive.
+        """
+        pinned = (
+            os.environ.get("RUSTBINSIGN_MUSL_SHA512")
+            or MUSL_SHA512.get(self.musl_target_name)
+            or self._recorded_digests().get(self.musl_target_name)
+        )
+        return pinned.lower() if pinned else None
+
     def _download_musl(self):
         log.debug("Download musl")
 
         name = self.musl_target_name
-        url = f"https://musl.cc/{name}"
-
-        headers = {"User-Agent": "rustbinsign (https://github.com/N0fix/rustbinsign)"}
-        res = requests.get(url, timeout=20, headers=headers)
-        assert res.status_code == 200
-
-        result_file = get_default_dest_dir().joinpath(name)
-        open(result_file, "wb+").write(res.content)
+        result_file = self._musl_cache_dir().joinpath(name)
+        if result_file.exists():  # Only there once verified
+            return result_file
+
+        expected = self._musl_digest()
+        download_file(f"{MUSL_MIRROR}/{name}", result_file, expected, algorithm="sha512", resume=True)
+        if expected is None:
+            digest = file_digest(result_file, "sha512")
+            log.warning(
+                f"No SHA-512 is pinned for {name}, trusting this first download ({digest}). Later downloads are "
+                "checked against it, set RUSTBINSIGN_MUSL_SHA512 to pin another one"
+            )
+            self._record_digest(digest)
 
         log.debug(f"Successfuly downloaded to {result_file}")
         return result_file
 
     def _setup_musl(self):
         log.debug("Setup musl")
-        musl_path = self._download_musl()
-        directory = extract_tarfile(musl_path)
+        # Concurrent runs wait for the first one to download and extract the archive, then use its copy
+        with file_lock(self._musl_cache_dir().joinpath(f"{self.musl_target_name}.lock")):
+            musl_path = self._download_musl()
+            directory = extract_tarfile(musl_path)
+
         musl_lib_path = pathlib.Path(directory) / "lib"
         return musl_lib_path
 
-    def _gen_hello_world(self, template: Optional[pathlib.Path]):
-        log.info("Generating hello world package")
-        c = Crate.from_depstring("hello-world-2022-10-01-0.1.0")
-
-        template = {key: template[key] for key in template if key != "lib"}
-
-        args = {
-            "profile": "release",
-            "lib": False,
-            "env": {
-                "LD_LIBRARY_PATH": str(self.musl_lib_path),
-                # "RUSTFLAGS": ctx.env.get("RUSTFLAGS", "") + " -C target-feature=-crt-static",
-            },
-            "template": template,
-        }
-
-        if template is not None:
-            args["template"] = template
-
-        return CompilationUnit(self, CompilationCtx(**args)).compile_remote_crate(c)
-
 
 class MuslToolchain_x86(MuslToolchain):
     musl_lib_path: pathlib.Path
@@ -1,35 +1,229 @@
+import contextlib
+import fnmatch
+import hashlib
+import json
+import os
 import pathlib
 import re
 import tarfile
 import tempfile
-from typing import Optional
+import threading
+from typing import Dict, Iterable, Optional
 import unicodedata
 import shutil
 
+import requests
+
+from .exceptions import ChecksumError
+from .logger import logger as log
+
+USER_AGENT = "rustbinsign (https://github.com/N0fix/rustbinsign)"
+
 def get_default_dest_dir() -> pathlib.Path:
     destination_directory = pathlib.Path(tempfile.gettempdir()) / __package__
     destination_directory.mkdir(exist_ok=True)
     return destination_directory
 
 
-def extract_tarfile(tar_path: pathlib.Path) -> pathlib.Path:
+EXTRACTION_MARKER = ".rustbinsign-extracted"
+
+
+@contextlib.contextmanager
+def file_lock(path: pathlib.Path):
+    """Exclusive lock shared by every process of the host, held for the duration of the `with` block."""
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+
+                except OSError:  # LK_LOCK gives up after 10 seconds
+                    continue
+
+        else:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+        try:
+            yield
+
+        finally:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def download_file(
+    url: str,
+    destination: pathlib.Path,
+    expected_digest: Optional[str] = None,
+    algorithm: str = "sha256",
+    session: Optional[requests.Session] = None,
+    timeout: int = 60,
+    resume: bool = False,
+) -> pathlib.Path:
+    """Streams `url` to `destination` chunk by chunk.
+
+    The file only shows up at `destination` once fully downloaded and, when `expected_digest` is given, verified.
+    With `resume`, what an interrupted download left is kept and completed with a range request: the partial
+    file has a fixed name, callers must hold a lock on `destination`.
+
+    Raises:
+        ChecksumError: the downloaded content does not match `expected_digest`
+    """
+    destination = pathlib.Path(destination)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    if resume:
+        tmp_path = destination.with_name(f".{destination.name}.part")
+    else:
+        tmp_path = destination.with_name(f".{destination.name}.{os.getpid()}-{threading.get_ident()}.part")
+
+    offset = tmp_path.stat().st_size if resume and tmp_path.exists() else 0
+    headers = {"User-Agent": USER_AGENT}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+
+    digest = hashlib.new(algorithm)
+    keep_partial = resume
+
+    try:
+        with (session or requests).get(url, stream=True, timeout=timeout, headers=headers) as res:
+            if offset and res.status_code == 416:  # Nothing left to download
+                mode = None
+
+            else:
+                res.raise_for_status()
+                mode = "ab" if offset and res.status_code == 206 else "wb"
+
+            if mode != "wb" and offset:
+                log.debug(f"Resuming download of {url} at {offset} bytes")
+                with open(tmp_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(chunk)
+
+            if mode is not None:
+                with open(tmp_path, mode) as f:
+                    for chunk in res.iter_content(chunk_size=1 << 16):
+                        f.write(chunk)
+                        digest.update(chunk)
+
+        if expected_digest is not None and digest.hexdigest() != expected_digest.lower():
+            keep_partial = False  # Corrupted, start over next time
+            raise ChecksumError(f"{url}: expected {algorithm} {expected_digest}, got {digest.hexdigest()}")
+
+        os.replace(tmp_path, destination)
+
+    finally:
+        if not keep_partial:
+            tmp_path.unlink(missing_ok=True)
+
+    return destination
+
+
+def replace_file(path: pathlib.Path, content: str):
+    """Writes `content` to a new file at `path`, so that hard links to the previous file keep their content."""
+    path = pathlib.Path(path)
+    path.unlink(missing_ok=True)
+    path.write_text(content, encoding="utf-8")
+
+
+def template_hash(template: Optional[Dict]) -> str:
+    """Stable digest of a compilation template, used to tell whether a template was already applied."""
+    return hashlib.sha256(json.dumps(template or {}, sort_keys=True).encode()).hexdigest()
+
+
+def file_digest(path: pathlib.Path, algorithm: str = "sha256") -> str:
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def extract_tarfile(
+    tar_path: pathlib.Path,
+    destination: Optional[pathlib.Path] = None,
+    skip: Iterable[str] = (),
+) -> pathlib.Path:
     """Should only be used on crates.io downloaded crates
 
+    Extraction happens in a temporary directory that is renamed in place once complete, and is marked with
+    the archive hash. Extracting the same archive again is a no-op.
+
     Args:
         tar_path (pathlib.Path)
+        destination (Optional[pathlib.Path]) : Directory to extract to, defaults to the archive's directory
+        skip (Iterable[str]) : Glob patterns, relative to the archive root, of paths not to extract
 
     Returns:
         pathlib.Path: directory with extracted content
     """
     assert tar_path.exists()
 
-    tar = tarfile.open(tar_path)
-    tar.extractall(path=tar_path.parent)
-    members = tar.members
-    assert len(members) != 0  # should contain content
-    result_path = members[0].name.split("/")[0]
-    tar.close()
-    return pathlib.Path(tar_path.parent).joinpath(result_path)
+    destination = pathlib.Path(destination or tar_path.parent)
+    destination.mkdir(parents=True, exist_ok=True)
+    skip = list(skip)
+    # Trees extracted with other skip patterns lack other files
+    digest = file_digest(tar_path) + "".join(f" {pattern}" for pattern in skip)
+
+    with tarfile.open(tar_path) as tar:
+        first = tar.next()
+        assert first is not None  # should contain content
+        root_name = first.name.split("/")[0]
+        result_path = destination.joinpath(root_name)
+        marker = result_path.joinpath(EXTRACTION_MARKER)
+
+        def extracted() -> bool:
+            return marker.exists() and marker.read_text(encoding="utf-8") == digest
+
+        if extracted():
+            log.debug(f"{tar_path} already extracted to {result_path}")
+            return result_path
+
+        def wanted_members():
+            for member in tar:  # Starts again from the first member, without loading the whole index first
+                relative = member.name.split("/", 1)[1] if "/" in member.name else ""
+                if any(fnmatch.fnmatch(relative, pattern) for pattern in skip):
+                    continue
+
+                yield member
+
+        tmp_dir = pathlib.Path(tempfile.mkdtemp(dir=destination, prefix=f".{root_name}-"))
+        try:
+            extract_args = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+            tar.extractall(path=tmp_dir, members=wanted_members(), **extract_args)
+            tmp_dir.joinpath(root_name).mkdir(exist_ok=True)
+            tmp_dir.joinpath(root_name, EXTRACTION_MARKER).write_text(digest, encoding="utf-8")
+
+            # Another process may be renaming its own extraction in place, only look at result_path under the lock
+            with file_lock(destination.joinpath(f".{root_name}.lock")):
+                if extracted():
+                    log.debug(f"{result_path} was extracted concurrently, using it")
+                    return result_path
+
+                if result_path.exists():  # Stale or partial tree from an older run
+                    stale_path = pathlib.Path(tempfile.mkdtemp(dir=destination, prefix=f".{root_name}-stale-"))
+                    os.rename(result_path, stale_path.joinpath(root_name))
+                    shutil.rmtree(stale_path, ignore_errors=True)
+
+                os.rename(tmp_dir.joinpath(root_name), result_path)
+
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return result_path
 
 
 # Taken from https://stackoverflow.com/a/295466
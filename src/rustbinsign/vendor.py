@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import toml
+from rustbininfo import Crate
+
+from .crate_store import unneeded_paths
+from .logger import logger as log
+from .util import extract_tarfile, file_digest, get_default_dest_dir
+
+SOURCE_NAME = "rustbinsign-vendor"
+VENDOR_COPY_MARKER = ".rustbinsign-vendored"
+
+
+class VendorSource:
+    """Local source of crates for offline builds.
+
+    Either a directory produced by `cargo vendor`, or a local registry mirror (a directory holding an `index/`
+    and `<name>-<version>.crate` archives, as produced by `cargo local-registry`).
+
+    Usage example:
+    >>> vendor = VendorSource("./vendor")
+    >>> project_dir = vendor.fetch_source(Crate.from_depstring("rand_chacha-0.3.1"))
+    >>> args, env = vendor.cargo_args("1.70.0")
+    """
+
+    path: pathlib.Path
+
+    def __init__(self, path: pathlib.Path):
+        self.path = pathlib.Path(path).resolve()
+        if not self.path.is_dir():
+            raise FileNotFoundError(f"Vendor directory {self.path} does not exist")
+
+    @property
+    def kind(self) -> str:
+        return "local-registry" if self.path.joinpath("index").is_dir() else "directory"
+
+    def cargo_config(self) -> str:
+        return (
+            "[source.crates-io]\n"
+            f'replace-with = "{SOURCE_NAME}"\n\n'
+            f"[source.{SOURCE_NAME}]\n"
+            f"{self.kind} = {json.dumps(str(self.path))}\n\n"
+            "[net]\n"
+            "offline = true\n"
+        )
+
+    def config_dir(self) -> pathlib.Path:
+        """Directory holding the generated source replacement config, usable as CARGO_HOME."""
+        content = self.cargo_config()
+        config_dir = get_default_dest_dir().joinpath("vendor-config", hashlib.sha256(content.encode()).hexdigest()[:12])
+        config_path = config_dir.joinpath("config")  # Older cargo versions do not read config.toml
+
+        if not config_path.exists():
+            config_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = config_dir.joinpath(f".config.{os.getpid()}")
+            tmp_path.write_text(content, encoding="utf-8")
+            os.replace(tmp_path, config_path)
+
+        return config_dir
+
+    def cargo_args(self, version: str) -> Tuple[List[str], Dict[str, str]]:
+        """Cargo arguments and environment making a build use this source only, and never the network."""
+        from .compilation import supports_cargo_overrides
+
+        env = {"CARGO_NET_OFFLINE": "true"}
+        config_dir = self.config_dir()
+
+        if supports_cargo_overrides(version):
+            return ["--offline", "--config", str(config_dir.joinpath("config"))], env
+
+        # Configuration files can't be given on the command line, use a dedicated cargo home instead
+        env["CARGO_HOME"] = str(config_dir)
+        return ["--offline"], env
+
+    def locate(self, crate: Crate) -> pathlib.Path:
+        """Path of a crate in this source: a `.crate` archive or an unpacked directory."""
+        archive = self.path.joinpath(f"{crate.name}-{crate.version}.crate")
+        if archive.exists():
+            return archive
+
+        versioned_dir = self.path.joinpath(f"{crate.name}-{crate.version}")
+        if versioned_dir.joinpath("Cargo.toml").exists():
+            return versioned_dir
+
+        unversioned_dir = self.path.joinpath(crate.name)
+        if unversioned_dir.joinpath("Cargo.toml").exists():
+            manifest = toml.load(unversioned_dir.joinpath("Cargo.toml"))
+            if manifest.get("package", {}).get("version") == crate.version:
+                return unversioned_dir
+
+        raise FileNotFoundError(f"{crate} is not available in {self.path}")
+
+    def checksum(self, crate: Crate) -> Optional[str]:
+        """sha256 cargo expects of the archive of `crate`, None if this source does not have it."""
+        try:
+            location = self.locate(crate)
+
+        except FileNotFoundError:
+            return None
+
+        if location.is_file():
+            return file_digest(location)
+
+        try:
+            return json.loads(location.joinpath(".cargo-checksum.json").read_text(encoding="utf-8"))["package"]
+
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def fetch_source(self, crate: Crate) -> pathlib.Path:
+        """Returns a directory with the sources of `crate`, that builds are free to modify."""
+        location = self.locate(crate)
+        # Apart from the trees extracted from crates.io, which online runs may replace at any time
+        sources_dir = get_default_dest_dir().joinpath("vendor-src")
+        sources_dir.mkdir(exist_ok=True)
+        if location.is_file():
+            return extract_tarfile(location, sources_dir, skip=unneeded_paths(location))
+
+        # Vendored directories are checksummed by cargo, work on a copy
+        destination = sources_dir.joinpath(f"{crate.name}-{crate.version}")
+        if destination.joinpath(VENDOR_COPY_MARKER).exists():
+            return destination
+
+        log.debug(f"Copying {location} to {destination}")
+        tmp_dir = pathlib.Path(tempfile.mkdtemp(dir=sources_dir, prefix=f".{destination.name}-"))
+        try:
+            shutil.copytree(location, tmp_dir.joinpath(destination.name))
+            tmp_dir.joinpath(destination.name, VENDOR_COPY_MARKER).write_text(str(location), encoding="utf-8")
+            if destination.exists() and not destination.joinpath(VENDOR_COPY_MARKER).exists():
+                shutil.rmtree(destination, ignore_errors=True)
+
+            try:
+                os.rename(tmp_dir.joinpath(destination.name), destination)
+
+            except OSError:
+                log.debug(f"{destination} was copied concurrently, using it")
+
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        return destination
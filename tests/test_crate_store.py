@@ -0,0 +1,117 @@
+import hashlib
+import io
+import json
+import tarfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from rustbininfo import Crate
+
+from rustbinsign.crate_store import CrateStore, index_file_path
+from rustbinsign.exceptions import ChecksumError
+
+
+def make_crate(name: str, version: str) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for path, content in (
+            ("Cargo.toml", f'[package]\nname = "{name}"\nversion = "{version}"\n'),
+            ("src/lib.rs", "pub fn f() {}\n"),
+        ):
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(f"{name}-{version}/{path}")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    return buffer.getvalue()
+
+
+class Registry:
+    """crates.io stand-in: a sparse index under /index, archives under /dl."""
+
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+
+    def publish(self, name: str, version: str, archive: bytes, cksum: str = None):
+        entry = {"name": name, "vers": version, "deps": [], "features": {}, "yanked": False}
+        entry["cksum"] = cksum or hashlib.sha256(archive).hexdigest()
+        path = f"/index/{index_file_path(name)}"
+        self.files[path] = self.files.get(path, b"") + json.dumps(entry).encode("utf-8") + b"\n"
+        self.files[f"/dl/{name}/{name}-{version}.crate"] = archive
+
+
+@pytest.fixture
+def registry():
+    registry = Registry()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            registry.requests.append(self.path)
+            body = registry.files.get(self.path)
+            if body is None:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    registry.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield registry
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def store(registry, tmp_path):
+    return CrateStore(tmp_path, dl_url=f"{registry.url}/dl", index_url=f"{registry.url}/index")
+
+
+def test_fetch_stores_verified_archive(registry, store):
+    archive = make_crate("serde", "1.0.0")
+    registry.publish("serde", "1.0.0", archive)
+    crate = Crate(name="serde", version="1.0.0", fast_load=True)
+
+    assert store.get(crate) is None
+    path = store.fetch(crate)
+    assert path.read_bytes() == archive
+    assert path.name == f"{hashlib.sha256(archive).hexdigest()}.crate"
+    assert store.get(crate) == path
+
+    # Already stored: neither the index nor the archive are requested again
+    seen = len(registry.requests)
+    assert store.fetch(crate) == path
+    assert len(registry.requests) == seen
+
+
+def test_fetch_rejects_checksum_mismatch(registry, store):
+    registry.publish("log", "0.4.0", make_crate("log", "0.4.0"), cksum="0" * 64)
+    crate = Crate(name="log", version="0.4.0", fast_load=True)
+
+    with pytest.raises(ChecksumError):
+        store.fetch(crate)
+
+    assert store.get(crate) is None
+    # Neither the archive, its partial download nor a reference to it are left behind
+    assert [path for path in store.root.rglob("*") if path.is_file()] == []
+
+
+def test_prefetch_reports_missing_crates(registry, store):
+    registry.publish("rand", "0.8.5", make_crate("rand", "0.8.5"))
+    registry.publish("rand", "0.8.4", make_crate("rand", "0.8.4"))
+    crates = [Crate(name="rand", version=version, fast_load=True) for version in ("0.8.5", "0.8.4", "0.8.3")]
+
+    archives, failed = store.prefetch(crates)
+    assert len(archives) == 2
+    assert [crate.version for crate in failed] == ["0.8.3"]
+    # The index file of a crate is only read once
+    assert registry.requests.count(f"/index/{index_file_path('rand')}") == 1
@@ -0,0 +1,152 @@
+import struct
+from typing import List, Tuple
+
+import pytest
+
+from rustbinsign.binary import Binary
+from rustbinsign.profile_guess import guess_profile
+
+TEXT_ADDRESS = 0x1000
+
+# (body, has landing pads), laid out one after the other in .text
+Functions = List[Tuple[bytes, bool]]
+
+
+def make_functions(count: int, size: int = 32, landing_pads: int = 0, duplicated: int = 0) -> Functions:
+    """`count` distinct function bodies of `size` bytes, the last `duplicated` ones being copies of the first one."""
+    bodies = [i.to_bytes(4, "little") * (size // 4) for i in range(count - duplicated)]
+    bodies += [bodies[0]] * duplicated
+    return [(body, i < landing_pads) for i, body in enumerate(bodies)]
+
+
+def layout(functions: Functions) -> Tuple[bytes, List[Tuple[int, int, bool]]]:
+    """.text content, and the address, size and landing pads of each function."""
+    text, entries = b"", []
+    for body, has_landing_pads in functions:
+        entries.append((TEXT_ADDRESS + len(text), len(body), has_landing_pads))
+        text += body
+
+    return text, entries
+
+
+def make_elf(functions: Functions, rodata: bytes = b"") -> bytes:
+    """64-bit ELF file with a .text, a .rodata and an .eh_frame describing `functions`."""
+    text, entries = layout(functions)
+    # CIE with a "zLR" augmentation: LSDA and FDE pointers as absolute 4 bytes values
+    cie = b"\x00\x00\x00\x00" + b"\x01" + b"zLR\x00" + b"\x01\x78\x10" + b"\x02\x03\x03"
+    eh_frame = struct.pack("<I", len(cie)) + cie
+    for start, size, has_landing_pads in entries:
+        cie_pointer = len(eh_frame) + 4
+        fde = struct.pack("<IIIBI", cie_pointer, start, size, 4, 0x2000 if has_landing_pads else 0)
+        eh_frame += struct.pack("<I", len(fde)) + fde
+
+    eh_frame += b"\x00\x00\x00\x00"
+
+    names = [b"", b".text", b".rodata", b".eh_frame", b".shstrtab"]
+    shstrtab = b"\x00".join(names) + b"\x00"
+    name_offsets = [shstrtab.index(name + b"\x00") if name else 0 for name in names]
+    contents = [b"", text, rodata, eh_frame, shstrtab]
+
+    data, headers = bytearray(0x40), [b"\x00" * 0x40]
+    for i, content in enumerate(contents[1:], start=1):
+        offset = len(data)
+        address = TEXT_ADDRESS + offset - 0x40 if i < 4 else 0
+        section_type = 3 if i == 4 else 1  # SHT_STRTAB, SHT_PROGBITS
+        headers.append(struct.pack("<IIQQQQIIQQ", name_offsets[i], section_type, 0, address, offset, len(content),
+                                   0, 0, 1, 0))
+        data += content
+
+    shoff = len(data)
+    data += b"".join(headers)
+    data[:16] = b"\x7fELF\x02\x01\x01" + b"\x00" * 9
+    struct.pack_into("<Q", data, 0x28, shoff)
+    struct.pack_into("<HHH", data, 0x3A, 0x40, len(headers), 4)
+    return bytes(data)
+
+
+def make_pe(functions: Functions, rdata: bytes = b"") -> bytes:
+    """64-bit PE file with a .text, an .rdata and a .pdata describing `functions`."""
+    text, entries = layout(functions)
+    file_alignment = 0x200
+    # UNWIND_INFO of a function without, then with, an exception handler
+    unwind_infos = b"\x01\x00\x00\x00" + b"\x09\x00\x00\x00" + b"\x00" * 8
+    sections = [(b".text", text), (b".rdata", unwind_infos + rdata), (b".pdata", b"")]
+    rdata_address = TEXT_ADDRESS + -(-len(text) // 0x1000) * 0x1000
+    pdata = b"".join(
+        struct.pack("<III", start, start + size, rdata_address + (4 if has_landing_pads else 0))
+        for start, size, has_landing_pads in entries
+    )
+    sections[2] = (b".pdata", pdata)
+
+    pe_offset, optional_size = 0x80, 0xF0
+    headers_size = pe_offset + 24 + optional_size + 40 * len(sections)
+    data = bytearray(-(-headers_size // file_alignment) * file_alignment)
+    data[:2] = b"MZ"
+    struct.pack_into("<I", data, 0x3C, pe_offset)
+    data[pe_offset : pe_offset + 4] = b"PE\x00\x00"
+    struct.pack_into("<HH", data, pe_offset + 4, 0x8664, len(sections))
+    struct.pack_into("<H", data, pe_offset + 20, optional_size)
+    struct.pack_into("<H", data, pe_offset + 24, 0x20B)
+
+    address = TEXT_ADDRESS
+    for i, (name, content) in enumerate(sections):
+        raw_size = -(-len(content) // file_alignment) * file_alignment
+        struct.pack_into("<8sIIII", data, pe_offset + 24 + optional_size + i * 40, name, len(content), address,
+                         raw_size, len(data))
+        data += content.ljust(raw_size, b"\x00")
+        address += -(-len(content) // 0x1000) * 0x1000
+
+    return bytes(data)
+
+
+@pytest.fixture
+def write(tmp_path):
+    def write(name: str, content: bytes):
+        path = tmp_path.joinpath(name)
+        path.write_bytes(content)
+        return path
+
+    return write
+
+
+@pytest.mark.parametrize("make", [make_elf, make_pe])
+def test_fixtures_parse(write, make):
+    functions = make_functions(8, landing_pads=3)
+    parsed = Binary(write("target", make(functions))).functions()
+
+    assert [(f.start, f.size, f.has_landing_pads) for f in parsed] == layout(functions)[1]
+
+
+def test_elf_unwind_lto(write):
+    functions = make_functions(400, landing_pads=100)
+    guess = guess_profile(write("target", make_elf(functions, rodata=b"_Unwind_RaiseException\x00")))
+
+    assert (guess.panic, guess.lto, guess.opt_level, guess.codegen_units) == ("unwind", True, 3, None)
+
+
+def test_elf_abort_without_landing_pads(write):
+    functions = make_functions(400, duplicated=20)
+    guess = guess_profile(write("target", make_elf(functions, rodata=b"_Unwind_RaiseException\x00")))
+
+    assert (guess.panic, guess.lto) == ("abort", False)
+
+
+def test_pe_abort_without_unwinding_runtime(write):
+    # Landing pads come with the precompiled standard library, the runtime only with panic = "unwind"
+    functions = make_functions(400, size=24, landing_pads=100)
+    guess = guess_profile(write("target.exe", make_pe(functions)))
+
+    assert (guess.panic, guess.lto, guess.opt_level, guess.codegen_units) == ("abort", True, "z", 1)
+    assert guess.to_template() == {
+        "profile": {
+            "release": {"debug": 2, "strip": "none", "opt-level": "z", "panic": "abort", "lto": True,
+                        "codegen-units": 1}
+        }
+    }
+
+
+def test_pe_unwind_without_lto(write):
+    functions = make_functions(400, landing_pads=100, duplicated=20)
+    guess = guess_profile(write("target.exe", make_pe(functions, rdata=b"_CxxThrowException\x00")))
+
+    assert (guess.panic, guess.lto, guess.opt_level) == ("unwind", False, 3)